@@ -0,0 +1,162 @@
+"""
+Benchmark: API responsiveness while long LLM diagnoses are in flight.
+
+Starts a fake Ollama server (chunked NDJSON, one token every --token-delay seconds)
+and the backend (uvicorn, in-process) unless --base-url points to a running one,
+then fires --concurrency streamed and plain diagnoses at once while polling
+GET /api/anomaly/status. With the async LLM clients the probe latency under load
+stays close to the idle latency.
+
+Usage (from backend/):
+    python -m benchmarks.bench_llm_concurrency --concurrency 32 --tokens 40
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+def start_fake_ollama(port: int, tokens: int, token_delay: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _chunk(self, data: bytes):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not body.get("stream"):
+                time.sleep(tokens * token_delay)
+                data = json.dumps({"response": "token " * tokens, "done": True}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for _ in range(tokens):
+                self._chunk((json.dumps({"response": "token ", "done": False}) + "\n").encode())
+                time.sleep(token_delay)
+            self._chunk((json.dumps({"response": "", "done": True, "eval_count": tokens}) + "\n").encode())
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_backend(port: int):
+    import uvicorn
+
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def _diagnose(client: httpx.AsyncClient, stream: bool, config: dict) -> float:
+    body = {"query": "Why did the power spike?", "provider": "ollama", "config": config}
+    t0 = time.perf_counter()
+    if stream:
+        async with client.stream("POST", "/api/diagnosis/analyze/stream", json=body) as r:
+            async for _ in r.aiter_lines():
+                pass
+    else:
+        r = await client.post("/api/diagnosis/analyze", json=body)
+        r.raise_for_status()
+    return time.perf_counter() - t0
+
+
+async def _probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> list:
+    latencies = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        r = await client.get("/api/anomaly/status")
+        r.raise_for_status()
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def _summary(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        "n": len(values),
+        "median_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+async def run(args) -> dict:
+    config = {"url": f"http://127.0.0.1:{args.ollama_port}", "model": "bench"}
+    limits = httpx.Limits(max_connections=args.concurrency + 8)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=300, limits=limits) as client:
+        stop = asyncio.Event()
+        idle_task = asyncio.create_task(_probe(client, stop, args.probe_interval))
+        await asyncio.sleep(1.0)
+        stop.set()
+        idle = await idle_task
+
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(_probe(client, stop, args.probe_interval))
+        t0 = time.perf_counter()
+        durations = await asyncio.gather(
+            *(_diagnose(client, i % 2 == 0, config) for i in range(args.concurrency))
+        )
+        wall = time.perf_counter() - t0
+        stop.set()
+        loaded = await probe_task
+
+    return {
+        "concurrency": args.concurrency,
+        "expected_generation_s": round(args.tokens * args.token_delay, 2),
+        "diagnoses_wall_s": round(wall, 2),
+        "diagnosis_latency": _summary(durations),
+        "status_probe_idle": _summary(idle),
+        "status_probe_under_load": _summary(loaded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API responsiveness under concurrent LLM diagnoses")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per fake generation")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="seconds between fake tokens")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--ollama-port", type=int, default=18434)
+    parser.add_argument("--backend-port", type=int, default=18000)
+    parser.add_argument("--base-url", default=None, help="running backend; default: start one in-process")
+    args = parser.parse_args()
+
+    start_fake_ollama(args.ollama_port, args.tokens, args.token_delay)
+    if args.base_url is None:
+        start_backend(args.backend_port)
+        args.base_url = f"http://127.0.0.1:{args.backend_port}"
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark: XLSX import on dati_test/Termoformatrice4.xlsx scaled up to N rows.
+
+Times separately:
+  - parse:     pd.read_excel of a scaled workbook (only with --write-xlsx, slow to generate)
+  - transform: DataFrame -> normalized columns/records, legacy row loop vs vectorized
+
+Usage (from backend/):
+    python -m benchmarks.bench_xlsx_import --rows 200000 [--write-xlsx]
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from modules.anomaly_detection.xlsx_importer import (
+    COL_MAP,
+    _build_timestamp,
+    _first_present,
+    _normalize_col,
+    _read_excel,
+    columns_to_records,
+    frame_to_columns,
+)
+
+SAMPLE = Path(__file__).resolve().parents[2] / "dati_test" / "Termoformatrice4.xlsx"
+
+
+def _legacy_to_float(val):
+    if val is None:
+        return None
+    try:
+        if isinstance(val, str):
+            v = val.strip().replace(",", ".")
+            if v == "":
+                return None
+            return float(v)
+        return float(val)
+    except Exception:
+        return None
+
+
+def legacy_transform(df: pd.DataFrame, electrical_mode: str = "three_phase"):
+    """Reference: the previous per-row implementation (iterrows + per-cell parsing)."""
+    _, detected = _first_present(COL_MAP, {_normalize_col(c): c for c in df.columns})
+    ts = _build_timestamp(df, detected["date"], detected["time"])
+    df = df.assign(_timestamp=ts).dropna(subset=["_timestamp"]).copy()
+    df["_timestamp_epoch"] = (df["_timestamp"] - pd.Timestamp(0)) / pd.Timedelta(seconds=1)
+    df = df.sort_values("_timestamp_epoch")
+    scale = math.sqrt(3.0) if electrical_mode == "three_phase" else 1.0
+    out = []
+    for _, row in df.iterrows():
+        rec = {"timestamp": _legacy_to_float(row["_timestamp_epoch"])}
+        for key in ("voltage_v", "current_a", "power_factor", "power_kw", "energy_total_kwh",
+                    "energy_grid_kwh", "energy_self_kwh", "reactive_varh"):
+            rec[key] = _legacy_to_float(row.get(detected.get(key))) if detected.get(key) else None
+        if rec["power_kw"] is None and None not in (rec["voltage_v"], rec["current_a"], rec["power_factor"]):
+            rec["power_kw"] = scale * rec["voltage_v"] * rec["current_a"] * rec["power_factor"] / 1000.0
+        rec["power"] = rec["power_kw"]
+        out.append(rec)
+    return out
+
+
+def scaled_frame(rows: int) -> pd.DataFrame:
+    """Tile the sample sheet to `rows` rows with consecutive hourly dates."""
+    base = pd.read_excel(SAMPLE)
+    reps = max(1, math.ceil(rows / len(base)))
+    df = pd.concat([base] * reps, ignore_index=True).iloc[:rows].copy()
+    start = pd.Timestamp("2020-01-01")
+    stamps = start + pd.to_timedelta(range(rows), unit="h")
+    df["Data"] = stamps.date
+    df["Ora"] = stamps.time
+    # Half of the numeric cells as comma-decimal strings, as exported by some panels
+    col = "Tensione (V)"
+    df[col] = df[col].astype(object)
+    df.loc[df.index % 2 == 0, col] = df.loc[df.index % 2 == 0, col].map(lambda v: str(v).replace(".", ","))
+    return df
+
+
+def _timed(fn, *args, **kwargs):
+    t = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--write-xlsx", action="store_true", help="also write the scaled workbook and time parsing")
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    df = scaled_frame(args.rows)
+    print(f"rows: {len(df)}")
+
+    (columns, summary), t_cols = _timed(frame_to_columns, df, max_rows=args.rows)
+    records, t_recs = _timed(columns_to_records, columns)
+    print(f"vectorized: columns {t_cols:.3f}s + records {t_recs:.3f}s ({summary.rows_imported} rows)")
+
+    if not args.skip_legacy:
+        legacy, t_legacy = _timed(legacy_transform, df)
+        print(f"legacy row loop: {t_legacy:.3f}s ({len(legacy)} rows) -> speedup x{t_legacy / (t_cols + t_recs):.1f}")
+
+    if args.write_xlsx:
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            _, t_write = _timed(df.to_excel, path, index=False)
+            print(f"wrote scaled workbook in {t_write:.1f}s")
+            _, t_read = _timed(_read_excel, path)
+            print(f"parse (read_excel): {t_read:.3f}s")
+        finally:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
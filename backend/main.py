@@ -8,12 +8,22 @@ from modules.anomaly_detection.router import router as anomaly_router
 from modules.guided_diagnosis.router import router as diagnosis_router
 from modules.guided_diagnosis.config_router import router as llm_config_router
 from modules.anomaly_detection.database import init_database
+from modules.anomaly_detection.scheduler import ml_scheduler
+from modules.anomaly_detection.import_jobs import import_jobs
+from modules.anomaly_detection.similarity_index import similarity_index
+from modules.anomaly_detection import text_search
 from modules.realtime.database import init_database as init_realtime_db
 from modules.realtime.collector import collector
+from modules.realtime.downtime import downtime_tracker
 from modules.realtime.router import router as realtime_router
 from modules.realtime.config_store import init_db as init_realtime_config_db
 from modules.realtime.config_router import router as realtime_config_router
 from modules.guided_diagnosis.config_store import init_db as init_llm_config_db
+from modules.guided_diagnosis.manual_index import manual_index
+from modules.guided_diagnosis.http_pool import close_http_client
+from modules.guided_diagnosis.response_cache import response_cache
+from modules.guided_diagnosis.anomaly_context import anomaly_context_cache
+from modules.guided_diagnosis.llm_client import LLM_PREWARM, prewarm_configured_model
 
 # Configure logging
 logging.basicConfig(
@@ -32,19 +42,36 @@ async def lifespan(app: FastAPI):
     init_database()
     init_realtime_db()
     init_llm_config_db()
+    manual_index.init_db()
+    response_cache.init_db()
+    anomaly_context_cache.init_db()
     init_realtime_config_db()
+    text_search.init_db()
+    # Similar-incident vectors: backfilled once for events stored before the index
+    await asyncio.to_thread(similarity_index.load)
     logger.info("📦 Database initialized")
     
     # Start background tasks
     collector_task = await collector.start()
+    ml_scheduler_task = await ml_scheduler.start()
+    downtime_task = await downtime_tracker.start()
+    await anomaly_context_cache.start()
+    prewarm_task = asyncio.create_task(prewarm_configured_model()) if LLM_PREWARM else None
     logger.info("✅ All services started")
     
     yield  # Application runs here
     
     # Shutdown
     logger.info("🛑 WR-AI Backend Shutting down...")
-    # Ensure collector loop is stopped and connections closed
+    # Ensure background loops are stopped and connections closed
+    await ml_scheduler.stop()
+    await downtime_tracker.stop()
+    await anomaly_context_cache.stop()
+    if prewarm_task is not None and not prewarm_task.done():
+        prewarm_task.cancel()
     await collector.stop()
+    import_jobs.shutdown()
+    await close_http_client()
 
 app = FastAPI(lifespan=lifespan)
 
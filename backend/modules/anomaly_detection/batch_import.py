@@ -0,0 +1,292 @@
+"""
+Batch import - parse a folder (or glob) of workbooks in parallel worker processes,
+merge the results per device and deduplicate them by (device, timestamp).
+
+Every file is parsed with the XLSX importer in its own process (through the import
+cache, so unchanged files are not parsed twice). The device is taken from the
+file name, e.g. "Termoformatrice4_2024-03-01.xlsx" -> "Termoformatrice4".
+
+CLI (from backend/):
+    python -m modules.anomaly_detection.batch_import "data/*.xlsx" --workers 8 --persist
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .import_cache import cache_key, file_digest, import_cache
+from .xlsx_importer import import_termoformatrice_columns, merge_columns
+
+logger = logging.getLogger(__name__)
+
+# File stem up to an optional trailing date (YYYY-MM-DD, YYYYMMDD, ...)
+DEFAULT_DEVICE_PATTERN = r"^(?P<device>.+?)(?:[_\- .]+\d{4}-?\d{2}-?\d{2}.*)?$"
+DEFAULT_FILE_PATTERN = "*.xlsx"
+
+# Rows per executemany transaction when persisting merged samples
+PERSIST_BATCH_ROWS = 100_000
+
+# Directory that API batch imports may read from (the CLI is not restricted)
+IMPORT_BATCH_ROOT = os.getenv("IMPORT_BATCH_ROOT", str(Path(__file__).resolve().parents[2] / "data"))
+
+
+def _within(path: Path, root: Path) -> bool:
+    try:
+        path.resolve().relative_to(root)
+        return True
+    except ValueError:
+        return False
+
+
+def resolve_source(source: str, pattern: str = DEFAULT_FILE_PATTERN, root: Optional[str] = None) -> str:
+    """
+    Absolute batch source for a client-supplied directory/glob: relative sources
+    are taken under the import root, and anything outside it raises ValueError.
+    """
+    root_path = Path(root or IMPORT_BATCH_ROOT).resolve()
+    pattern_path = Path(pattern or DEFAULT_FILE_PATTERN)
+    if pattern_path.is_absolute() or ".." in pattern_path.parts:
+        raise ValueError("Batch import pattern must be relative to the source directory")
+    path = Path(source or ".")
+    if not path.is_absolute():
+        path = root_path / path
+    # For a glob, the directory part before the first wildcard must be under the root
+    prefix = re.split(r"[*?\[]", str(path), maxsplit=1)[0]
+    if ".." in path.parts or not _within(Path(prefix or root_path), root_path):
+        raise ValueError(f"Batch import source must be under {root_path}")
+    return str(path)
+
+
+def resolve_files(source: str, pattern: str = DEFAULT_FILE_PATTERN, root: Optional[str] = None) -> List[str]:
+    """
+    Workbooks in a directory (matching pattern, '**' for recursion) or matching a glob;
+    with root, files resolving outside it (symlinks) are left out.
+    """
+    path = Path(source)
+    if path.is_dir():
+        candidates = path.glob(pattern)
+    else:
+        candidates = glob.glob(source, recursive=True)
+    files = [Path(p) for p in candidates]
+    if root is not None:
+        root_path = Path(root).resolve()
+        files = [p for p in files if _within(p, root_path)]
+    # "~$name.xlsx" are Office lock files of open workbooks
+    return sorted(str(p) for p in files if p.is_file() and not p.name.startswith("~$"))
+
+
+def device_from_path(file_path: str, pattern: str = DEFAULT_DEVICE_PATTERN) -> str:
+    stem = Path(file_path).stem
+    match = re.match(pattern, stem)
+    if match and match.groupdict().get("device"):
+        return match.group("device")
+    return stem
+
+
+def parse_workbook(
+    file_path: str,
+    electrical_mode: str = "three_phase",
+    max_rows: int = 200_000,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """Worker process entry point: never raises, failures are reported in "error"."""
+    t0 = time.perf_counter()
+    out: Dict[str, Any] = {"file": file_path, "pid": os.getpid(), "cache_hit": False, "error": None}
+    try:
+        key = cache_key(file_digest(file_path), electrical_mode, max_rows) if use_cache else None
+        cached = import_cache.get(key) if key else None
+        if cached is not None:
+            columns, summary = cached
+            out["cache_hit"] = True
+        else:
+            columns, summary = import_termoformatrice_columns(
+                file_path, max_rows=max_rows, electrical_mode=electrical_mode
+            )
+            if key:
+                import_cache.put(key, columns, summary)
+        out["columns"] = columns
+        out["summary"] = asdict(summary)
+    except Exception as e:
+        out["error"] = str(e)
+    out["elapsed_s"] = time.perf_counter() - t0
+    return out
+
+
+def _dedupe(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Keep the first row of every timestamp (columns sorted by timestamp, stable)."""
+    ts = columns["timestamp"]
+    if len(ts) < 2:
+        return columns
+    keep = np.ones(len(ts), dtype=bool)
+    keep[1:] = ts[1:] != ts[:-1]
+    return {k: v[keep] for k, v in columns.items()}
+
+
+def run_batch_import(
+    source: str,
+    pattern: str = DEFAULT_FILE_PATTERN,
+    workers: Optional[int] = None,
+    electrical_mode: str = "three_phase",
+    max_rows: int = 200_000,
+    device_pattern: str = DEFAULT_DEVICE_PATTERN,
+    use_cache: bool = True,
+    persist: bool = False,
+    on_file_done: Optional[Callable[[int, int], None]] = None,
+    root: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Parse all matching files on a process pool, merge per device and deduplicate.
+    With persist, merged samples (payload "device" set) are written to the realtime
+    samples store, skipping (device, timestamp) pairs already stored.
+    on_file_done(files_done, files_total) is called as files complete; an exception
+    raised from it cancels the files not yet started. With root, only files under
+    that directory are read.
+
+    Returns {"report": ..., "merged": {device: columns}}.
+    """
+    files = resolve_files(source, pattern, root=root)
+    if not files:
+        raise ValueError(f"No files found for '{source}' (pattern '{pattern}')")
+    workers = max(1, min(len(files), workers or os.cpu_count() or 1))
+
+    t0 = time.perf_counter()
+    results: Dict[str, Dict[str, Any]] = {}
+    # spawn: the pool may be started from a server thread, where fork is unsafe
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [
+            executor.submit(parse_workbook, path, electrical_mode, max_rows, use_cache) for path in files
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["file"]] = result
+            if on_file_done:
+                on_file_done(len(results), len(files))
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    parse_done = time.perf_counter()
+
+    # Merge in file order, so the kept duplicate does not depend on completion order
+    parts: Dict[str, List[Dict[str, np.ndarray]]] = {}
+    file_reports: List[Dict[str, Any]] = []
+    for path in files:
+        result = results[path]
+        device = device_from_path(path, device_pattern)
+        summary = result.get("summary") or {}
+        file_reports.append(
+            {
+                "file": Path(path).name,
+                "device": device,
+                "status": "failed" if result["error"] else "success",
+                "rows_total": summary.get("rows_total"),
+                "rows_imported": summary.get("rows_imported"),
+                "timestamp_min": summary.get("timestamp_min"),
+                "timestamp_max": summary.get("timestamp_max"),
+                "cache_hit": result["cache_hit"],
+                "elapsed_s": round(result["elapsed_s"], 3),
+                "worker_pid": result["pid"],
+                "error": result["error"],
+            }
+        )
+        if result["error"]:
+            logger.warning(f"Batch import: {path} failed: {result['error']}")
+        elif result["columns"]:
+            parts.setdefault(device, []).append(result["columns"])
+
+    merged: Dict[str, Dict[str, np.ndarray]] = {}
+    devices: Dict[str, Dict[str, Any]] = {}
+    for device, device_parts in parts.items():
+        combined = merge_columns(device_parts)
+        columns = _dedupe(combined)
+        merged[device] = columns
+        ts = columns["timestamp"]
+        devices[device] = {
+            "files": len(device_parts),
+            "rows": int(len(ts)),
+            "duplicates_removed": int(len(combined["timestamp"]) - len(ts)),
+            "timestamp_min": float(ts[0]) if len(ts) else None,
+            "timestamp_max": float(ts[-1]) if len(ts) else None,
+        }
+
+    persisted = 0
+    if persist:
+        # Lazy import: realtime storage is owned by the realtime module
+        from modules.realtime.database import save_samples_bulk
+        from modules.realtime.ingest import payloads_json
+
+        for device, columns in merged.items():
+            for start in range(0, len(columns["timestamp"]), PERSIST_BATCH_ROWS):
+                part = {k: v[start:start + PERSIST_BATCH_ROWS] for k, v in columns.items()}
+                persisted += save_samples_bulk(
+                    list(zip(part["timestamp"].tolist(), payloads_json(part, device=device))),
+                    skip_duplicates=True,
+                )
+
+    wall = time.perf_counter() - t0
+    parse_total = sum(r["elapsed_s"] for r in results.values())
+    parse_wall = parse_done - t0
+    report = {
+        "source": source,
+        "workers": workers,
+        "files_total": len(files),
+        "files_ok": sum(1 for r in file_reports if r["status"] == "success"),
+        "files_failed": sum(1 for r in file_reports if r["status"] == "failed"),
+        "devices": devices,
+        "samples_persisted": persisted,
+        "wall_s": round(wall, 3),
+        "parse_wall_s": round(parse_wall, 3),
+        "parse_cpu_s": round(parse_total, 3),
+        "parallel_speedup": round(parse_total / parse_wall, 2) if parse_wall > 0 else None,
+        "files": file_reports,
+    }
+    return {"report": report, "merged": merged}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel batch import of XLSX workbooks")
+    parser.add_argument("source", help="directory or glob pattern")
+    parser.add_argument("--pattern", default=DEFAULT_FILE_PATTERN, help="file pattern inside a directory")
+    parser.add_argument("--workers", type=int, default=None, help="default: CPU count")
+    parser.add_argument("--electrical-mode", choices=("three_phase", "single_phase"), default="three_phase")
+    parser.add_argument("--max-rows", type=int, default=200_000, help="per file")
+    parser.add_argument("--device-pattern", default=DEFAULT_DEVICE_PATTERN)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--persist", action="store_true", help="store merged samples in the realtime DB")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.persist:
+        from modules.realtime.database import init_database
+
+        init_database()
+
+    out = run_batch_import(
+        args.source,
+        pattern=args.pattern,
+        workers=args.workers,
+        electrical_mode=args.electrical_mode,
+        max_rows=args.max_rows,
+        device_pattern=args.device_pattern,
+        use_cache=not args.no_cache,
+        persist=args.persist,
+    )
+    print(json.dumps(out["report"], indent=2))
+    raise SystemExit(1 if out["report"]["files_failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
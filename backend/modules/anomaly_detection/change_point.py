@@ -0,0 +1,105 @@
+"""
+Change-point detection - regime changes (recipe change, maintenance, drift onset)
+over one or more signals.
+
+Binary segmentation with a Gaussian cost computed from cumulative sums: the cost of
+every candidate split of a segment is evaluated at once with array operations, so a
+segment of length L costs O(L) and the whole search is ~O(n log n).
+"""
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+COSTS = ('normal_meanvar', 'normal_mean')
+
+
+class _CumulativeCost:
+    """Segment costs for a (n_signals, n) array from prefix sums of x and x^2"""
+
+    def __init__(self, x: np.ndarray, cost: str):
+        if cost not in COSTS:
+            raise ValueError(f'Unknown cost: {cost}. Available: {list(COSTS)}')
+        self.cost = cost
+        zeros = np.zeros((x.shape[0], 1))
+        self.s1 = np.concatenate((zeros, np.cumsum(x, axis=1)), axis=1)
+        self.s2 = np.concatenate((zeros, np.cumsum(x * x, axis=1)), axis=1)
+        # Floor for the variance of (near) flat segments, relative to the standardized scale
+        self.min_var = 1e-6
+
+    def __call__(self, start, end) -> np.ndarray:
+        """Cost of [start, end) summed over signals; start/end may be arrays"""
+        start, end = np.atleast_1d(start), np.atleast_1d(end)
+        n = (end - start).astype(float)
+        s1 = self.s1[:, end] - self.s1[:, start]
+        s2 = self.s2[:, end] - self.s2[:, start]
+        if self.cost == 'normal_mean':
+            return np.sum(s2 - s1 * s1 / n, axis=0)
+        var = np.maximum(s2 / n - (s1 / n) ** 2, self.min_var)
+        return np.sum(n * np.log(var), axis=0)
+
+
+def binary_segmentation(
+    x: np.ndarray,
+    penalty: Optional[float] = None,
+    min_size: int = 30,
+    max_change_points: int = 50,
+    cost: str = 'normal_meanvar'
+) -> List[Tuple[int, float]]:
+    """
+    Args:
+        x: Array (n_signals, n) of standardized signals
+        penalty: Minimum cost reduction to accept a split (default BIC-like p * log(n))
+        min_size: Minimum segment length in samples
+        max_change_points: Upper bound on the number of change points returned
+        cost: 'normal_meanvar' (mean and variance change) or 'normal_mean' (mean shift)
+
+    Returns:
+        Sorted list of (change point index, cost reduction)
+    """
+    n_signals, n = x.shape
+    if penalty is None:
+        params_per_segment = 2 if cost == 'normal_meanvar' else 1
+        penalty = params_per_segment * n_signals * np.log(max(n, 2))
+    seg_cost = _CumulativeCost(x, cost)
+
+    def best_split(start: int, end: int) -> Optional[Tuple[float, int]]:
+        if end - start < 2 * min_size:
+            return None
+        splits = np.arange(start + min_size, end - min_size + 1)
+        gains = seg_cost(start, end) - seg_cost(start, splits) - seg_cost(splits, end)
+        i = int(np.argmax(gains))
+        return float(gains[i]), int(splits[i])
+
+    # Always split the segment with the largest gain first
+    heap: List[Tuple[float, int, int, int]] = []
+
+    def push(start: int, end: int):
+        found = best_split(start, end)
+        if found and found[0] > penalty:
+            heapq.heappush(heap, (-found[0], found[1], start, end))
+
+    push(0, n)
+    change_points: List[Tuple[int, float]] = []
+    while heap and len(change_points) < max_change_points:
+        neg_gain, split, start, end = heapq.heappop(heap)
+        change_points.append((split, -neg_gain))
+        push(start, split)
+        push(split, end)
+    return sorted(change_points)
+
+
+def segment_stats(raw: np.ndarray, bounds: List[int]) -> List[Dict[str, np.ndarray]]:
+    """Per-segment mean/std/min/max of each signal for segments [bounds[i], bounds[i+1])"""
+    starts = np.asarray(bounds[:-1])
+    lengths = np.diff(bounds)
+    sums = np.add.reduceat(raw, starts, axis=1)
+    sq_sums = np.add.reduceat(raw * raw, starts, axis=1)
+    mins = np.minimum.reduceat(raw, starts, axis=1)
+    maxs = np.maximum.reduceat(raw, starts, axis=1)
+    means = sums / lengths
+    stds = np.sqrt(np.maximum(sq_sums / lengths - means ** 2, 0.0))
+    return [
+        {'mean': means[:, i], 'std': stds[:, i], 'min': mins[:, i], 'max': maxs[:, i]}
+        for i in range(len(starts))
+    ]
@@ -6,7 +6,7 @@ import sqlite3
 import json
 import logging
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
@@ -14,6 +14,21 @@ logger = logging.getLogger(__name__)
 # Database file path
 DB_PATH = Path(__file__).parent / "anomaly_data.db"
 
+# Hot fields of anomaly_events kept as typed columns (filtered and listed
+# without parsing the details JSON): name -> SQL type
+EVENT_COLUMNS = {
+    'source': 'TEXT',
+    'primary_signal': 'TEXT',
+    'max_sigma': 'REAL',
+    'risk_score': 'REAL',
+    'ml_score': 'REAL',
+    'temperature': 'REAL',
+    'vibration': 'REAL',
+    'power': 'REAL',
+}
+# Rows of anomaly_events migrated per batch when the typed columns are added
+MIGRATION_BATCH = 5000
+
 
 @contextmanager
 def get_db_connection():
@@ -55,28 +70,156 @@ def init_database():
             )
         ''')
         
+        # Deviating signals of each event (one row per signal, for signal filters)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS anomaly_event_signals (
+                event_id INTEGER NOT NULL,
+                signal TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                direction TEXT,
+                sigma REAL,
+                value REAL,
+                PRIMARY KEY (event_id, signal),
+                FOREIGN KEY (event_id) REFERENCES anomaly_events(id)
+            )
+        ''')
+        
+        # Feature vectors of anomaly events (similar-incident index, see similarity_index)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS anomaly_event_vectors (
+                event_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                FOREIGN KEY (event_id) REFERENCES anomaly_events(id)
+            )
+        ''')
+        
+        # Scheduled ML jobs state (incremental watermark per job)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ml_job_state (
+                job_name TEXT PRIMARY KEY,
+                last_sample_id INTEGER NOT NULL DEFAULT 0,
+                last_run_at REAL,
+                last_trained_at REAL
+            )
+        ''')
+        
+        _migrate_event_columns(cursor)
+        
+        # Keyset pagination walks (timestamp, id); chats are read per anomaly
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_anomaly_events_ts ON anomaly_events(timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_anomaly_events_type_ts ON anomaly_events(type, timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_anomaly_event_signals_ts ON anomaly_event_signals(signal, timestamp, event_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_anomaly_chats_anomaly ON anomaly_chats(anomaly_id, id)')
+        
         conn.commit()
         logger.info(f"Database initialized at {DB_PATH}")
 
 
+def _typed_fields(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Typed column values and deviating signals of an event, from its details"""
+    details = event.get('details') or {}
+    if not isinstance(details, dict):
+        details = {}
+    values = details.get('values') if isinstance(details.get('values'), dict) else details
+    
+    signals = []
+    for name, info in (details.get('anomalies') or {}).items():
+        if not isinstance(info, dict):
+            continue
+        signals.append((name, info.get('type'), _as_float(info.get('deviation_sigma')), _as_float(info.get('value'))))
+    primary = max(signals, key=lambda s: s[2] or 0.0) if signals else None
+    
+    fields = {
+        'source': details.get('source') or 'statistical',
+        'primary_signal': primary[0] if primary else None,
+        'max_sigma': primary[2] if primary else None,
+        'risk_score': _as_float(details.get('anomaly_score')),
+        'ml_score': _as_float(details.get('ml_score', details.get('score'))),
+        'temperature': _as_float(values.get('temperature')),
+        'vibration': _as_float(values.get('vibration')),
+        'power': _as_float(values.get('power', values.get('power_kw'))),
+    }
+    return {'fields': fields, 'signals': signals}
+
+
+def _as_float(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _write_signals(cursor, event_id: int, timestamp: float, signals: List[tuple]):
+    cursor.executemany('''
+        INSERT OR REPLACE INTO anomaly_event_signals (event_id, signal, timestamp, direction, sigma, value)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(event_id, name, timestamp, direction, sigma, value) for name, direction, sigma, value in signals])
+
+
+def _migrate_event_columns(cursor):
+    """Add the typed columns to an existing anomaly_events table and fill them from details"""
+    existing = {row['name'] for row in cursor.execute('PRAGMA table_info(anomaly_events)')}
+    missing = [name for name in EVENT_COLUMNS if name not in existing]
+    for name in missing:
+        cursor.execute(f'ALTER TABLE anomaly_events ADD COLUMN {name} {EVENT_COLUMNS[name]}')
+    if not missing:
+        return
+    
+    assignments = ", ".join(f"{name} = ?" for name in EVENT_COLUMNS)
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = cursor.execute('''
+            SELECT id, timestamp, details FROM anomaly_events WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, MIGRATION_BATCH)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            try:
+                details = json.loads(row['details']) if row['details'] else {}
+            except ValueError:
+                details = {}
+            typed = _typed_fields({'details': details})
+            cursor.execute(
+                f'UPDATE anomaly_events SET {assignments} WHERE id = ?',
+                [*typed['fields'].values(), row['id']]
+            )
+            _write_signals(cursor, row['id'], row['timestamp'], typed['signals'])
+        last_id = rows[-1]['id']
+        migrated += len(rows)
+    if migrated:
+        logger.info(f"Migrated {migrated} anomaly events to typed signal columns")
+
+
 def save_anomaly_event(event: Dict[str, Any]) -> int:
     """
-    Save an anomaly event to the database
+    Save an anomaly event to the database, with its similar-incident vector
     Returns the inserted event ID
     """
+    # Lazy import to avoid a cycle (the index reads events through this module)
+    from .similarity_index import similarity_index, store_vector
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO anomaly_events (timestamp, type, message, details)
-            VALUES (?, ?, ?, ?)
+        typed = _typed_fields(event)
+        columns = ", ".join(EVENT_COLUMNS)
+        placeholders = ", ".join("?" * len(EVENT_COLUMNS))
+        cursor.execute(f'''
+            INSERT INTO anomaly_events (timestamp, type, message, details, {columns})
+            VALUES (?, ?, ?, ?, {placeholders})
         ''', (
             event.get('timestamp'),
             event.get('type'),
             event.get('message'),
-            json.dumps(event.get('details', {}))
+            json.dumps(event.get('details', {})),
+            *typed['fields'].values()
         ))
-        conn.commit()
         event_id = cursor.lastrowid
+        _write_signals(cursor, event_id, event.get('timestamp'), typed['signals'])
+        vector = store_vector(cursor, event_id, event)
+        conn.commit()
+        similarity_index.add(event_id, vector)
         logger.info(f"Saved anomaly event {event_id}: {event.get('type')}")
         return event_id
 
@@ -105,6 +248,96 @@ def get_anomaly_events(limit: int = 100) -> List[Dict[str, Any]]:
         return events
 
 
+def encode_cursor(timestamp: float, event_id: int) -> str:
+    return f"{timestamp!r}:{int(event_id)}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """(timestamp, id) of a cursor returned by query_anomaly_events; ValueError if malformed"""
+    timestamp, _, event_id = (cursor or "").rpartition(":")
+    return float(timestamp), int(event_id)
+
+
+def query_anomaly_events(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    types: Optional[List[str]] = None,
+    ts_from: Optional[float] = None,
+    ts_to: Optional[float] = None,
+    signal: Optional[str] = None,
+    min_sigma: Optional[float] = None,
+    ascending: bool = False,
+    with_details: bool = False,
+) -> Dict[str, Any]:
+    """
+    One page of anomaly events, newest first (oldest first with ascending), and
+    the cursor of the next page. Pages are keyset-paginated on (timestamp, id),
+    so each page costs the same regardless of its depth. signal keeps events
+    where that signal deviated (min_sigma: by at least that many σ).
+    """
+    where = []
+    params: List[Any] = []
+    if signal:
+        # Walk the per-signal index in time order, joined to the events
+        source = 'anomaly_event_signals s JOIN anomaly_events e ON e.id = s.event_id'
+        ts_col, id_col = 's.timestamp', 's.event_id'
+        where.append('s.signal = ?')
+        params.append(signal)
+        if min_sigma is not None:
+            where.append('s.sigma >= ?')
+            params.append(float(min_sigma))
+    else:
+        source = 'anomaly_events e'
+        ts_col, id_col = 'e.timestamp', 'e.id'
+        if min_sigma is not None:
+            where.append('e.max_sigma >= ?')
+            params.append(float(min_sigma))
+    if types:
+        where.append(f"e.type IN ({','.join('?' * len(types))})")
+        params.extend(t.upper() for t in types)
+    if ts_from is not None:
+        where.append(f'{ts_col} >= ?')
+        params.append(float(ts_from))
+    if ts_to is not None:
+        where.append(f'{ts_col} <= ?')
+        params.append(float(ts_to))
+    if cursor:
+        where.append(f"({ts_col}, {id_col}) {'>' if ascending else '<'} (?, ?)")
+        params.extend(decode_cursor(cursor))
+    order = 'ASC' if ascending else 'DESC'
+    columns = ", ".join(f"e.{name}" for name in EVENT_COLUMNS)
+    
+    with get_db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT e.id, e.timestamp, e.type, e.message, e.created_at, {columns}
+                   {', e.details' if with_details else ''}
+            FROM {source}
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY {ts_col} {order}, {id_col} {order}
+            LIMIT ?
+        ''', [*params, int(limit) + 1]).fetchall()
+    
+    events = []
+    for row in rows[:limit]:
+        event = {
+            'id': row['id'],
+            'timestamp': row['timestamp'],
+            'type': row['type'],
+            'message': row['message'],
+            'created_at': row['created_at'],
+            **{name: row[name] for name in EVENT_COLUMNS}
+        }
+        if with_details:
+            event['details'] = json.loads(row['details']) if row['details'] else {}
+        events.append(event)
+    has_more = len(rows) > limit
+    return {
+        'events': events,
+        'next_cursor': encode_cursor(events[-1]['timestamp'], events[-1]['id']) if has_more else None,
+        'has_more': has_more
+    }
+
+
 def get_anomaly_event_by_id(event_id: int) -> Optional[Dict[str, Any]]:
     """Get a specific anomaly event by ID"""
     with get_db_connection() as conn:
@@ -128,6 +361,33 @@ def get_anomaly_event_by_id(event_id: int) -> Optional[Dict[str, Any]]:
         return None
 
 
+def get_anomaly_events_by_ids(event_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Events by ID (without details), for listing search results"""
+    if not event_ids:
+        return {}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(event_ids))
+        cursor.execute(f'''
+            SELECT e.id, e.timestamp, e.type, e.message, e.created_at,
+                   (SELECT COUNT(*) FROM anomaly_chats c WHERE c.anomaly_id = e.id) AS chat_messages
+            FROM anomaly_events e
+            WHERE e.id IN ({placeholders})
+        ''', [int(i) for i in event_ids])
+        
+        return {
+            row['id']: {
+                'id': row['id'],
+                'timestamp': row['timestamp'],
+                'type': row['type'],
+                'message': row['message'],
+                'created_at': row['created_at'],
+                'chat_messages': row['chat_messages']
+            }
+            for row in cursor.fetchall()
+        }
+
+
 def save_chat_message(anomaly_id: int, role: str, content: str) -> int:
     """Save a chat message linked to an anomaly"""
     with get_db_connection() as conn:
@@ -150,7 +410,7 @@ def get_chat_history(anomaly_id: int) -> List[Dict[str, Any]]:
             SELECT id, role, content, created_at
             FROM anomaly_chats
             WHERE anomaly_id = ?
-            ORDER BY created_at ASC
+            ORDER BY id ASC
         ''', (anomaly_id,))
         
         messages = []
@@ -164,11 +424,56 @@ def get_chat_history(anomaly_id: int) -> List[Dict[str, Any]]:
         return messages
 
 
+def get_ml_job_state(job_name: str) -> Optional[Dict[str, Any]]:
+    """Get the stored watermark/state of a scheduled ML job"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT job_name, last_sample_id, last_run_at, last_trained_at
+            FROM ml_job_state
+            WHERE job_name = ?
+        ''', (job_name,))
+        
+        row = cursor.fetchone()
+        if row:
+            return {
+                'job_name': row['job_name'],
+                'last_sample_id': row['last_sample_id'],
+                'last_run_at': row['last_run_at'],
+                'last_trained_at': row['last_trained_at']
+            }
+        return None
+
+
+def save_ml_job_state(
+    job_name: str,
+    last_sample_id: int,
+    last_run_at: Optional[float] = None,
+    last_trained_at: Optional[float] = None
+):
+    """Upsert the watermark/state of a scheduled ML job (None keeps the stored value)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO ml_job_state (job_name, last_sample_id, last_run_at, last_trained_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(job_name) DO UPDATE SET
+                last_sample_id = excluded.last_sample_id,
+                last_run_at = COALESCE(excluded.last_run_at, ml_job_state.last_run_at),
+                last_trained_at = COALESCE(excluded.last_trained_at, ml_job_state.last_trained_at)
+        ''', (job_name, int(last_sample_id), last_run_at, last_trained_at))
+        conn.commit()
+
+
 def clear_all_data():
     """Clear all data from database (for testing/reset)"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM anomaly_chats')
+        cursor.execute('DELETE FROM anomaly_event_vectors')
+        cursor.execute('DELETE FROM anomaly_event_signals')
         cursor.execute('DELETE FROM anomaly_events')
         conn.commit()
         logger.warning("All anomaly data cleared from database")
+    from .similarity_index import similarity_index
+    similarity_index.reset()
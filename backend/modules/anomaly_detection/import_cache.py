@@ -0,0 +1,257 @@
+"""
+Import cache - content-addressed store of normalized import results.
+
+Entries are keyed by the SHA-256 of the uploaded file plus the parse options, and
+hold the normalized column arrays (sorted by timestamp) and the import summary in
+an uncompressed .npz file, so a repeated upload of the same workbook skips Excel
+parsing and loads with a few memory copies. Least recently used entries are
+evicted when the total size exceeds IMPORT_CACHE_MAX_MB.
+
+A streamed import fills its entry through an EntryWriter: every parsed chunk is
+appended to per-column spool files on disk and the .npz is assembled from them
+when the parse ends, one column at a time, so caching never holds the whole file
+in memory. An entry that outgrows IMPORT_CACHE_MAX_MB is dropped while spooling.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from .xlsx_importer import ImportSummary
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.getenv("IMPORT_CACHE_DIR", str(Path(__file__).parent / "import_cache")))
+CACHE_MAX_BYTES = int(float(os.getenv("IMPORT_CACHE_MAX_MB", "512")) * 1024 * 1024)
+CACHE_ENABLED = os.getenv("IMPORT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Bump when the normalized column layout changes, so stale entries are never hit
+FORMAT_VERSION = 1
+
+_SUMMARY_KEY = "__summary__"
+
+
+def file_digest(file_path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content, read in blocks"""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(digest: str, electrical_mode: str, max_rows: int) -> str:
+    options = f"v{FORMAT_VERSION}|{digest}|{electrical_mode}|{int(max_rows)}"
+    return hashlib.sha256(options.encode("utf-8")).hexdigest()
+
+
+class ImportCache:
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES, enabled: bool = CACHE_ENABLED):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npz"
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, np.ndarray], ImportSummary]]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = {name: data[name] for name in data.files if name != _SUMMARY_KEY}
+                summary = ImportSummary(**json.loads(str(data[_SUMMARY_KEY])))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable import cache entry {path.name}: {e}")
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # LRU bookkeeping: the modification time is the last access time
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return columns, summary
+
+    def put(self, key: str, columns: Dict[str, np.ndarray], summary: ImportSummary) -> None:
+        if not self.enabled:
+            return
+        arrays: Dict[str, Any] = dict(columns)
+        arrays[_SUMMARY_KEY] = _summary_array(summary)
+        self._publish(key, lambda f: np.savez(f, **arrays))
+
+    def writer(self, key: str) -> Optional["EntryWriter"]:
+        """Entry filled chunk by chunk, or None when the cache is disabled"""
+        if not self.enabled:
+            return None
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            return EntryWriter(self, key)
+        except OSError as e:
+            logger.warning(f"Import cache unavailable: {e}")
+            return None
+
+    def _publish(self, key: str, write: Callable[[BinaryIO], None]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            self._remove(Path(tmp))
+            raise
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for path in self.directory.glob("*.npz"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                logger.info(f"Evicted import cache entry {path.name} ({size} bytes)")
+
+    @staticmethod
+    def _remove(path: Path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def clear(self) -> int:
+        removed = 0
+        with self._lock:
+            for path in self.directory.glob("*.npz"):
+                self._remove(path)
+                removed += 1
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        entries = list(self.directory.glob("*.npz")) if self.directory.exists() else []
+        size = 0
+        for path in entries:
+            try:
+                size += path.stat().st_size
+            except OSError:
+                pass
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(entries),
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+        }
+
+
+class EntryWriter:
+    """
+    Spools the column chunks of one cache entry to disk as they are parsed.
+    commit() assembles the .npz (sorted by timestamp) from the spool files;
+    discard() drops the entry. Either one removes the spool.
+    """
+
+    def __init__(self, cache: ImportCache, key: str):
+        self.cache = cache
+        self.key = key
+        self.rows = 0
+        self.size_bytes = 0
+        self._spool = Path(tempfile.mkdtemp(dir=cache.directory, suffix=".spool"))
+        self._files: Dict[str, BinaryIO] = {}
+        self._dtypes: Dict[str, np.dtype] = {}
+        self.active = True
+
+    def append(self, columns: Dict[str, np.ndarray]):
+        if not self.active or not columns:
+            return
+        for name, values in columns.items():
+            f = self._files.get(name)
+            if f is None:
+                f = self._files[name] = open(self._spool / f"{len(self._files)}.bin", "wb")
+                self._dtypes[name] = values.dtype
+            values = np.ascontiguousarray(values, dtype=self._dtypes[name])
+            values.tofile(f)
+            self.size_bytes += values.nbytes
+        self.rows += len(columns["timestamp"])
+        if self.size_bytes > self.cache.max_bytes:
+            logger.info(f"Import cache entry {self.key[:12]} exceeds the cache size, not caching it")
+            self.discard()
+
+    def commit(self, summary: ImportSummary):
+        if not self.active:
+            return
+        try:
+            self._close_files()
+            self.cache._publish(self.key, lambda f: self._write_npz(f, summary))
+        finally:
+            self.discard()
+
+    def _write_npz(self, f: BinaryIO, summary: ImportSummary):
+        columns = {
+            name: np.memmap(self._spool / f"{i}.bin", dtype=self._dtypes[name], mode="r", shape=(self.rows,))
+            if self.rows else np.empty(0, dtype=self._dtypes[name])
+            for i, name in enumerate(self._files)
+        }
+        ts = columns.get("timestamp")
+        # Chunks are sorted on their own; reorder only when they overlap in time
+        order = None
+        if ts is not None and len(ts) > 1 and not np.all(ts[1:] >= ts[:-1]):
+            order = np.argsort(ts, kind="stable")
+        # Same layout as np.savez, written one member (column) at a time
+        with zipfile.ZipFile(f, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name, values in columns.items():
+                with zf.open(f"{name}.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array(member, values[order] if order is not None else values, allow_pickle=False)
+            with zf.open(f"{_SUMMARY_KEY}.npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array(member, _summary_array(summary), allow_pickle=False)
+
+    def _close_files(self):
+        for f in self._files.values():
+            f.close()
+
+    def discard(self):
+        self.active = False
+        self._close_files()
+        shutil.rmtree(self._spool, ignore_errors=True)
+
+
+def _summary_array(summary: ImportSummary) -> np.ndarray:
+    return np.array(json.dumps(asdict(summary)))
+
+
+import_cache = ImportCache()
@@ -0,0 +1,338 @@
+"""
+Import jobs - tracking and execution of (potentially long) dataset imports.
+Progress is exposed through the /api/anomaly/import/jobs endpoints.
+"""
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .import_cache import cache_key, file_digest, import_cache
+from .service import service
+from .xlsx_importer import (
+    SIGNAL_KEYS,
+    columns_to_records,
+    iter_column_chunks,
+    stream_termoformatrice_xlsx,
+)
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept for status queries
+MAX_FINISHED_JOBS = 50
+
+# Imports running concurrently; further jobs wait in the queue
+IMPORT_WORKERS = max(1, int(os.getenv("IMPORT_WORKERS", "2")))
+
+
+class ImportCancelled(Exception):
+    """Raised inside a running import when its job has been cancelled"""
+
+
+@dataclass
+class ImportJob:
+    id: str
+    kind: str
+    filename: str
+    status: str = "queued"  # queued | running | completed | failed | cancelled
+    rows_read: int = 0
+    rows_total_estimate: Optional[int] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise ImportCancelled(f"Import job {self.id} cancelled")
+
+    def to_dict(self) -> Dict[str, Any]:
+        progress = None
+        if self.status == "completed":
+            progress = 1.0
+        elif self.rows_total_estimate:
+            progress = min(1.0, self.rows_read / self.rows_total_estimate)
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_read": self.rows_read,
+            "rows_total_estimate": self.rows_total_estimate,
+            "progress": progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "cancel_requested": self.cancel_requested,
+        }
+
+
+class ImportJobRegistry:
+    def __init__(self, max_workers: int = IMPORT_WORKERS):
+        self._jobs: Dict[str, ImportJob] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="import")
+
+    def create(self, kind: str, filename: str) -> ImportJob:
+        job = ImportJob(id=uuid.uuid4().hex, kind=kind, filename=filename)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.finished]
+            for old in sorted(finished, key=lambda j: j.created_at)[:-MAX_FINISHED_JOBS]:
+                del self._jobs[old.id]
+        return job
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+        return [j.to_dict() for j in jobs]
+
+    def submit(self, job: ImportJob, fn: Callable[..., Any], *args, **kwargs) -> ImportJob:
+        """Run fn(job, *args, **kwargs) on the import worker pool; returns immediately"""
+        self._executor.submit(fn, job, *args, **kwargs)
+        return job
+
+    def cancel(self, job_id: str) -> Optional[ImportJob]:
+        """
+        Cancel a job: a queued job is skipped when a worker picks it up, a running
+        one stops at the next chunk boundary and leaves the anomaly service untouched.
+        """
+        job = self.get(job_id)
+        if not job or job.finished:
+            return job
+        job.cancel_requested = True
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return job
+
+    def shutdown(self):
+        """Cancel pending/running jobs and release the worker pool (app shutdown)"""
+        with self._lock:
+            job_ids = [j.id for j in self._jobs.values() if not j.finished]
+        for job_id in job_ids:
+            self.cancel(job_id)
+        self._executor.shutdown(wait=False)
+
+
+import_jobs = ImportJobRegistry()
+
+
+def run_xlsx_import(
+    job: ImportJob,
+    file_path: str,
+    electrical_mode: str = "three_phase",
+    max_points: int = 1000,
+    chunk_size: int = 5000,
+    persist: bool = False,
+    delete_file: bool = False,
+    max_rows: int = 200_000,
+    use_cache: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """
+    Stream an XLSX file chunk by chunk. Every chunk is optionally written to the
+    realtime samples store; only the newest `max_points` points are kept in memory
+    (bounded heap) and replayed into the anomaly service / baseline at the end.
+
+    Imports are content-addressed: the normalized columns of a parsed file are
+    stored in the import cache, and a repeated upload of the same content with the
+    same options is replayed from there without parsing the workbook. Parsed
+    chunks are spooled to the cache entry on disk as they arrive, so peak memory
+    while parsing stays bounded by chunk_size + max_points rows.
+
+    Runs on the import worker pool; with delete_file the (temporary) upload is
+    removed when the job ends, whatever its outcome. Failures are recorded on
+    the job rather than raised.
+    """
+    # Lazy import: realtime storage is owned by the realtime module
+    from modules.realtime.database import save_samples_bulk
+
+    if job.cancel_requested:
+        # Cancelled while queued
+        _remove(file_path, delete_file)
+        return None
+    job.status = "running"
+    job.started_at = time.time()
+    newest: List[Tuple[float, int, Dict[str, Any]]] = []  # min-heap on timestamp
+    seq = 0
+    persisted = 0
+
+    def on_chunk(columns):
+        nonlocal seq, persisted
+        job.check_cancelled()
+        if persist:
+            records = columns_to_records(columns)
+            persisted += save_samples_bulk(
+                [(r["timestamp"], {k: r[k] for k in (*SIGNAL_KEYS, "power")}) for r in records]
+            )
+            candidates = records[-max_points:] if max_points > 0 else records
+        else:
+            # Chunk is sorted by timestamp: only its tail can be among the newest points
+            tail = {k: v[-max_points:] for k, v in columns.items()} if max_points > 0 else columns
+            candidates = columns_to_records(tail)
+        for record in candidates:
+            seq += 1
+            item = (record["timestamp"], seq, record)
+            if max_points <= 0 or len(newest) < max_points:
+                heapq.heappush(newest, item)
+            elif item[0] > newest[0][0]:
+                heapq.heapreplace(newest, item)
+
+    def on_progress(rows_read, rows_estimate):
+        job.rows_read = rows_read
+        job.rows_total_estimate = rows_estimate
+        job.check_cancelled()
+
+    try:
+        key = cache_key(file_digest(file_path), electrical_mode, max_rows) if use_cache else None
+        cached = import_cache.get(key) if key else None
+        if cached is not None:
+            columns, summary = cached
+            rows = summary.rows_imported
+            for i, part in enumerate(iter_column_chunks(columns, chunk_size), start=1):
+                on_chunk(part)
+                on_progress(min(i * chunk_size, rows), rows)
+        else:
+            writer = import_cache.writer(key) if key else None
+
+            def parse_chunk(columns):
+                on_chunk(columns)
+                if writer:
+                    writer.append(columns)
+
+            try:
+                summary = stream_termoformatrice_xlsx(
+                    file_path,
+                    parse_chunk,
+                    chunk_size=chunk_size,
+                    max_rows=max_rows,
+                    electrical_mode=electrical_mode,
+                    on_progress=on_progress,
+                )
+                job.check_cancelled()
+                if writer:
+                    try:
+                        writer.commit(summary)
+                    except Exception as e:
+                        logger.warning(f"Could not cache import {job.filename}: {e}")
+            finally:
+                if writer:
+                    writer.discard()
+        job.check_cancelled()
+        points = [record for _, _, record in newest]
+        loaded = service.load_history_from_import(points, max_points=max_points, clear_events=True)
+        job.result = {
+            "status": "success",
+            "job_id": job.id,
+            "mode": loaded["mode"],
+            "import_summary": {
+                "rows_total": summary.rows_total,
+                "rows_imported": summary.rows_imported,
+                "timestamp_min": summary.timestamp_min,
+                "timestamp_max": summary.timestamp_max,
+                "detected_columns": summary.detected_columns,
+            },
+            "points_loaded": loaded["points_loaded"],
+            "events_generated": loaded["events_generated"],
+            "samples_persisted": persisted,
+            "cache_hit": cached is not None,
+        }
+        job.status = "completed"
+        return job.result
+    except ImportCancelled:
+        job.status = "cancelled"
+        logger.info(f"Import job {job.id} cancelled after {job.rows_read} rows")
+        return None
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.warning(f"Import job {job.id} failed: {e}")
+        return None
+    finally:
+        job.finished_at = time.time()
+        _remove(file_path, delete_file)
+
+
+def _remove(file_path: str, delete_file: bool):
+    if delete_file and file_path and os.path.exists(file_path):
+        try:
+            os.unlink(file_path)
+        except Exception:
+            pass
+
+
+def run_batch_import_job(
+    job: ImportJob,
+    source: str,
+    load_device: Optional[str] = None,
+    max_points: int = 1000,
+    **batch_options: Any,
+) -> Optional[Dict[str, Any]]:
+    """
+    Batch (folder/glob) import as a job: for these jobs rows_read/rows_total_estimate
+    count files. The merged data of load_device (or of the only device found) is
+    replayed into the anomaly service like a single-file import.
+    """
+    from .batch_import import run_batch_import
+
+    if job.cancel_requested:
+        return None
+    job.status = "running"
+    job.started_at = time.time()
+
+    def on_file_done(files_done, files_total):
+        job.rows_read = files_done
+        job.rows_total_estimate = files_total
+        job.check_cancelled()
+
+    try:
+        out = run_batch_import(source, on_file_done=on_file_done, **batch_options)
+        job.check_cancelled()
+        report, merged = out["report"], out["merged"]
+        result: Dict[str, Any] = {"status": "success", "job_id": job.id, **report}
+
+        device = load_device or (next(iter(merged)) if len(merged) == 1 else None)
+        if device is not None:
+            if device not in merged:
+                raise ValueError(f"Device '{device}' not found. Available: {sorted(merged)}")
+            tail = {k: v[-max_points:] for k, v in merged[device].items()} if max_points > 0 else merged[device]
+            loaded = service.load_history_from_import(columns_to_records(tail), max_points=max_points)
+            result.update(
+                loaded_device=device,
+                mode=loaded["mode"],
+                points_loaded=loaded["points_loaded"],
+                events_generated=loaded["events_generated"],
+            )
+        job.result = result
+        job.status = "completed"
+        return job.result
+    except ImportCancelled:
+        job.status = "cancelled"
+        logger.info(f"Batch import job {job.id} cancelled after {job.rows_read} files")
+        return None
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.warning(f"Batch import job {job.id} failed: {e}")
+        return None
+    finally:
+        job.finished_at = time.time()
@@ -0,0 +1,262 @@
+"""
+Matrix Profile - subsequence (cycle) level discord and motif discovery.
+
+Vectorized SCRIMP: the z-normalized correlation between every pair of subsequences
+is computed one diagonal of the distance matrix at a time, where the sliding dot
+products along a diagonal come from a single cumulative sum. Diagonals are visited
+in random order, so with a time budget the result is an anytime approximation that
+converges to the exact (STOMP) profile; the top discords of an approximate profile
+can then be made exact by comparing just those subsequences with all the others. New data can be appended incrementally with
+FFT-based sliding dot products for the first new row and the STOMP row recurrence
+for the following ones.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def estimate_period(values: np.ndarray, min_period: int = 4, max_period: Optional[int] = None) -> Optional[int]:
+    """
+    Dominant period (in samples) from the FFT autocorrelation, or None if the signal
+    shows no clear periodicity.
+    """
+    x = np.asarray(values, dtype=float)
+    n = len(x)
+    if n < 4 * min_period:
+        return None
+    max_period = min(max_period or n // 4, n // 2)
+    x = x - x.mean()
+    spectrum = np.fft.rfft(x, 2 * n)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    if acf[0] <= 0:
+        return None
+    acf = acf / acf[0]
+
+    # First peak after the autocorrelation has dropped below zero
+    below = np.where(acf[:max_period] < 0)[0]
+    if len(below) == 0:
+        return None
+    start = max(int(below[0]), min_period)
+    if start >= max_period:
+        return None
+    lag = start + int(np.argmax(acf[start:max_period]))
+    if acf[lag] < 0.2:
+        return None
+    return lag
+
+
+def sliding_dot_product(query: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Dot product of `query` with every subsequence of `values` (FFT, O(n log n))"""
+    m, n = len(query), len(values)
+    size = 1 << int(np.ceil(np.log2(n + m)))
+    prod = np.fft.irfft(np.fft.rfft(values, size) * np.fft.rfft(query[::-1], size), size)
+    return prod[m - 1:n]
+
+
+def _sliding_mean_std(values: np.ndarray, m: int) -> Tuple[np.ndarray, np.ndarray]:
+    cs = np.concatenate(([0.0], np.cumsum(values)))
+    cs2 = np.concatenate(([0.0], np.cumsum(values * values)))
+    mean = (cs[m:] - cs[:-m]) / m
+    var = (cs2[m:] - cs2[:-m]) / m - mean * mean
+    return mean, np.sqrt(np.maximum(var, 0.0))
+
+
+class MatrixProfile:
+    """
+    Matrix profile of one signal, stored as the best Pearson correlation per
+    subsequence (distance = sqrt(2m(1 - corr))) and the index of its nearest neighbour.
+    """
+
+    # Windows with a std below this fraction of the signal std are treated as flat
+    FLAT_TOLERANCE = 1e-6
+
+    def __init__(self, values, m: int):
+        self.m = int(m)
+        self.exclusion = max(1, int(np.ceil(self.m / 4)))
+        self._offset = float(np.mean(values)) if len(values) else 0.0
+        self.values = np.asarray(values, dtype=float) - self._offset
+        n_sub = len(self.values) - self.m + 1
+        if n_sub <= self.exclusion:
+            raise ValueError(f'Signal too short for subsequence length {self.m}')
+        self.corr = np.full(n_sub, -np.inf)
+        self.index = np.full(n_sub, -1, dtype=np.int64)
+        # Rows compared against every other subsequence (exact even when the profile is not)
+        self.exact_rows = np.zeros(n_sub, dtype=bool)
+        self.diagonals_total = n_sub - self.exclusion
+        self.diagonals_done = 0
+        self._refresh_stats()
+
+    def _refresh_stats(self):
+        self.mean, std = _sliding_mean_std(self.values, self.m)
+        scale = float(np.std(self.values)) or 1.0
+        self.flat = std <= self.FLAT_TOLERANCE * scale
+        self.inv_std = np.where(self.flat, 0.0, 1.0 / np.where(self.flat, 1.0, std))
+
+    @property
+    def exact(self) -> bool:
+        return self.diagonals_done >= self.diagonals_total
+
+    def compute(self, time_budget_s: Optional[float] = None, seed: int = 42) -> 'MatrixProfile':
+        """Process the diagonals (random order) until all are done or the budget is spent"""
+        t = self.values
+        n, m = len(t), self.m
+        n_sub = len(self.corr)
+        order = np.random.default_rng(seed).permutation(np.arange(self.exclusion, n_sub))
+        has_flat = bool(self.flat.any())
+        deadline = time.perf_counter() + time_budget_s if time_budget_s else None
+
+        # corr(i, j) = QT(i, j) * s_i * s_j - c_i * c_j, with s = 1 / (std sqrt(m)) and c = mean sqrt(m) s
+        s = self.inv_std / np.sqrt(m)
+        c = self.mean * np.sqrt(m) * s
+        positions = np.arange(n_sub)
+        # Scratch buffers reused by every diagonal (views of the first `length` items)
+        cs = np.empty(n + 1)
+        cs[0] = 0.0
+        corr_buf = np.empty(n_sub)
+        tmp_buf = np.empty(n_sub)
+        mask_buf = np.empty(n_sub, dtype=bool)
+
+        for done, k in enumerate(order, start=1):
+            length = n_sub - k
+            corr, tmp, mask = corr_buf[:length], tmp_buf[:length], mask_buf[:length]
+            np.multiply(t[:n - k], t[k:], out=cs[1:n - k + 1])
+            np.cumsum(cs[1:n - k + 1], out=cs[1:n - k + 1])
+            np.subtract(cs[m:m + length], cs[:length], out=corr)
+            corr *= s[:length]
+            corr *= s[k:]
+            np.multiply(c[:length], c[k:], out=tmp)
+            corr -= tmp
+            if has_flat:
+                corr[self.flat[:length] & self.flat[k:]] = 1.0
+
+            # Fold the diagonal (pairs i, i + k) into both sides of the profile
+            side = self.corr[:length]
+            np.greater(corr, side, out=mask)
+            np.copyto(side, corr, where=mask)
+            np.copyto(self.index[:length], positions[k:], where=mask)
+            side = self.corr[k:]
+            np.greater(corr, side, out=mask)
+            np.copyto(side, corr, where=mask)
+            np.copyto(self.index[k:], positions[:length], where=mask)
+
+            self.diagonals_done = done
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        return self
+
+    def append(self, new_values) -> int:
+        """
+        Extend the signal and update the profile for the new subsequences.
+        Returns the number of subsequences added.
+        """
+        new_values = np.asarray(new_values, dtype=float) - self._offset
+        if len(new_values) == 0:
+            return 0
+        old_sub = len(self.corr)
+        self.values = np.concatenate((self.values, new_values))
+        self._refresh_stats()
+        n_sub = len(self.values) - self.m + 1
+        added = n_sub - old_sub
+        self.corr = np.concatenate((self.corr, np.full(added, -np.inf)))
+        self.index = np.concatenate((self.index, np.full(added, -1, dtype=np.int64)))
+        # New rows are compared with all the earlier ones below, and fold into them
+        self.exact_rows = np.concatenate((self.exact_rows, np.ones(added, dtype=bool)))
+        self.diagonals_total = n_sub - self.exclusion
+        self.diagonals_done += added
+
+        t, m = self.values, self.m
+        qt = None
+        for q in range(old_sub, n_sub):
+            if qt is None:
+                qt = sliding_dot_product(t[q:q + m], t[:q + m])
+            else:
+                # STOMP recurrence: QT[q, j] = QT[q-1, j-1] - t[q-1]t[j-1] + t[q+m-1]t[j+m-1]
+                prev = qt
+                qt = np.empty(q + 1)
+                qt[0] = np.dot(t[q:q + m], t[:m])
+                qt[1:] = prev - t[q - 1] * t[:q] + t[q + m - 1] * t[m:q + m]
+            corr = (qt - m * self.mean[:q + 1] * self.mean[q]) * (self.inv_std[:q + 1] * self.inv_std[q] / m)
+            if self.flat[q]:
+                corr[self.flat[:q + 1]] = 1.0
+            corr[max(0, q - self.exclusion + 1):] = -np.inf
+            if q == 0 or not np.isfinite(corr).any():
+                continue
+            best = int(np.argmax(corr))
+            self.corr[q] = corr[best]
+            self.index[q] = best
+            better = np.flatnonzero(corr[:q] > self.corr[:q])
+            self.corr[better] = corr[better]
+            self.index[better] = q
+        return added
+
+    def refine_row(self, i: int):
+        """Compare subsequence i with every other one (FFT) and fold the row into the profile"""
+        t, m = self.values, self.m
+        qt = sliding_dot_product(t[i:i + m], t)
+        corr = (qt - m * self.mean * self.mean[i]) * (self.inv_std * self.inv_std[i] / m)
+        if self.flat[i]:
+            corr[self.flat] = 1.0
+        corr[max(0, i - self.exclusion + 1):i + self.exclusion] = -np.inf
+        if not np.isfinite(corr).any():
+            self.exact_rows[i] = True
+            return
+        best = int(np.argmax(corr))
+        self.corr[i] = corr[best]
+        self.index[i] = best
+        better = np.flatnonzero(corr > self.corr)
+        self.corr[better] = corr[better]
+        self.index[better] = i
+        self.exact_rows[i] = True
+
+    def refine_discords(self, k: int = 3, time_budget_s: Optional[float] = None) -> bool:
+        """
+        Make the top-k discords exact on an approximate profile. A partial profile
+        only overestimates distances, so once every current top discord has been
+        compared with all subsequences no other one can exceed it. Returns whether
+        that point was reached within the budget.
+        """
+        if self.exact:
+            return True
+        deadline = time.perf_counter() + time_budget_s if time_budget_s else None
+        while True:
+            pending = [d['index'] for d in self.top_discords(k) if not self.exact_rows[d['index']]]
+            if not pending:
+                return True
+            for i in pending:
+                self.refine_row(i)
+            if deadline is not None and time.perf_counter() > deadline:
+                return not any(not self.exact_rows[d['index']] for d in self.top_discords(k))
+
+    def distances(self) -> np.ndarray:
+        corr = np.clip(self.corr, -1.0, 1.0)
+        dist = np.sqrt(np.maximum(2.0 * self.m * (1.0 - corr), 0.0))
+        dist[~np.isfinite(self.corr)] = np.nan
+        return dist
+
+    def top_discords(self, k: int = 3) -> List[Dict]:
+        """Subsequences farthest from their nearest neighbour (non-overlapping)"""
+        dist = self.distances()
+        order = np.argsort(np.where(np.isnan(dist), -np.inf, dist))[::-1]
+        return self._pick(order, dist, k)
+
+    def top_motifs(self, k: int = 3) -> List[Dict]:
+        """Closest pairs of subsequences (non-overlapping)"""
+        dist = self.distances()
+        order = np.argsort(np.where(np.isnan(dist), np.inf, dist))
+        return self._pick(order, dist, k, with_neighbour=True)
+
+    def _pick(self, order: np.ndarray, dist: np.ndarray, k: int, with_neighbour: bool = False) -> List[Dict]:
+        taken: List[int] = []
+        out: List[Dict] = []
+        for idx in order:
+            if len(out) >= k or np.isnan(dist[idx]):
+                break
+            idx = int(idx)
+            nn = int(self.index[idx])
+            blocked = [idx] + ([nn] if with_neighbour else [])
+            if any(abs(b - t) < self.m for b in blocked for t in taken):
+                continue
+            taken.extend(blocked)
+            out.append({'index': idx, 'neighbor_index': nn, 'distance': float(dist[idx])})
+        return out
@@ -3,7 +3,7 @@ ML-based Anomaly Analyzer - On-demand or scheduled deep analysis
 Supports multiple algorithms for user selection.
 """
 import numpy as np
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 from datetime import datetime
 import logging
 from sklearn.ensemble import IsolationForest
@@ -11,6 +11,9 @@ from sklearn.svm import OneClassSVM
 from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import StandardScaler
 
+from .change_point import binary_segmentation, segment_stats
+from .matrix_profile import MatrixProfile, estimate_period
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,13 +26,25 @@ class MLAnalyzer:
     ALGORITHMS = {
         'isolation_forest': 'Isolation Forest',
         'one_class_svm': 'One-Class SVM',
-        'dbscan': 'DBSCAN Clustering'
+        'dbscan': 'DBSCAN Clustering',
+        'matrix_profile': 'Matrix Profile (cycle discords)',
+        'change_point': 'Change-Point Detection (regimes)'
     }
     
+    # Algorithms whose fitted model can score unseen points (used by scheduled jobs)
+    SCORABLE_ALGORITHMS = ('isolation_forest', 'one_class_svm')
+    
+    FEATURES = ('temperature', 'vibration', 'power')
+    
+    # Signals considered by change-point detection when none are requested
+    REGIME_SIGNALS = ('power', 'voltage_v', 'current_a', 'power_factor', 'temperature', 'vibration')
+    
     def __init__(self):
         self.scaler = StandardScaler()
         self.current_algorithm = 'isolation_forest'
         self.last_analysis = None
+        # Matrix profile kept between calls for incremental updates
+        self._mp_state: Optional[Dict] = None
         
     def analyze(
         self, 
@@ -42,7 +57,7 @@ class MLAnalyzer:
         
         Args:
             data_points: List of data dicts with 'temperature', 'vibration', 'power', 'timestamp'
-            algorithm: One of 'isolation_forest', 'one_class_svm', 'dbscan'
+            algorithm: One of 'isolation_forest', 'one_class_svm', 'dbscan', 'matrix_profile', 'change_point'
             params: Optional algorithm-specific parameters
             
         Returns:
@@ -56,16 +71,17 @@ class MLAnalyzer:
             }
         
         try:
-            # Extract features
-            features = self._extract_features(data_points)
-            
-            # Select and run algorithm
+            # Select and run algorithm (point-wise algorithms share the scaled feature matrix)
             if algorithm == 'isolation_forest':
-                result = self._run_isolation_forest(features, data_points, params)
+                result = self._run_isolation_forest(self._extract_features(data_points), data_points, params)
             elif algorithm == 'one_class_svm':
-                result = self._run_one_class_svm(features, data_points, params)
+                result = self._run_one_class_svm(self._extract_features(data_points), data_points, params)
             elif algorithm == 'dbscan':
-                result = self._run_dbscan(features, data_points, params)
+                result = self._run_dbscan(self._extract_features(data_points), data_points, params)
+            elif algorithm == 'matrix_profile':
+                result = self._run_matrix_profile(data_points, params)
+            elif algorithm == 'change_point':
+                result = self._run_change_point(data_points, params)
             else:
                 return {
                     'success': False,
@@ -92,21 +108,96 @@ class MLAnalyzer:
     
     def _extract_features(self, data_points: List[Dict]) -> np.ndarray:
         """Extract and normalize features from data points"""
-        features = []
-        for point in data_points:
-            features.append([
-                point.get('temperature', 0),
-                point.get('vibration', 0),
-                point.get('power', 0)
-            ])
-        
-        features_array = np.array(features)
+        features_array = self._feature_matrix(data_points, self.FEATURES)
         
         # Normalize features
         features_scaled = self.scaler.fit_transform(features_array)
         
         return features_scaled
     
+    @staticmethod
+    def _feature_matrix(data_points: List[Dict], feature_keys: Sequence[str]) -> np.ndarray:
+        """Raw feature matrix; missing or non-numeric values become 0"""
+        features = np.zeros((len(data_points), len(feature_keys)), dtype=float)
+        for i, point in enumerate(data_points):
+            for j, key in enumerate(feature_keys):
+                value = point.get(key)
+                if isinstance(value, (int, float)) and np.isfinite(value):
+                    features[i, j] = value
+        return features
+    
+    def train_model(
+        self,
+        data_points: List[Dict],
+        algorithm: str = 'isolation_forest',
+        params: Optional[Dict] = None,
+        feature_keys: Optional[Sequence[str]] = None
+    ) -> Tuple[object, StandardScaler]:
+        """
+        Fit a reusable model (and its scaler) for later scoring of new points.
+        Only algorithms that can score unseen data are supported (see SCORABLE_ALGORITHMS).
+        """
+        if algorithm not in self.SCORABLE_ALGORITHMS:
+            raise ValueError(
+                f'Algorithm {algorithm} cannot score new data. Available: {list(self.SCORABLE_ALGORITHMS)}'
+            )
+        if not data_points or len(data_points) < 20:
+            raise ValueError('Insufficient data for ML training (minimum 20 points required)')
+        
+        params = params or {}
+        scaler = StandardScaler()
+        features = scaler.fit_transform(self._feature_matrix(data_points, feature_keys or self.FEATURES))
+        
+        if algorithm == 'isolation_forest':
+            model = IsolationForest(
+                n_estimators=params.get('n_estimators', 100),
+                contamination=params.get('contamination', 0.05),
+                random_state=42
+            )
+        else:
+            model = OneClassSVM(
+                nu=params.get('nu', 0.05),
+                kernel=params.get('kernel', 'rbf'),
+                gamma=params.get('gamma', 'scale')
+            )
+        model.fit(features)
+        return model, scaler
+    
+    def score_points(
+        self,
+        model,
+        scaler: StandardScaler,
+        data_points: List[Dict],
+        feature_keys: Optional[Sequence[str]] = None
+    ) -> Dict:
+        """
+        Score new points with an already trained model (no refit).
+        Returns the same anomaly structure as analyze().
+        """
+        feature_keys = list(feature_keys or self.FEATURES)
+        if not data_points:
+            return {'anomalies': [], 'anomaly_count': 0, 'anomaly_rate': 0.0, 'scores': []}
+        
+        features = scaler.transform(self._feature_matrix(data_points, feature_keys))
+        predictions = model.predict(features)
+        scores = model.decision_function(features)
+        
+        anomalies = []
+        for idx in np.where(predictions == -1)[0]:
+            anomalies.append({
+                'index': int(idx),
+                'timestamp': data_points[idx].get('timestamp'),
+                'score': float(scores[idx]),
+                'values': {key: data_points[idx].get(key) for key in feature_keys}
+            })
+        
+        return {
+            'anomalies': anomalies,
+            'anomaly_count': len(anomalies),
+            'anomaly_rate': len(anomalies) / len(data_points),
+            'scores': scores.tolist()
+        }
+    
     def _run_isolation_forest(
         self, 
         features: np.ndarray, 
@@ -267,6 +358,267 @@ class MLAnalyzer:
             'summary': f'Found {len(anomalies)} outlier points ({len(anomalies)/len(data_points)*100:.1f}%) and {n_clusters} clusters using DBSCAN'
         }
     
+    @staticmethod
+    def _signal_values(data_points: List[Dict], signal: str) -> np.ndarray:
+        """Values of one signal as a float array; gaps are forward/back filled"""
+        values = np.array(
+            [v if isinstance(v, (int, float)) else np.nan for v in (p.get(signal) for p in data_points)],
+            dtype=float
+        )
+        values[~np.isfinite(values)] = np.nan
+        valid = ~np.isnan(values)
+        if not valid.any():
+            raise ValueError(f"Signal '{signal}' has no numeric values")
+        if not valid.all():
+            idx = np.where(valid, np.arange(len(values)), 0)
+            np.maximum.accumulate(idx, out=idx)
+            values = values[idx]
+            values[:np.argmax(valid)] = values[np.argmax(valid)]
+        return values
+    
+    @staticmethod
+    def _paa(values: np.ndarray, factor: int) -> np.ndarray:
+        """Piecewise aggregate approximation (block means of `factor` samples)"""
+        n = (len(values) // factor) * factor
+        return values[:n].reshape(-1, factor).mean(axis=1)
+    
+    def _run_matrix_profile(self, data_points: List[Dict], params: Optional[Dict]) -> Dict:
+        """
+        Run Matrix Profile analysis on one signal.
+        Finds anomalous cycles (discords) and repeated cycles (motifs) whose individual
+        values may all be within the normal range.
+        """
+        params = params or {}
+        signal = params.get('signal', 'power')
+        top_k = int(params.get('top_k', 3))
+        time_budget_s = float(params.get('time_budget_s', 5.0))
+        max_window = int(params.get('max_window', 32))
+        # Work is quadratic in the series length: longer series are downsampled to this
+        max_points = max(100, int(params.get('max_points', 20_000)))
+        incremental = bool(params.get('incremental', False))
+        # Profile values returned for plotting (0 = none); longer profiles are max-pooled
+        profile_points = max(0, int(params.get('profile_points', 0)))
+        
+        values = self._signal_values(data_points, signal)
+        timestamps = np.array([float(p.get('timestamp') or 0.0) for p in data_points])
+        
+        state = self._mp_state
+        requested_length = params.get('subsequence_length')
+        if (
+            incremental and state and state['signal'] == signal
+            and (not requested_length or int(requested_length) == state['subsequence_length'])
+        ):
+            # Append only points newer than what the stored profile has seen
+            new = timestamps > state['last_timestamp']
+            pending = np.concatenate((state['pending'], values[new]))
+            pending_ts = np.concatenate((state['pending_timestamps'], timestamps[new]))
+            usable = (len(pending) // state['factor']) * state['factor']
+            state['profile'].append(self._paa(pending[:usable], state['factor']))
+            state['timestamps'] = np.concatenate((state['timestamps'], pending_ts[:usable:state['factor']]))
+            state['pending'], state['pending_timestamps'] = pending[usable:], pending_ts[usable:]
+            if new.any():
+                state['last_timestamp'] = float(timestamps[new].max())
+            points_added = int(new.sum())
+        else:
+            period = estimate_period(values)
+            subsequence_length = int(requested_length or period or min(50, len(values) // 4))
+            if subsequence_length < 4:
+                raise ValueError('Subsequence length must be at least 4 samples')
+            # Long cycles are downsampled so the subsequence spans ~max_window points, long
+            # series so that at most max_points remain (work is quadratic in n)
+            factor = max(1, int(np.ceil(subsequence_length / max_window)), int(np.ceil(len(values) / max_points)))
+            usable = (len(values) // factor) * factor
+            profile = MatrixProfile(self._paa(values, factor), max(4, round(subsequence_length / factor)))
+            profile.compute(time_budget_s=time_budget_s)
+            state = {
+                'signal': signal,
+                'subsequence_length': subsequence_length,
+                'estimated_period': period,
+                'factor': factor,
+                'profile': profile,
+                'timestamps': timestamps[:usable:factor],
+                'pending': values[usable:],
+                'pending_timestamps': timestamps[usable:],
+                'last_timestamp': float(timestamps.max()),
+            }
+            self._mp_state = state
+            incremental = False
+            points_added = len(values)
+        
+        profile = state['profile']
+        # On an approximate profile, make the reported discords exact (at most 1 s more)
+        discords_exact = profile.refine_discords(top_k, time_budget_s=1.0)
+        factor = state['factor']
+        series_ts = state['timestamps']
+        span = profile.m
+        
+        def _describe(item: Dict) -> Dict:
+            start, neighbor = item['index'], item['neighbor_index']
+            end = min(start + span, len(series_ts)) - 1
+            return {
+                'index': start * factor,
+                'timestamp': float(series_ts[start]),
+                'timestamp_end': float(series_ts[end]),
+                'length': span * factor,
+                'score': item['distance'],
+                'neighbor_index': neighbor * factor,
+                'neighbor_timestamp': float(series_ts[neighbor]) if neighbor >= 0 else None,
+            }
+        
+        anomalies = [_describe(d) for d in profile.top_discords(top_k)]
+        motifs = [_describe(m) for m in profile.top_motifs(top_k)]
+        cycles = max(1, len(series_ts) // span)
+        
+        result = {
+            'anomalies': anomalies,
+            'anomaly_count': len(anomalies),
+            'anomaly_rate': len(anomalies) / cycles,
+            'motifs': motifs,
+            'signal': signal,
+            'subsequence_length': state['subsequence_length'],
+            'estimated_period': state['estimated_period'],
+            'downsample_factor': factor,
+            'exact': profile.exact,
+            'discords_exact': discords_exact,
+            'coverage': profile.diagonals_done / max(1, profile.diagonals_total),
+            'incremental': incremental,
+            'points_added': points_added,
+            'parameters': {
+                'signal': signal,
+                'top_k': top_k,
+                'time_budget_s': time_budget_s,
+                'max_window': max_window,
+                'max_points': max_points,
+                'profile_points': profile_points,
+            },
+            'summary': (
+                f'Found {len(anomalies)} discord cycles and {len(motifs)} motifs in {signal} '
+                f'(subsequence {state["subsequence_length"]} samples) using Matrix Profile'
+                + self._mp_accuracy_note(profile, discords_exact)
+            )
+        }
+        if profile_points:
+            result.update(self._pool_profile(profile.distances(), profile_points, factor))
+        return result
+    
+    @staticmethod
+    def _mp_accuracy_note(profile: MatrixProfile, discords_exact: bool) -> str:
+        if profile.exact:
+            return ''
+        coverage = profile.diagonals_done / max(1, profile.diagonals_total)
+        if discords_exact:
+            return f'; time budget hit at {coverage:.0%} coverage: discords exact, motifs approximate'
+        return f'; time budget hit at {coverage:.0%} coverage: APPROXIMATE discords and motifs'
+
+    @staticmethod
+    def _pool_profile(distances: np.ndarray, points: int, factor: int) -> Dict:
+        """
+        At most `points` profile values, each the max of a run of `step` distances
+        (discords are peaks, so pooling keeps them visible). NaN (not computed) -> None.
+        """
+        step = max(1, -(-len(distances) // points))
+        usable = len(distances) // step * step
+        pooled = distances[:usable].reshape(-1, step)
+        if usable < len(distances):
+            pooled = list(pooled) + [distances[usable:]]
+        values = []
+        for chunk in pooled:
+            finite = chunk[~np.isnan(chunk)]
+            values.append(float(finite.max()) if len(finite) else None)
+        return {'matrix_profile': values, 'matrix_profile_step': step * factor}
+    
+    def _run_change_point(self, data_points: List[Dict], params: Optional[Dict]) -> Dict:
+        """
+        Run change-point detection (binary segmentation) over one or more signals.
+        Reports when the process regime changed plus per-segment statistics.
+        """
+        params = params or {}
+        cost = params.get('cost', 'normal_meanvar')
+        min_size = max(2, int(params.get('min_size', 30)))
+        max_change_points = int(params.get('max_change_points', 20))
+        penalty = params.get('penalty')
+        
+        requested = params.get('signals') or ([params['signal']] if params.get('signal') else None)
+        candidates = list(requested or self.REGIME_SIGNALS)
+        signals: List[str] = []
+        rows: List[np.ndarray] = []
+        for name in candidates:
+            try:
+                rows.append(self._signal_values(data_points, name))
+                signals.append(name)
+            except ValueError:
+                if requested:
+                    raise
+        if not signals:
+            raise ValueError(f'No numeric signals found among {candidates}')
+        
+        raw = np.vstack(rows)
+        # Standardize by the noise level (MAD of first differences), robust to the shifts we look for
+        noise = np.median(np.abs(np.diff(raw, axis=1)), axis=1) / (0.6745 * np.sqrt(2.0))
+        scale = np.where(noise > 0, noise, np.where(raw.std(axis=1) > 0, raw.std(axis=1), 1.0))
+        standardized = (raw - raw.mean(axis=1, keepdims=True)) / scale[:, None]
+        
+        change_points = binary_segmentation(
+            standardized,
+            penalty=float(penalty) if penalty is not None else None,
+            min_size=min_size,
+            max_change_points=max_change_points,
+            cost=cost
+        )
+        
+        n = raw.shape[1]
+        bounds = [0] + [cp for cp, _ in change_points] + [n]
+        stats = segment_stats(raw, bounds)
+        
+        def _ts(i: int):
+            return data_points[i].get('timestamp')
+        
+        segments = []
+        for i, seg in enumerate(stats):
+            start, end = bounds[i], bounds[i + 1]
+            segments.append({
+                'start_index': start,
+                'end_index': end - 1,
+                'timestamp_start': _ts(start),
+                'timestamp_end': _ts(end - 1),
+                'length': end - start,
+                'stats': {
+                    name: {
+                        'mean': float(seg['mean'][j]),
+                        'std': float(seg['std'][j]),
+                        'min': float(seg['min'][j]),
+                        'max': float(seg['max'][j])
+                    }
+                    for j, name in enumerate(signals)
+                }
+            })
+        
+        anomalies = []
+        for i, (cp, gain) in enumerate(change_points):
+            before, after = segments[i]['stats'], segments[i + 1]['stats']
+            anomalies.append({
+                'index': cp,
+                'timestamp': _ts(cp),
+                'score': gain,
+                'values': {name: data_points[cp].get(name) for name in signals},
+                'shift': {name: after[name]['mean'] - before[name]['mean'] for name in signals}
+            })
+        
+        return {
+            'anomalies': anomalies,
+            'anomaly_count': len(anomalies),
+            'anomaly_rate': len(anomalies) / len(data_points),
+            'segments': segments,
+            'signals': signals,
+            'parameters': {
+                'cost': cost,
+                'min_size': min_size,
+                'max_change_points': max_change_points,
+                'penalty': penalty
+            },
+            'summary': f'Found {len(anomalies)} change points ({len(segments)} regimes) in {", ".join(signals)} using Change-Point Detection'
+        }
+    
     def get_available_algorithms(self) -> Dict:
         """Get list of available algorithms with descriptions"""
         return {
@@ -301,6 +653,32 @@ class MLAnalyzer:
                         'eps': {'type': 'float', 'default': 0.5, 'range': [0.1, 2.0]},
                         'min_samples': {'type': 'int', 'default': 5, 'range': [2, 20]}
                     }
+                },
+                {
+                    'id': 'matrix_profile',
+                    'name': 'Matrix Profile (cycle discords)',
+                    'description': 'Finds malformed machine cycles (discords) and recurring cycles (motifs) in one signal. Subsequence length defaults to the dominant period.',
+                    'speed': 'medium',
+                    'parameters': {
+                        'signal': {'type': 'enum', 'default': 'power', 'options': ['power', 'current_a', 'voltage_v', 'power_factor', 'temperature', 'vibration']},
+                        'subsequence_length': {'type': 'int', 'default': None, 'range': [4, 2000]},
+                        'top_k': {'type': 'int', 'default': 3, 'range': [1, 20]},
+                        'time_budget_s': {'type': 'float', 'default': 10.0, 'range': [1.0, 120.0]},
+                        'incremental': {'type': 'bool', 'default': False}
+                    }
+                },
+                {
+                    'id': 'change_point',
+                    'name': 'Change-Point Detection (regimes)',
+                    'description': 'Finds when the process regime changed (recipe, maintenance, drift onset) and reports per-segment statistics.',
+                    'speed': 'fast',
+                    'parameters': {
+                        'signals': {'type': 'list', 'default': None},
+                        'cost': {'type': 'enum', 'default': 'normal_meanvar', 'options': ['normal_meanvar', 'normal_mean']},
+                        'min_size': {'type': 'int', 'default': 30, 'range': [2, 10000]},
+                        'max_change_points': {'type': 'int', 'default': 20, 'range': [1, 200]},
+                        'penalty': {'type': 'float', 'default': None, 'range': [0.0, 10000.0]}
+                    }
                 }
             ]
         }
@@ -0,0 +1,78 @@
+"""
+In-memory registry of trained ML models used by scheduled analysis jobs.
+Each entry is versioned so callers can tell when a job has been retrained.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class RegisteredModel:
+    name: str
+    algorithm: str
+    model: Any
+    scaler: Any
+    feature_keys: Tuple[str, ...]
+    params: Dict[str, Any] = field(default_factory=dict)
+    trained_at: float = 0.0
+    training_samples: int = 0
+    version: int = 1
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'algorithm': self.algorithm,
+            'feature_keys': list(self.feature_keys),
+            'params': self.params,
+            'trained_at': self.trained_at,
+            'training_samples': self.training_samples,
+            'version': self.version,
+        }
+
+
+class ModelRegistry:
+    """Keeps the current model per name; registering again bumps the version."""
+
+    def __init__(self):
+        self._models: Dict[str, RegisteredModel] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        algorithm: str,
+        model: Any,
+        scaler: Any,
+        feature_keys,
+        params: Optional[Dict[str, Any]] = None,
+        training_samples: int = 0,
+    ) -> RegisteredModel:
+        with self._lock:
+            previous = self._models.get(name)
+            entry = RegisteredModel(
+                name=name,
+                algorithm=algorithm,
+                model=model,
+                scaler=scaler,
+                feature_keys=tuple(feature_keys),
+                params=dict(params or {}),
+                trained_at=time.time(),
+                training_samples=int(training_samples),
+                version=(previous.version + 1) if previous else 1,
+            )
+            self._models[name] = entry
+            return entry
+
+    def get(self, name: str) -> Optional[RegisteredModel]:
+        with self._lock:
+            return self._models.get(name)
+
+    def list_models(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [m.describe() for m in self._models.values()]
+
+
+# Global instance
+model_registry = ModelRegistry()
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Body, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional, Dict, Any
 from datetime import datetime
 import csv
@@ -7,33 +8,62 @@ import os
 import tempfile
 import shutil
 from .service import service
-from .database import get_chat_history, save_chat_message, get_anomaly_event_by_id
+from .database import (
+    get_chat_history, save_chat_message, get_anomaly_event_by_id, get_anomaly_events_by_ids, query_anomaly_events
+)
 from .ml_analyzer import ml_analyzer
+from .scheduler import ml_scheduler
 from .statistical_baseline import statistical_baseline
-from .xlsx_importer import import_termoformatrice_xlsx
+from .streaming_detector import streaming_detector
+from .import_jobs import import_jobs, run_batch_import_job, run_xlsx_import
+from .batch_import import IMPORT_BATCH_ROOT, resolve_source
+from .import_cache import import_cache
+from .similarity_index import similarity_index
+from . import text_search
 from modules.realtime.database import get_samples_between
+from modules.foundation.long_poll import long_poll
 
 router = APIRouter(
     prefix="/api/anomaly",
     tags=["Anomaly Detection"]
 )
 
+# Upper bound of stored samples loaded for an interval ML analysis
+ML_INTERVAL_MAX_POINTS = 200_000
+
 @router.get("/status")
 def get_anomaly_status():
     last_reading = service.history[-1] if service.history else None
     return {
         "status": last_reading['status'] if last_reading else "calibrating",
-        "active_models": 1, 
+        # Per-sample detectors: the statistical baseline, plus Half-Space Trees when enabled
+        "active_models": 1 + int(service.detector.enabled),
         "model_ready": last_reading['model_ready'] if last_reading else False,
         "last_reading": last_reading
     }
 
 @router.get("/stream")
-def get_stream(limit: int = 60):
-    # Return last 'limit' points for charts. If limit is 0 or negative, return all.
-    if limit <= 0:
-        return service.history
-    return service.history[-limit:]
+async def get_stream(limit: int = 60, since: Optional[int] = None, wait: float = 0):
+    """
+    Last 'limit' points for charts (all if limit <= 0). With since (the "cursor"
+    of the previous response, 0 to start) only newer points are returned, as
+    {"items", "cursor", "reset"}; reset means the client missed points (or the
+    history was replaced) and must drop its buffer. wait > 0 holds the request
+    up to that many seconds until a point arrives.
+    """
+    if since is None:
+        if limit <= 0:
+            return service.history
+        return service.history[-limit:]
+    limit = limit if limit > 0 else 1000
+    state = {"reset": False}
+
+    def fetch():
+        items, state["reset"] = service.points_since(since, limit)
+        return items
+
+    items = await long_poll(service.points_feed, fetch, wait)
+    return {"items": items, "cursor": items[-1]["seq"] if items else since, "reset": state["reset"]}
 
 
 @router.get("/history")
@@ -45,8 +75,22 @@ def get_history(ts_from: float, ts_to: float, limit: int = 50_000):
     return get_samples_between(float(ts_from), float(ts_to), limit=limit)
 
 @router.get("/events")
-def get_events():
-    return service.events
+async def get_events(since: Optional[int] = None, wait: float = 0):
+    """
+    Latest events (newest first). since/wait as in /stream, with the events
+    recorded after the cursor.
+    """
+    if since is None:
+        return service.events
+    state = {"reset": False}
+
+    def fetch():
+        items, state["reset"] = service.events_since(since)
+        return items
+
+    items = await long_poll(service.events_feed, fetch, wait)
+    cursor = max(e.get("seq", 0) for e in items) if items else since
+    return {"items": items, "cursor": cursor, "reset": state["reset"]}
 
 @router.get("/source")
 def get_source():
@@ -57,6 +101,40 @@ def set_source(mode: str = Body(default="realtime")):
     new_mode = service.set_source_mode(mode)
     return {"mode": new_mode}
 
+@router.get("/events/history")
+def get_event_history(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    type: str = "",
+    ts_from: Optional[float] = None,
+    ts_to: Optional[float] = None,
+    signal: Optional[str] = None,
+    min_sigma: Optional[float] = None,
+    order: str = "desc",
+    details: bool = False,
+):
+    """
+    Stored anomaly events, keyset-paginated: pass back next_cursor to get the
+    following page. type is a comma-separated list (e.g. WARNING,CRITICAL);
+    signal keeps events where that signal deviated.
+    """
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    try:
+        return query_anomaly_events(
+            limit=max(1, min(int(limit), 1000)),
+            cursor=cursor,
+            types=[t.strip() for t in type.split(",") if t.strip()] or None,
+            ts_from=ts_from,
+            ts_to=ts_to,
+            signal=signal,
+            min_sigma=min_sigma,
+            ascending=order == "asc",
+            with_details=details,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/events/{event_id}")
 def get_event_by_id(event_id: int):
     """Get a specific anomaly event by ID"""
@@ -76,6 +154,59 @@ def get_event_chat(event_id: int):
     chat_history = get_chat_history(event_id)
     return {"anomaly_id": event_id, "messages": chat_history}
 
+@router.get("/events/{event_id}/similar")
+def get_similar_events(event_id: int, k: int = 5, with_chats: bool = False):
+    """
+    Past anomaly events nearest to this one (deviation signature, severity,
+    time of day, recipe). with_chats keeps only events that were diagnosed.
+    """
+    event = get_anomaly_event_by_id(event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    k = max(1, min(int(k), 100))
+    neighbours = similarity_index.search(event, k=k, exclude_id=event_id, with_chats=with_chats)
+    events = get_anomaly_events_by_ids([n["event_id"] for n in neighbours])
+    return {
+        "event_id": event_id,
+        "similar": [{**events[n["event_id"]], **n} for n in neighbours if n["event_id"] in events],
+        "query_ms": similarity_index.last_query_ms,
+    }
+
+@router.get("/similarity/index")
+def get_similarity_index():
+    """State of the similar-incident index"""
+    return similarity_index.get_stats()
+
+@router.get("/search")
+def search_text(
+    q: str,
+    sources: str = "",
+    ts_from: Optional[float] = None,
+    ts_to: Optional[float] = None,
+    chat_q: str = "",
+    limit: int = 20,
+    offset: int = 0,
+    raw: bool = False,
+):
+    """
+    Full-text search over anomaly events, rule events and diagnosis chats
+    (BM25 ranked, with highlighted snippets). sources is a comma-separated
+    subset of anomaly_events, realtime_events, anomaly_chats.
+    """
+    try:
+        return text_search.search(
+            q,
+            sources=[s.strip() for s in sources.split(",") if s.strip()] or None,
+            ts_from=ts_from,
+            ts_to=ts_to,
+            chat_q=chat_q or None,
+            limit=limit,
+            offset=offset,
+            raw=raw,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/events/{event_id}/chat")
 def add_chat_message(event_id: int, role: str, content: str):
     """Add a chat message to an anomaly event's history"""
@@ -94,46 +225,123 @@ def get_statistical_stats():
     """Get current statistical baseline statistics"""
     return statistical_baseline.get_current_stats()
 
-@router.post("/import/xlsx")
+@router.get("/ml/streaming")
+def get_streaming_detector_state():
+    """Get state of the online (Half-Space Trees) detector scoring each sample"""
+    return streaming_detector.get_state()
+
+@router.post("/import/xlsx", status_code=202)
 async def import_xlsx(
     file: UploadFile = File(...),
     electrical_mode: str = Form(default="three_phase"),
     max_points: int = Form(default=1000),
+    chunk_size: int = Form(default=5000),
+    persist: bool = Form(default=False),
+    use_cache: bool = Form(default=True),
 ):
     """
-    Import historical points from an XLSX file and switch service to file mode.
+    Start a background import of historical points from an XLSX file and return
+    its job id immediately. The workbook is streamed in chunks (bounded memory) on
+    the import worker pool; poll /api/anomaly/import/jobs/{job_id} for progress and
+    result. On completion the service switches to file mode with the imported
+    history swapped in at once. With persist=true every row is also stored in the
+    realtime samples database. Re-uploads of the same file with the same options
+    are served from the content-addressed import cache (use_cache=false to reparse).
     """
     tmp_path = None
     try:
         suffix = os.path.splitext(file.filename or "")[1] or ".xlsx"
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
             tmp_path = tmp.name
-            shutil.copyfileobj(file.file, tmp)
-
-        points, summary = import_termoformatrice_xlsx(tmp_path, electrical_mode=electrical_mode)
-        result = service.load_history_from_import(points, max_points=max_points, clear_events=True)
-
-        return {
-            "status": "success",
-            "mode": result["mode"],
-            "import_summary": {
-                "rows_total": summary.rows_total,
-                "rows_imported": summary.rows_imported,
-                "timestamp_min": summary.timestamp_min,
-                "timestamp_max": summary.timestamp_max,
-                "detected_columns": summary.detected_columns,
-            },
-            "points_loaded": result["points_loaded"],
-            "events_generated": result["events_generated"],
-        }
+            await run_in_threadpool(shutil.copyfileobj, file.file, tmp)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Import failed: {str(e)}")
-    finally:
         if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
+            os.unlink(tmp_path)
+        raise HTTPException(status_code=400, detail=f"Import failed: {str(e)}")
+
+    # The job owns the temporary file from here on and deletes it when it ends
+    job = import_jobs.create("xlsx", file.filename or "")
+    import_jobs.submit(
+        job,
+        run_xlsx_import,
+        tmp_path,
+        electrical_mode=electrical_mode,
+        max_points=max_points,
+        chunk_size=max(100, chunk_size),
+        persist=persist,
+        delete_file=True,
+        use_cache=use_cache,
+    )
+    return {"status": "accepted", "job_id": job.id, "job": job.to_dict()}
+
+@router.post("/import/batch", status_code=202)
+def import_batch(
+    source: str = Body(..., embed=True),
+    pattern: str = Body(default="*.xlsx", embed=True),
+    workers: Optional[int] = Body(default=None, embed=True),
+    electrical_mode: str = Body(default="three_phase", embed=True),
+    max_rows: int = Body(default=200_000, embed=True),
+    persist: bool = Body(default=False, embed=True),
+    load_device: Optional[str] = Body(default=None, embed=True),
+    max_points: int = Body(default=1000, embed=True),
+):
+    """
+    Start a parallel batch import of a server-side directory or glob of workbooks.
+    Files are parsed on a process pool, merged per device (from the file name) and
+    deduplicated by timestamp; the job result reports per-file timings and failures.
+    With persist=true merged samples are stored in the realtime samples database.
+    source is resolved under IMPORT_BATCH_ROOT; anything outside it is rejected.
+    """
+    try:
+        source = resolve_source(source, pattern)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = import_jobs.create("batch", source)
+    import_jobs.submit(
+        job,
+        run_batch_import_job,
+        source,
+        root=IMPORT_BATCH_ROOT,
+        load_device=load_device,
+        max_points=max_points,
+        pattern=pattern,
+        workers=workers,
+        electrical_mode=electrical_mode,
+        max_rows=max_rows,
+        persist=persist,
+    )
+    return {"status": "accepted", "job_id": job.id, "job": job.to_dict()}
+
+@router.get("/import/jobs")
+def list_import_jobs():
+    """List recent import jobs (newest first) with their progress"""
+    return import_jobs.list_jobs()
+
+@router.get("/import/jobs/{job_id}")
+def get_import_job(job_id: str):
+    """Get status/progress of an import job"""
+    job = import_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict()
+
+@router.get("/import/cache")
+def get_import_cache():
+    """Import cache usage and hit/miss counters"""
+    return import_cache.get_stats()
+
+@router.post("/import/cache/clear")
+def clear_import_cache():
+    """Drop all cached import results"""
+    return {"status": "success", "entries_deleted": import_cache.clear()}
+
+@router.post("/import/jobs/{job_id}/cancel")
+def cancel_import_job(job_id: str):
+    """Cancel a queued or running import job; the current data is left untouched"""
+    job = import_jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict()
 
 @router.get("/ml/algorithms")
 def get_ml_algorithms():
@@ -144,19 +352,25 @@ def get_ml_algorithms():
 def run_ml_analysis(
     algorithm: str = Body(default="isolation_forest"),
     window_size: int = Body(default=500),
-    params: Optional[Dict[str, Any]] = Body(default=None)
+    params: Optional[Dict[str, Any]] = Body(default=None),
+    ts_from: Optional[float] = Body(default=None),
+    ts_to: Optional[float] = Body(default=None)
 ):
     """
     Run ML-based anomaly analysis on recent historical data.
     This is an on-demand operation, not continuous.
     
     Args:
-        algorithm: One of 'isolation_forest', 'one_class_svm', 'dbscan'
+        algorithm: One of 'isolation_forest', 'one_class_svm', 'dbscan', 'matrix_profile', 'change_point'
         window_size: Number of recent data points to analyze (default 500)
         params: Optional algorithm-specific parameters
+        ts_from/ts_to: Optional interval; when given, stored samples (SQLite) are analyzed
+            instead of the in-memory history (up to ML_INTERVAL_MAX_POINTS points)
     """
+    if ts_from is not None and ts_to is not None:
+        data_points = get_samples_between(float(ts_from), float(ts_to), limit=ML_INTERVAL_MAX_POINTS)
     # Get recent data from history
-    if window_size <= 0:
+    elif window_size <= 0:
         data_points = service.history
     else:
         data_points = service.history[-window_size:] if len(service.history) >= window_size else service.history
@@ -180,6 +394,11 @@ def get_last_ml_analysis():
         raise HTTPException(status_code=404, detail="No ML analysis has been run yet")
     return result
 
+@router.get("/ml/schedule")
+def get_ml_schedule():
+    """Get scheduled ML jobs with their watermark, current model and last run result"""
+    return ml_scheduler.get_status()
+
 # Data management endpoints
 
 @router.get("/export/csv")
@@ -240,6 +459,7 @@ def clear_history(payload: Dict[str, Any] = Body(default=None)):
         # Reset statistical baseline
         from .statistical_baseline import StatisticalBaseline
         statistical_baseline.__dict__ = StatisticalBaseline().__dict__
+        streaming_detector.reset()
         
         return {
             "status": "success",
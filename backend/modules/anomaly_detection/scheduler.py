@@ -0,0 +1,297 @@
+"""
+Scheduled incremental ML analysis.
+
+Each configured job periodically scores only the realtime samples stored since its
+last run (watermark = last processed sample id, persisted in SQLite), using the
+model currently registered for the job. Models are retrained on a slower cadence.
+Anomalies found are persisted as anomaly events.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from .database import get_ml_job_state, save_anomaly_event, save_ml_job_state
+from .ml_analyzer import ml_analyzer
+from .model_registry import RegisteredModel, model_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEATURES = ("power", "voltage_v", "current_a", "power_factor")
+
+# Anomalous samples closer than this (seconds) are grouped into a single event
+EVENT_DEBOUNCE_S = 5.0
+
+
+@dataclass(frozen=True)
+class MLJob:
+    name: str
+    algorithm: str = "isolation_forest"
+    interval_s: float = 300.0
+    retrain_interval_s: float = 6 * 3600.0
+    train_window: int = 5000
+    batch_limit: int = 50_000
+    features: Tuple[str, ...] = DEFAULT_FEATURES
+    params: Dict[str, Any] = field(default_factory=dict)
+
+
+def _parse_jobs(raw: str) -> List[MLJob]:
+    """
+    Expect JSON like:
+      [
+        {"name":"electrical_if","algorithm":"isolation_forest","interval_s":300,
+         "retrain_interval_s":21600,"features":["power","current_a"],"params":{"contamination":0.02}}
+      ]
+    """
+    if not raw:
+        return []
+    try:
+        data = json.loads(raw)
+        out: List[MLJob] = []
+        for item in data:
+            algorithm = str(item.get("algorithm", "isolation_forest"))
+            if algorithm not in ml_analyzer.SCORABLE_ALGORITHMS:
+                raise ValueError(f"algorithm {algorithm} not schedulable")
+            out.append(
+                MLJob(
+                    name=str(item["name"]),
+                    algorithm=algorithm,
+                    interval_s=float(item.get("interval_s", 300.0)),
+                    retrain_interval_s=float(item.get("retrain_interval_s", 6 * 3600.0)),
+                    train_window=int(item.get("train_window", 5000)),
+                    batch_limit=int(item.get("batch_limit", 50_000)),
+                    features=tuple(item.get("features") or DEFAULT_FEATURES),
+                    params=dict(item.get("params") or {}),
+                )
+            )
+        return out
+    except Exception as e:
+        raise ValueError(f"Invalid ML_SCHEDULE_JOBS_JSON: {e}")
+
+
+def _default_jobs() -> List[MLJob]:
+    return [MLJob(name="electrical_isolation_forest")]
+
+
+class MLScheduler:
+    def __init__(self):
+        self.enabled = os.getenv("ML_SCHEDULE_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+        self.tick_s = float(os.getenv("ML_SCHEDULE_TICK_S", "5.0"))
+        raw_jobs = os.getenv("ML_SCHEDULE_JOBS_JSON", "").strip()
+        self.jobs: List[MLJob] = _default_jobs()
+        if raw_jobs:
+            try:
+                self.jobs = _parse_jobs(raw_jobs)
+            except ValueError as e:
+                # A bad setting must not stop the backend from importing
+                logger.warning(f"{e}; using the default jobs")
+
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        self._job_tasks: Dict[str, asyncio.Task] = {}
+        self._last_started: Dict[str, float] = {}
+        self._status: Dict[str, Dict[str, Any]] = {
+            job.name: {"runs": 0, "skipped_runs": 0, "last_error": None, "last_result": None}
+            for job in self.jobs
+        }
+
+    async def start(self):
+        """
+        Start the scheduler loop and return the running task (None when disabled).
+        """
+        if not self.enabled:
+            logger.info("ML scheduler disabled (ML_SCHEDULE_ENABLED=false)")
+            return None
+        if self.running and self._task:
+            return self._task
+        self.running = True
+        self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        self.running = False
+        tasks = [t for t in [self._task, *self._job_tasks.values()] if t]
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
+            try:
+                await asyncio.wait_for(t, timeout=2.0)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+            except Exception:
+                # keep shutdown resilient
+                pass
+        self._task = None
+        self._job_tasks.clear()
+
+    async def _loop(self):
+        logger.info(f"🗓️ ML scheduler started with {len(self.jobs)} job(s)")
+        while self.running:
+            now = time.time()
+            for job in self.jobs:
+                if now - self._last_started.get(job.name, 0.0) < job.interval_s:
+                    continue
+                running = self._job_tasks.get(job.name)
+                if running and not running.done():
+                    # Previous run still busy: skip this slot. Its samples are not lost,
+                    # the next run picks them up from the watermark (coalesced).
+                    self._status[job.name]["skipped_runs"] += 1
+                    logger.info(f"ML job {job.name} still running, skipping scheduled run")
+                    continue
+                self._last_started[job.name] = now
+                self._job_tasks[job.name] = asyncio.create_task(self._run_job(job))
+            await asyncio.sleep(self.tick_s)
+
+    async def _run_job(self, job: MLJob):
+        status = self._status[job.name]
+        try:
+            # Training and scoring are CPU-bound: keep them off the event loop
+            result = await asyncio.to_thread(self.run_job_once, job)
+            status["last_result"] = result
+            status["last_error"] = None
+        except Exception as e:
+            status["last_error"] = str(e)
+            logger.warning(f"ML job {job.name} failed: {e}")
+        finally:
+            status["runs"] += 1
+
+    def run_job_once(self, job: MLJob) -> Dict[str, Any]:
+        # Lazy import: realtime storage is owned by the realtime module
+        from modules.realtime.database import get_latest_samples, get_max_sample_id, get_samples_after_id
+
+        started = time.time()
+        state = get_ml_job_state(job.name)
+        registered = model_registry.get(job.name)
+        trained = False
+
+        if registered is None or started - registered.trained_at >= job.retrain_interval_s:
+            train_points = get_latest_samples(limit=job.train_window)
+            if len(train_points) < 20:
+                return {"status": "waiting_data", "samples_available": len(train_points), "ran_at": started}
+            registered = self._train(job, train_points)
+            trained = True
+
+        if state is None:
+            # First run: the training window is the reference, score only what comes next
+            state = {"last_sample_id": get_max_sample_id()}
+
+        watermark = int(state["last_sample_id"])
+        samples = get_samples_after_id(watermark, limit=job.batch_limit)
+        events_saved = 0
+        anomaly_count = 0
+        if samples:
+            result = ml_analyzer.score_points(registered.model, registered.scaler, samples, registered.feature_keys)
+            anomaly_count = result["anomaly_count"]
+            events_saved = self._persist_anomalies(job, registered, samples, result["anomalies"])
+            watermark = int(samples[-1]["id"])
+
+        save_ml_job_state(
+            job.name,
+            watermark,
+            last_run_at=started,
+            last_trained_at=registered.trained_at if trained else None,
+        )
+        return {
+            "status": "ok",
+            "ran_at": started,
+            "duration_s": time.time() - started,
+            "retrained": trained,
+            "model_version": registered.version,
+            "samples_scored": len(samples),
+            "anomaly_count": anomaly_count,
+            "events_saved": events_saved,
+            "watermark": watermark,
+        }
+
+    def _train(self, job: MLJob, train_points: List[Dict[str, Any]]) -> RegisteredModel:
+        model, scaler = ml_analyzer.train_model(train_points, job.algorithm, job.params, job.features)
+        registered = model_registry.register(
+            job.name,
+            job.algorithm,
+            model,
+            scaler,
+            job.features,
+            params=job.params,
+            training_samples=len(train_points),
+        )
+        logger.info(f"ML job {job.name}: trained {job.algorithm} v{registered.version} on {len(train_points)} samples")
+        return registered
+
+    def _persist_anomalies(
+        self,
+        job: MLJob,
+        registered: RegisteredModel,
+        samples: List[Dict[str, Any]],
+        anomalies: List[Dict[str, Any]],
+    ) -> int:
+        # Lazy import to avoid a cycle (service imports the anomaly database at import time)
+        from .service import service
+
+        groups: List[List[Dict[str, Any]]] = []
+        for anomaly in anomalies:
+            ts = float(anomaly.get("timestamp") or 0.0)
+            if groups and ts - float(groups[-1][-1].get("timestamp") or 0.0) <= EVENT_DEBOUNCE_S:
+                groups[-1].append(anomaly)
+            else:
+                groups.append([anomaly])
+
+        saved = 0
+        for group in groups:
+            worst = min(group, key=lambda a: a["score"])
+            sample = samples[worst["index"]]
+            event = {
+                "timestamp": worst["timestamp"],
+                "type": "WARNING",
+                "message": (
+                    f"ML anomaly detected ({ml_analyzer.ALGORITHMS[registered.algorithm]}, job {job.name}): "
+                    f"{len(group)} sample(s), min score {worst['score']:.3f}"
+                ),
+                "details": {
+                    "source": "ml_scheduler",
+                    "job": job.name,
+                    "algorithm": registered.algorithm,
+                    "model_version": registered.version,
+                    "score": worst["score"],
+                    "values": worst["values"],
+                    "sample_id": sample.get("id"),
+                    "samples_in_group": len(group),
+                    "timestamp_from": group[0]["timestamp"],
+                    "timestamp_to": group[-1]["timestamp"],
+                },
+            }
+            try:
+                event["id"] = save_anomaly_event(event)
+                saved += 1
+            except Exception as e:
+                logger.error(f"Failed to persist ML anomaly event: {e}")
+                continue
+            service.record_event(event)
+        return saved
+
+    def get_status(self) -> Dict[str, Any]:
+        jobs = []
+        for job in self.jobs:
+            registered = model_registry.get(job.name)
+            running = self._job_tasks.get(job.name)
+            jobs.append(
+                {
+                    "name": job.name,
+                    "algorithm": job.algorithm,
+                    "interval_s": job.interval_s,
+                    "retrain_interval_s": job.retrain_interval_s,
+                    "features": list(job.features),
+                    "running": bool(running and not running.done()),
+                    "state": get_ml_job_state(job.name),
+                    "model": registered.describe() if registered else None,
+                    **self._status[job.name],
+                }
+            )
+        return {"enabled": self.enabled, "running": self.running, "tick_s": self.tick_s, "jobs": jobs}
+
+
+ml_scheduler = MLScheduler()
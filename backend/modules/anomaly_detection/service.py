@@ -1,23 +1,43 @@
 import asyncio
+import copy
+import itertools
 import logging
-from typing import Any, Dict, List, Optional
-from .statistical_baseline import statistical_baseline
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from modules.foundation.long_poll import ChangeFeed
+from .statistical_baseline import StatisticalBaseline, statistical_baseline
+from .streaming_detector import streaming_detector
 from .database import init_database, save_anomaly_event, get_anomaly_events
 
 logger = logging.getLogger(__name__)
 
+# Sequence numbers of history points and events (the `since` cursors of
+# /stream and /events); shared by staged import services so they keep growing
+_point_seq = itertools.count(1)
+_event_seq = itertools.count(1)
+
 class AnomalyService:
-    def __init__(self):
+    def __init__(self, load_persisted: bool = True):
         self.history: List[Dict] = []
         self.events: List[Dict] = []
         self.running = False
         self.source_mode: str = "realtime"  # "realtime" | "file"
-        self._load_persisted_events()
+        self.baseline = statistical_baseline
+        self.detector = streaming_detector
+        # Guards the swap of history/events/baseline/detector after a background import
+        self._state_lock = threading.RLock()
+        # Wake long-polling /stream and /events requests
+        self.points_feed = ChangeFeed()
+        self.events_feed = ChangeFeed()
+        if load_persisted:
+            self._load_persisted_events()
         
     def _load_persisted_events(self):
         """Load previously saved events from database on startup"""
         try:
             self.events = get_anomaly_events(limit=50)
+            for event in reversed(self.events):
+                event["seq"] = next(_event_seq)
             logger.info(f"Loaded {len(self.events)} persisted anomaly events")
         except Exception as e:
             logger.warning(f"Could not load persisted events: {e}")
@@ -32,7 +52,8 @@ class AnomalyService:
                 from .serial_adapter import serial_source
                 data = serial_source.read_data()
                 if data:
-                    self._process_point(data, persist_event=True)
+                    with self._state_lock:
+                        self._process_point(data, persist_event=True)
 
             await asyncio.sleep(1)  # Read every 1s (Simulating 1Hz sample rate)
 
@@ -49,27 +70,38 @@ class AnomalyService:
         max_points: int = 1000,
         clear_events: bool = True,
     ) -> Dict[str, Any]:
-        # Reset baseline for a clean calibration on the imported dataset
-        from .statistical_baseline import StatisticalBaseline
-        statistical_baseline.__dict__ = StatisticalBaseline().__dict__
-
-        if clear_events:
-            self.events.clear()
-
-        self.history.clear()
-        self.set_source_mode("file")
+        """
+        Replay imported points into a fresh baseline/detector/history (clean calibration
+        on the imported dataset), then swap them in at once: readers keep seeing the
+        previous state until the replay is complete.
+        """
+        staged = AnomalyService(load_persisted=False)
+        staged.baseline = StatisticalBaseline()
+        staged.detector = copy.copy(self.detector)
+        staged.detector.reset()
+        staged.source_mode = "file"
 
         points_sorted = sorted(points, key=lambda p: float(p.get("timestamp", 0.0)))
         if len(points_sorted) > max_points:
             points_sorted = points_sorted[-max_points:]
 
         for p in points_sorted:
-            self._process_point(dict(p), persist_event=False)
+            staged._process_point(dict(p), persist_event=False)
+
+        with self._state_lock:
+            # Shared singletons keep their identity (routers hold references to them)
+            self.baseline.__dict__ = staged.baseline.__dict__
+            self.detector.__dict__ = staged.detector.__dict__
+            self.history = staged.history
+            self.events = staged.events if clear_events else (staged.events + self.events)[:50]
+            self.source_mode = staged.source_mode
+        self.points_feed.notify()
+        self.events_feed.notify()
 
         return {
             "mode": self.source_mode,
-            "points_loaded": len(self.history),
-            "events_generated": len(self.events),
+            "points_loaded": len(staged.history),
+            "events_generated": len(staged.events),
         }
 
     def _process_point(self, data: Dict[str, Any], persist_event: bool) -> Optional[Dict[str, Any]]:
@@ -87,7 +119,7 @@ class AnomalyService:
             "current_a": data.get("current_a"),
             "power_factor": data.get("power_factor"),
         }
-        analysis = statistical_baseline.add_signals(signals)
+        analysis = self.baseline.add_signals(signals)
 
         data["anomaly_score"] = analysis["risk_score"]
         data["status"] = analysis["status"]
@@ -95,9 +127,17 @@ class AnomalyService:
         data["stats"] = analysis["stats"]
         data["anomalies"] = analysis.get("anomalies", {})
 
+        # Online ML score (Half-Space Trees) alongside the statistical bands
+        ml = self.detector.update(signals)
+        data["ml_ready"] = ml["ready"]
+        data["ml_score"] = ml["anomaly_score"]
+        data["ml_anomaly"] = ml["is_anomaly"]
+
+        data["seq"] = next(_point_seq)
         self.history.append(data)
         if len(self.history) > 1000:
             self.history.pop(0)
+        self.points_feed.notify()
 
         if analysis["status"] in ["warning", "critical"]:
             if not self.events or (data["timestamp"] - self.events[0].get("timestamp", 0) > 5):
@@ -124,10 +164,52 @@ class AnomalyService:
                     except Exception as e:
                         logger.error(f"Failed to persist anomaly event: {e}")
 
-                self.events.insert(0, event)
-                if len(self.events) > 50:
-                    self.events.pop()
+                self.record_event(event)
 
         return data
 
+    def record_event(self, event: Dict[str, Any]):
+        """Add an event to the in-memory list (newest first, 50 kept); safe from worker threads"""
+        with self._state_lock:
+            event["seq"] = next(_event_seq)
+            self.events.insert(0, event)
+            if len(self.events) > 50:
+                self.events.pop()
+        self.events_feed.notify()
+
+    def points_since(self, since: int, limit: int = 1000) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        History points after the `since` sequence number (at most the last
+        `limit`), and whether the client must reset its buffer: points it has
+        not seen were dropped, or the history was replaced by an import.
+        """
+        history = self.history
+        if not history:
+            return [], False
+        first, last = history[0].get("seq", 0), history[-1].get("seq", 0)
+        if since >= last:
+            # Nothing new; a cursor from the future means the backend restarted
+            return ([], False) if since == last else (history[-limit:], True)
+        reset = since < first - 1
+        # Sequence numbers grow along the list: locate the cursor by bisection
+        lo, hi = 0, len(history)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if history[mid].get("seq", 0) <= since:
+                lo = mid + 1
+            else:
+                hi = mid
+        items = history[lo:]
+        return items[-limit:], reset or len(items) > limit
+
+    def events_since(self, since: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """Events after the `since` sequence number (newest first) and the reset flag"""
+        events = self.events
+        seqs = [e.get("seq", 0) for e in events]
+        if not seqs:
+            return [], False
+        if since > max(seqs):
+            return list(events), True
+        return [e for e in events if e.get("seq", 0) > since], since < min(seqs) - 1
+
 service = AnomalyService()
@@ -0,0 +1,280 @@
+"""
+Similar-incident index - nearest-neighbour search over stored anomaly events.
+
+Every event is reduced to a small feature vector (event_features): the signed
+σ deviation of each scored signal, the severity and source of the event, the ML
+score, the time of day and the recipe when the sample carries one. Vectors are
+written next to the event by save_anomaly_event (table anomaly_event_vectors),
+so the index grows incrementally and survives restarts; events stored before
+the index existed are backfilled on load.
+
+The vectors are kept in memory as one float32 matrix and searched exhaustively:
+with ~16 dimensions a query is a single matrix-vector product, a few
+milliseconds over hundreds of thousands of events, and exact (no ANN tuning).
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Signals scored by the anomaly service (one deviation dimension each)
+SIGNALS = ("temperature", "vibration", "power", "voltage_v", "current_a", "power_factor")
+RECIPE_BUCKETS = 4
+# Deviations are clipped to ±SIGMA_CLIP and scaled by 1/SIGMA_SCALE
+SIGMA_CLIP = 8.0
+SIGMA_SCALE = 4.0
+# Relative weight of each feature group in the euclidean distance
+W_FLAGGED = 1.0
+W_UNFLAGGED = 0.5
+W_STATUS = 0.5
+W_TIME = 0.35
+W_RECIPE = 0.35
+
+DIM = len(SIGNALS) + 2 + 2 + 2 + RECIPE_BUCKETS
+
+# Bump when the feature layout changes, so stored vectors are recomputed
+FEATURE_VERSION = 1
+
+BACKFILL_BATCH = 5000
+
+
+def _num(value: Any) -> Optional[float]:
+    try:
+        out = float(value)
+    except (TypeError, ValueError):
+        return None
+    return out if math.isfinite(out) else None
+
+
+def _sigma(value: float) -> float:
+    return max(-SIGMA_CLIP, min(SIGMA_CLIP, value)) / SIGMA_SCALE
+
+
+def event_features(event: Dict[str, Any]) -> np.ndarray:
+    """Feature vector of an anomaly event ({timestamp, type, message, details})"""
+    details = event.get("details") or {}
+    if not isinstance(details, dict):
+        details = {}
+    vec = np.zeros(DIM, dtype=np.float32)
+
+    # Signed deviation per signal: flagged signals from the detector, the others
+    # as z-score of their value against the baseline stats of the sample
+    anomalies = details.get("anomalies") or {}
+    stats = details.get("stats") or {}
+    for i, name in enumerate(SIGNALS):
+        info = anomalies.get(name)
+        if info:
+            sigma = _num(info.get("deviation_sigma")) or 0.0
+            vec[i] = W_FLAGGED * _sigma(-sigma if info.get("type") == "low" else sigma)
+            continue
+        value = _num(details.get(name))
+        ref = stats.get(name) or {}
+        mean, std = _num(ref.get("mean")), _num(ref.get("std"))
+        if value is not None and mean is not None and std:
+            vec[i] = W_UNFLAGGED * _sigma((value - mean) / std)
+
+    i = len(SIGNALS)
+    severity = str(event.get("type") or "").upper()
+    vec[i] = W_STATUS * (severity == "CRITICAL")
+    vec[i + 1] = W_STATUS * (severity == "WARNING")
+    # Scheduled ML detections have no per-signal deviations: keep them apart
+    vec[i + 2] = W_STATUS * (details.get("source") == "ml_scheduler")
+    ml_score = _num(details.get("ml_score")) if details.get("ml_ready") else None
+    vec[i + 3] = W_STATUS * min(max(ml_score or 0.0, 0.0), 1.0)
+
+    i += 4
+    ts = _num(event.get("timestamp"))
+    if ts is not None:
+        local = time.localtime(ts)
+        angle = 2 * math.pi * (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec) / 86400
+        vec[i] = W_TIME * math.sin(angle)
+        vec[i + 1] = W_TIME * math.cos(angle)
+
+    i += 2
+    recipe = details.get("recipe")
+    if recipe:
+        vec[i + zlib.crc32(str(recipe).encode("utf-8")) % RECIPE_BUCKETS] = W_RECIPE
+    return vec
+
+
+def store_vector(cursor, event_id: int, event: Dict[str, Any]) -> np.ndarray:
+    """Write the vector of a new event (called inside save_anomaly_event's transaction)"""
+    vec = event_features(event)
+    cursor.execute(
+        "INSERT OR REPLACE INTO anomaly_event_vectors (event_id, version, vector) VALUES (?, ?, ?)",
+        (int(event_id), FEATURE_VERSION, vec.tobytes()),
+    )
+    return vec
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._matrix = np.zeros((0, DIM), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._size = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.last_query_ms: Optional[float] = None
+
+    def _grow(self, needed: int):
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        ids = np.zeros(capacity, dtype=np.int64)
+        matrix = np.zeros((capacity, DIM), dtype=np.float32)
+        norms = np.zeros(capacity, dtype=np.float32)
+        ids[: self._size] = self._ids[: self._size]
+        matrix[: self._size] = self._matrix[: self._size]
+        norms[: self._size] = self._norms[: self._size]
+        self._ids, self._matrix, self._norms = ids, matrix, norms
+
+    def _append(self, ids: np.ndarray, vectors: np.ndarray):
+        n = len(ids)
+        self._grow(self._size + n)
+        self._ids[self._size: self._size + n] = ids
+        self._matrix[self._size: self._size + n] = vectors
+        self._norms[self._size: self._size + n] = np.einsum("ij,ij->i", vectors, vectors)
+        self._size += n
+
+    def add(self, event_id: int, vector: np.ndarray):
+        """Add a just-stored event (no-op until the index is loaded: load reads it from the DB)"""
+        with self._lock:
+            if self._loaded:
+                self._append(np.array([event_id], dtype=np.int64), vector.reshape(1, DIM))
+
+    def load(self) -> int:
+        """Backfill missing/outdated vectors, then read all of them into memory"""
+        with self._lock:
+            if self._loaded:
+                return self._size
+            started = time.perf_counter()
+            backfilled = self._backfill()
+            with get_db_connection() as conn:
+                rows = conn.execute(
+                    "SELECT event_id, vector FROM anomaly_event_vectors WHERE version = ? ORDER BY event_id",
+                    (FEATURE_VERSION,),
+                ).fetchall()
+            self._size = 0
+            if rows:
+                ids = np.fromiter((r["event_id"] for r in rows), dtype=np.int64, count=len(rows))
+                vectors = np.frombuffer(b"".join(r["vector"] for r in rows), dtype=np.float32).reshape(-1, DIM)
+                self._append(ids, vectors)
+            self._loaded = True
+            logger.info(
+                f"Similarity index loaded: {self._size} events ({backfilled} backfilled) "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            return self._size
+
+    def _backfill(self) -> int:
+        done = 0
+        while True:
+            with get_db_connection() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT e.id, e.timestamp, e.type, e.details
+                    FROM anomaly_events e
+                    LEFT JOIN anomaly_event_vectors v ON v.event_id = e.id AND v.version = ?
+                    WHERE v.event_id IS NULL
+                    LIMIT ?
+                    """,
+                    (FEATURE_VERSION, BACKFILL_BATCH),
+                ).fetchall()
+                if not rows:
+                    return done
+                cursor = conn.cursor()
+                for row in rows:
+                    try:
+                        details = json.loads(row["details"]) if row["details"] else {}
+                    except ValueError:
+                        details = {}
+                    store_vector(cursor, row["id"], {"timestamp": row["timestamp"], "type": row["type"], "details": details})
+                conn.commit()
+            done += len(rows)
+
+    def reset(self):
+        """Forget the in-memory index (reloaded on the next query)"""
+        with self._lock:
+            self._size = 0
+            self._loaded = False
+
+    def _nearest(self, query: np.ndarray, exclude_id: Optional[int], n: int, allowed: Optional[List[int]]) -> List[tuple]:
+        """(event_id, distance) of the n nearest events (among allowed ids when given), nearest first"""
+        with self._lock:
+            size = self._size
+            if size == 0:
+                return []
+            matrix, norms, ids = self._matrix[:size], self._norms[:size], self._ids[:size]
+            # |x - q|^2 = |x|^2 - 2 x.q + |q|^2
+            dist = norms - 2.0 * (matrix @ query) + float(query @ query)
+            if allowed is not None:
+                dist[~np.isin(ids, np.asarray(allowed, dtype=np.int64))] = np.inf
+            if exclude_id is not None:
+                dist[ids == exclude_id] = np.inf
+            n = min(n, size)
+            top = np.argpartition(dist, n - 1)[:n] if n < size else np.arange(size)
+            top = top[np.argsort(dist[top], kind="stable")]
+            return [
+                (int(ids[j]), math.sqrt(max(float(dist[j]), 0.0)))
+                for j in top if np.isfinite(dist[j])
+            ]
+
+    def search(
+        self,
+        event: Dict[str, Any],
+        k: int = 5,
+        exclude_id: Optional[int] = None,
+        with_chats: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        The k stored events nearest to event, as {event_id, distance, similarity}.
+        with_chats keeps only events that have a diagnosis chat.
+        """
+        if not self._loaded:
+            self.load()
+        started = time.perf_counter()
+        query = event_features(event)
+        exclude_id = int(exclude_id) if exclude_id is not None else None
+        # Diagnosed events are a small subset: restrict the scan to them
+        allowed = self._chatted_events() if with_chats else None
+        nearest = self._nearest(query, exclude_id, k, allowed)
+        with self._lock:
+            self.queries += 1
+            self.last_query_ms = round((time.perf_counter() - started) * 1000, 3)
+        return [
+            {"event_id": event_id, "distance": round(distance, 4), "similarity": round(1.0 / (1.0 + distance), 4)}
+            for event_id, distance in nearest
+        ]
+
+    @staticmethod
+    def _chatted_events() -> List[int]:
+        with get_db_connection() as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT anomaly_id FROM anomaly_chats")]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "events": self._size,
+                "dimensions": DIM,
+                "memory_bytes": int(self._matrix.nbytes + self._ids.nbytes + self._norms.nbytes),
+                "queries": self.queries,
+                "last_query_ms": self.last_query_ms,
+            }
+
+
+similarity_index = SimilarityIndex()
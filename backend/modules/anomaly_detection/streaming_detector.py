@@ -0,0 +1,276 @@
+"""
+Streaming ML Anomaly Detector - Half-Space Trees (Tan, Ting & Liu, 2011)
+Online per-sample scoring with O(depth x trees) cost per update and fixed memory.
+"""
+import os
+import numpy as np
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SIGNALS = ('temperature', 'vibration', 'power', 'voltage_v', 'current_a', 'power_factor')
+
+# Fraction of the warm-up range added on each side when scaling to the unit cube
+RANGE_PADDING = 1.0
+
+
+class HalfSpaceTrees:
+    """
+    Ensemble of random half-space trees over min-max scaled signals.
+
+    Mass profiles are kept for two tumbling windows: the reference window (used for
+    scoring) and the latest window (being filled). Every `window_size` samples the
+    latest window becomes the new reference, so the model follows slow drifts.
+    Low mass in the region where a sample falls means the sample is anomalous.
+
+    Each tree contributes log2(1 + mass x 2^level) rather than the raw mass
+    profile, so a few trees that fail to isolate a spike cannot outweigh the many
+    that put it in an empty region. The threshold is the `quantile` of the
+    leave-one-out scores of the last `calibration_windows` reference windows.
+    """
+
+    def __init__(
+        self,
+        n_trees: int = 25,
+        depth: int = 10,
+        window_size: int = 250,
+        size_limit: Optional[float] = None,
+        quantile: float = 0.005,
+        signals: Sequence[str] = DEFAULT_SIGNALS,
+        seed: int = 42,
+        calibration_windows: int = 4,
+        enabled: bool = True
+    ):
+        """
+        Args:
+            n_trees: Number of trees in the ensemble
+            depth: Depth of each (complete) tree
+            window_size: Samples per window; also the warm-up length used to learn signal ranges
+            size_limit: Minimum reference mass to descend further (default 10% of window_size)
+            quantile: Fraction of reference-window scores below which a sample is anomalous
+            signals: Candidate signal names; only those seen during warm-up are used
+            calibration_windows: Reference windows whose scores set the threshold
+            enabled: When False, update() is a no-op that never flags a sample
+        """
+        self.n_trees = n_trees
+        self.depth = depth
+        self.window_size = window_size
+        self.size_limit = size_limit if size_limit is not None else 0.1 * window_size
+        self.quantile = quantile
+        self.candidate_signals = tuple(signals)
+        self.seed = seed
+        self.calibration_windows = max(1, calibration_windows)
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Drop the trees and all window state (e.g. when the data source changes)"""
+        self._rng = np.random.default_rng(self.seed)
+        self.signals: List[str] = []
+        self.is_ready = False
+        self.samples_seen = 0
+
+        # Warm-up buffer over all candidate signals (NaN = missing)
+        self._warmup = np.full((self.window_size, len(self.candidate_signals)), np.nan)
+        self._warmup_count = 0
+
+        n_nodes = 2 ** (self.depth + 1) - 1
+        self._split_dim = np.zeros((self.n_trees, n_nodes), dtype=np.intp)
+        self._split_val = np.zeros((self.n_trees, n_nodes))
+        self._r_mass = np.zeros((self.n_trees, n_nodes))
+        self._l_mass = np.zeros((self.n_trees, n_nodes))
+        self._tree_idx = np.arange(self.n_trees)
+        self._level_weight = 2.0 ** np.arange(self.depth + 1)
+
+        self._offset = np.zeros(0)
+        self._scale = np.ones(0)
+        self._fill = np.zeros(0)
+        self._window_count = 0
+
+        # Tree paths of the window being filled: once it becomes the reference they
+        # are re-scored against it to set the threshold
+        self._window_paths = np.zeros((self.window_size, self.n_trees, self.depth + 1), dtype=np.int32)
+        # Leave-one-out scores of the latest reference windows
+        self._calibration = deque(maxlen=self.calibration_windows)
+        self._threshold: Optional[float] = None
+        self._ref_median: Optional[float] = None
+
+    def update(self, signals: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Score a sample against the reference window, then learn it into the latest window.
+
+        Returns:
+            Dict with ready flag, raw mass score, normalized anomaly score (0-1) and anomaly flag
+        """
+        if not self.enabled:
+            return {'ready': False, 'score': None, 'anomaly_score': 0.0, 'is_anomaly': False}
+        self.samples_seen += 1
+        if not self.is_ready:
+            self._add_warmup(signals)
+            return {'ready': False, 'score': None, 'anomaly_score': 0.0, 'is_anomaly': False}
+
+        x = self._vectorize(signals)
+        path = self._path(x)
+
+        score = self._score_path(path)
+        self._l_mass[self._tree_idx[:, None], path] += 1
+        self._window_paths[self._window_count] = path
+        self._window_count += 1
+        if self._window_count >= self.window_size:
+            self._swap_windows()
+
+        anomaly_score = 0.0
+        if self._ref_median:
+            anomaly_score = float(min(max(1.0 - score / self._ref_median, 0.0), 1.0))
+        is_anomaly = self._threshold is not None and score < self._threshold
+
+        return {
+            'ready': True,
+            'score': score,
+            'anomaly_score': anomaly_score,
+            'is_anomaly': bool(is_anomaly),
+        }
+
+    def _add_warmup(self, signals: Dict[str, Any]):
+        row = self._warmup[self._warmup_count]
+        for j, name in enumerate(self.candidate_signals):
+            value = signals.get(name)
+            if isinstance(value, (int, float)) and np.isfinite(value):
+                row[j] = value
+        self._warmup_count += 1
+        if self._warmup_count >= self.window_size:
+            self._build()
+
+    def _build(self):
+        """Learn signal ranges from warm-up, grow random trees, and seed the reference window"""
+        seen = ~np.all(np.isnan(self._warmup), axis=0)
+        if not seen.any():
+            # Nothing numeric yet: restart warm-up
+            self._warmup[:] = np.nan
+            self._warmup_count = 0
+            return
+
+        data = self._warmup[:, seen]
+        self.signals = [s for s, keep in zip(self.candidate_signals, seen) if keep]
+        # Pad the observed range so warm-up data fills the middle half of the unit
+        # cube: values beyond it then fall in empty half-spaces instead of sharing
+        # the boundary cells with normal data.
+        lo = np.nanmin(data, axis=0)
+        hi = np.nanmax(data, axis=0)
+        span = np.where(hi - lo > 0, hi - lo, np.maximum(np.abs(hi), 1.0))
+        self._offset = lo - RANGE_PADDING * span
+        self._scale = 1.0 / ((1.0 + 2.0 * RANGE_PADDING) * span)
+        self._fill = (np.nanmean(data, axis=0) - self._offset) * self._scale
+
+        # Random half-space construction over the unit cube: each tree gets a
+        # random work range per dimension, then nodes split at range midpoints.
+        n_dims = len(self.signals)
+        n_internal = 2 ** self.depth - 1
+        for t in range(self.n_trees):
+            s = self._rng.uniform(0.0, 1.0, n_dims)
+            half = np.maximum(s, 1.0 - s)
+            mins = np.empty((2 ** (self.depth + 1) - 1, n_dims))
+            maxs = np.empty_like(mins)
+            mins[0] = s - half
+            maxs[0] = s + half
+            for node in range(n_internal):
+                q = self._rng.integers(n_dims)
+                mid = (mins[node, q] + maxs[node, q]) / 2.0
+                self._split_dim[t, node] = q
+                self._split_val[t, node] = mid
+                left, right = 2 * node + 1, 2 * node + 2
+                mins[left], maxs[left] = mins[node], maxs[node]
+                mins[right], maxs[right] = mins[node], maxs[node]
+                maxs[left, q] = mid
+                mins[right, q] = mid
+
+        scaled = np.where(np.isnan(data), np.nanmean(data, axis=0), data)
+        scaled = (scaled - self._offset) * self._scale
+        for x in scaled:
+            self._l_mass[self._tree_idx[:, None], self._path(x)] += 1
+        self._r_mass = self._l_mass.copy()
+        self._l_mass[:] = 0.0
+
+        # Initial threshold from the warm-up itself, scored against its own profile
+        self._set_threshold(self._score_paths(np.stack([self._path(x) for x in scaled])))
+
+        self.is_ready = True
+        self._warmup = np.zeros((0, 0))
+        logger.info(f"Half-Space Trees ready on {n_dims} signal(s): {', '.join(self.signals)}")
+
+    def _vectorize(self, signals: Dict[str, Any]) -> np.ndarray:
+        x = self._fill.copy()
+        for j, name in enumerate(self.signals):
+            value = signals.get(name)
+            if isinstance(value, (int, float)) and np.isfinite(value):
+                x[j] = (value - self._offset[j]) * self._scale[j]
+        return x
+
+    def _path(self, x: np.ndarray) -> np.ndarray:
+        """Node indices visited in every tree, shape (n_trees, depth + 1)"""
+        path = np.empty((self.depth + 1, self.n_trees), dtype=np.intp)
+        node = np.zeros(self.n_trees, dtype=np.intp)
+        path[0] = node
+        for level in range(1, self.depth + 1):
+            go_right = x[self._split_dim[self._tree_idx, node]] > self._split_val[self._tree_idx, node]
+            node = 2 * node + 1 + go_right
+            path[level] = node
+        return path.T
+
+    def _score_path(self, path: np.ndarray) -> float:
+        # Stop at the first node whose reference mass is below size_limit (or at the leaf)
+        mass = self._r_mass[self._tree_idx[:, None], path]
+        stop = mass < self.size_limit
+        stop[:, -1] = True
+        level = np.argmax(stop, axis=1)
+        return float(np.sum(np.log2(1.0 + mass[self._tree_idx, level] * self._level_weight[level])))
+
+    def _score_paths(self, paths: np.ndarray) -> np.ndarray:
+        """
+        Leave-one-out scores of samples learned into the reference window, shape
+        (n, n_trees, depth + 1): each sample's own unit of mass is left out, so its
+        score is what a new sample at that point would get.
+        """
+        mass = self._r_mass[self._tree_idx[None, :, None], paths] - 1.0
+        stop = mass < self.size_limit
+        stop[:, :, -1] = True
+        level = np.argmax(stop, axis=2)
+        picked = np.take_along_axis(mass, level[:, :, None], axis=2)[:, :, 0]
+        return np.sum(np.log2(1.0 + picked * self._level_weight[level]), axis=1)
+
+    def _swap_windows(self):
+        self._r_mass, self._l_mass = self._l_mass, self._r_mass
+        self._l_mass[:] = 0.0
+        # Threshold from the new reference, which is the one scoring the next window
+        self._set_threshold(self._score_paths(self._window_paths))
+        self._window_count = 0
+
+    def _set_threshold(self, scores: np.ndarray):
+        self._calibration.append(scores)
+        pooled = np.concatenate(self._calibration)
+        self._threshold = float(np.quantile(pooled, self.quantile))
+        self._ref_median = float(np.median(pooled)) or None
+
+    def get_state(self) -> Dict[str, Any]:
+        """Get detector configuration and progress"""
+        return {
+            'algorithm': 'half_space_trees',
+            'enabled': self.enabled,
+            'is_ready': self.is_ready,
+            'signals': self.signals,
+            'n_trees': self.n_trees,
+            'depth': self.depth,
+            'window_size': self.window_size,
+            'samples_seen': self.samples_seen,
+            'warmup_remaining': 0 if self.is_ready else self.window_size - self._warmup_count,
+            'threshold': self._threshold,
+        }
+
+
+# Global instance
+streaming_detector = HalfSpaceTrees(
+    enabled=os.getenv("STREAMING_ML_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+)
@@ -0,0 +1,231 @@
+"""
+Full-text search over anomaly events, rule events and diagnosis chats.
+
+Each searchable column has an external-content FTS5 table next to its source
+table, kept in sync by triggers, so every writer (anomaly service, ML scheduler,
+collector rules, diagnosis chats) is indexed without knowing about it:
+
+    anomaly DB:  anomaly_events.message  -> anomaly_events_fts
+                 anomaly_chats.content   -> anomaly_chats_fts
+    realtime DB: realtime_events.message -> realtime_events_fts
+
+A search runs the MATCH on each requested source (BM25 score, highlighted
+snippets, time range on the source table), then merges the sources by score.
+BM25 statistics are per table, so the cross-source order is approximate.
+"""
+from __future__ import annotations
+
+import logging
+import re
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from . import database as anomaly_db
+
+logger = logging.getLogger(__name__)
+
+# (fts table, source table, indexed column)
+ANOMALY_FTS = (
+    ("anomaly_events_fts", "anomaly_events", "message"),
+    ("anomaly_chats_fts", "anomaly_chats", "content"),
+)
+REALTIME_FTS = (("realtime_events_fts", "realtime_events", "message"),)
+
+SOURCES = ("anomaly_events", "realtime_events", "anomaly_chats")
+MAX_LIMIT = 200
+SNIPPET_TOKENS = 16
+HIGHLIGHT = ("<mark>", "</mark>")
+
+_TERM_RE = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def _ensure_fts(conn, fts: str, table: str, column: str):
+    """Create the FTS table and its sync triggers; index the existing rows once"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+    ).fetchone()
+    conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{column}, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+            INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});
+        END
+        """
+    )
+    if not exists:
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        logger.info(f"Full-text index {fts} built over {table}.{column}")
+
+
+def init_db():
+    # Lazy import: realtime storage is owned by the realtime module
+    from modules.realtime import database as realtime_db
+
+    for get_conn, specs in ((anomaly_db.get_db_connection, ANOMALY_FTS), (realtime_db.get_db_connection, REALTIME_FTS)):
+        with get_conn() as conn:
+            for fts, table, column in specs:
+                _ensure_fts(conn, fts, table, column)
+            conn.commit()
+
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Plain search text to an FTS5 query: every word must match (prefix with a
+    trailing *). Operators and punctuation are dropped, so user input never
+    raises a syntax error; use raw=True in search() for the FTS5 syntax.
+    """
+    terms = []
+    for term in _TERM_RE.findall(text or ""):
+        prefix = term.endswith("*")
+        word = term.rstrip("*")
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+
+def _search_source(
+    conn, source: str, match: str, ts_from: Optional[float], ts_to: Optional[float],
+    n: int, chat_match: Optional[str],
+) -> List[Dict[str, Any]]:
+    fts = f"{source}_fts"
+    where = [f"{fts} MATCH ?"]
+    params: List[Any] = [match]
+    if source == "anomaly_chats":
+        # Chats only carry created_at (UTC text)
+        ts_expr = "CAST(strftime('%s', t.created_at) AS REAL)"
+        extra = "t.anomaly_id, t.role, t.created_at,"
+    else:
+        ts_expr = "t.timestamp"
+        extra = "t.type,"
+    if ts_from is not None:
+        where.append(f"{ts_expr} >= ?")
+        params.append(float(ts_from))
+    if ts_to is not None:
+        where.append(f"{ts_expr} <= ?")
+        params.append(float(ts_to))
+    if source != "anomaly_chats" and (ts_from is not None or ts_to is not None):
+        # Rowid range of the time window (timestamp index): FTS5 then only walks
+        # the matches inside it instead of ranking every match in the history
+        bounds = conn.execute(
+            f"SELECT MIN(id), MAX(id) FROM {source} WHERE timestamp >= ? AND timestamp <= ?",
+            (float(ts_from) if ts_from is not None else float("-inf"), float(ts_to) if ts_to is not None else float("inf")),
+        ).fetchone()
+        if bounds[0] is None:
+            return []
+        where.append(f"{fts}.rowid BETWEEN ? AND ?")
+        params.extend(bounds)
+    if chat_match and source == "anomaly_events":
+        where.append(
+            "t.id IN (SELECT c.anomaly_id FROM anomaly_chats_fts "
+            "JOIN anomaly_chats c ON c.id = anomaly_chats_fts.rowid WHERE anomaly_chats_fts MATCH ?)"
+        )
+        params.append(chat_match)
+    rows = conn.execute(
+        f"""
+        SELECT t.id, {ts_expr} AS ts, {extra}
+               -bm25({fts}) AS score,
+               snippet({fts}, 0, ?, ?, '…', ?) AS snippet
+        FROM {fts}
+        JOIN {source} t ON t.id = {fts}.rowid
+        WHERE {" AND ".join(where)}
+        ORDER BY score DESC
+        LIMIT ?
+        """,
+        [HIGHLIGHT[0], HIGHLIGHT[1], SNIPPET_TOKENS, *params, n],
+    ).fetchall()
+    out = []
+    for row in rows:
+        hit = {
+            "source": source,
+            "id": row["id"],
+            "timestamp": row["ts"],
+            "score": row["score"],
+            "snippet": row["snippet"],
+        }
+        if source == "anomaly_chats":
+            hit.update({"anomaly_id": row["anomaly_id"], "role": row["role"], "created_at": row["created_at"]})
+        else:
+            hit["type"] = row["type"]
+        out.append(hit)
+    return out
+
+
+def search(
+    q: str,
+    sources: Optional[List[str]] = None,
+    ts_from: Optional[float] = None,
+    ts_to: Optional[float] = None,
+    chat_q: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+    raw: bool = False,
+) -> Dict[str, Any]:
+    """
+    Ranked matches of q in the requested sources (all by default), best first.
+    chat_q returns only anomaly events, those whose diagnosis chat matches it
+    ("events mentioning vibration with chats about bearings").
+    Raises ValueError for an empty query, unknown source or invalid FTS5 syntax.
+    """
+    from modules.realtime import database as realtime_db
+
+    started = time.perf_counter()
+    match = (q or "").strip() if raw else fts_query(q)
+    if not match:
+        raise ValueError("Empty search query")
+    chat_match = None
+    if chat_q:
+        chat_match = chat_q.strip() if raw else fts_query(chat_q)
+    sources = list(sources or SOURCES)
+    unknown = [s for s in sources if s not in SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown source(s): {', '.join(unknown)}")
+    if chat_match:
+        sources = ["anomaly_events"]
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    offset = max(0, int(offset))
+
+    # Each source contributes its best offset+limit hits; the merged page is cut from them
+    n = offset + limit + 1
+    hits: List[Dict[str, Any]] = []
+    try:
+        with anomaly_db.get_db_connection() as conn:
+            for source in ("anomaly_events", "anomaly_chats"):
+                if source in sources:
+                    hits.extend(_search_source(conn, source, match, ts_from, ts_to, n, chat_match))
+        if "realtime_events" in sources:
+            with realtime_db.get_db_connection() as conn:
+                hits.extend(_search_source(conn, "realtime_events", match, ts_from, ts_to, n, None))
+    except sqlite3.OperationalError as e:
+        # FTS5 reports query syntax errors (e.g. an unterminated string) at MATCH time
+        raise ValueError(f"Invalid search query: {e}")
+
+    # Rank on the exact scores: rounding would tie common-term matches
+    hits.sort(key=lambda h: -h["score"])
+    page = [dict(h, score=round(h["score"], 4)) for h in hits[offset: offset + limit]]
+    return {
+        "query": match,
+        "results": page,
+        "offset": offset,
+        "limit": limit,
+        "has_more": len(hits) > offset + limit,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import math
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from datetime import time as dt_time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
 
@@ -41,30 +43,38 @@ def _first_present(mapping: Dict[str, List[str]], normalized_cols: Dict[str, str
     return first_key, detected
 
 
-def _to_float(val: Any) -> Optional[float]:
-    if val is None:
-        return None
-    try:
-        if isinstance(val, str):
-            v = val.strip().replace(",", ".")
-            if v == "":
-                return None
-            return float(v)
-        return float(val)
-    except Exception:
-        return None
+def _to_float_series(series: pd.Series) -> np.ndarray:
+    """Column-wise equivalent of _to_float: comma decimals accepted, invalid -> NaN."""
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    text = series.astype(str).str.strip().str.replace(",", ".", regex=False)
+    return pd.to_numeric(text, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _time_of_day(time_series: pd.Series) -> pd.Series:
+    """Time-of-day offsets from datetime.time objects, datetimes or 'HH:MM[:SS]' strings."""
+    first = time_series.dropna().head(1)
+    if not first.empty and isinstance(first.iloc[0], dt_time):
+        # openpyxl yields datetime.time cells: pandas has no vectorized parser for them
+        seconds = np.fromiter(
+            (
+                t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1e6 if isinstance(t, dt_time) else np.nan
+                for t in time_series
+            ),
+            dtype=float,
+            count=len(time_series),
+        )
+        return pd.Series(pd.to_timedelta(seconds, unit="s"), index=time_series.index)
+    parsed = pd.to_datetime(time_series, errors="coerce", format="mixed")
+    return parsed - parsed.dt.normalize()
 
 
 def _build_timestamp(df: pd.DataFrame, date_col: str, time_col: str) -> pd.Series:
     date_series = df[date_col]
     time_series = df[time_col]
 
-    dt = pd.to_datetime(date_series, errors="coerce")
-    t = pd.to_datetime(time_series, errors="coerce").dt.time
-    combined = pd.to_datetime(
-        dt.dt.date.astype(str) + " " + t.astype(str),
-        errors="coerce",
-    )
+    dt = pd.to_datetime(date_series, errors="coerce").dt.normalize()
+    combined = dt + _time_of_day(time_series)
 
     if combined.isna().all():
         combined = pd.to_datetime(date_series.astype(str) + " " + time_series.astype(str), errors="coerce")
@@ -72,83 +82,242 @@ def _build_timestamp(df: pd.DataFrame, date_col: str, time_col: str) -> pd.Serie
     return combined
 
 
-def import_termoformatrice_xlsx(
-    file_path: str,
+def _to_epoch_seconds(ts: pd.Series) -> np.ndarray:
+    # Unit-agnostic (pandas may store datetimes as ns or us)
+    return ((ts - pd.Timestamp(0)) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+
+
+def _parse_timestamp_column(series: pd.Series) -> np.ndarray:
+    """Single timestamp column: epoch seconds/milliseconds or date-time strings."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return _to_epoch_seconds(series)
+    numeric = _to_float_series(series)
+    if np.isfinite(numeric).any():
+        # Epoch milliseconds (e.g. JS Date.now()) are > 1e11 until year 5138
+        return np.where(numeric > 1e11, numeric / 1000.0, numeric)
+    return _to_epoch_seconds(pd.to_datetime(series, errors="coerce", format="mixed"))
+
+
+def _read_excel(file_path: str) -> pd.DataFrame:
+    """Read the first sheet, using the (much faster) calamine engine when installed."""
+    try:
+        import python_calamine  # noqa: F401
+        return pd.read_excel(file_path, engine="calamine")
+    except ImportError:
+        return pd.read_excel(file_path)
+
+
+COL_MAP = {
+    "timestamp": ["timestamp", "ts", "datetime", "data e ora", "data/ora"],
+    "date": ["data", "date", "giorno"],
+    "time": ["ora", "time"],
+    "energy_total_kwh": ["energia consumata totale (kwh)", "energia consumata totale", "energia totale (kwh)", "energia totale", "energy_total_kwh"],
+    "energy_grid_kwh": ["energia prelevata dalla rete (kwh)", "energia prelevata dalla rete", "energy_grid_kwh"],
+    "energy_self_kwh": ["energia autoconsumata (kwh)", "energia autoconsumata", "energy_self_kwh"],
+    "reactive_varh": ["energia reattiva (varh)", "energia reattiva", "reactive_varh"],
+    "power_factor": ["fattore di potenza (units)", "fattore di potenza", "cosφ", "cosfi", "cosphi", "power_factor"],
+    "voltage_v": ["tensione (v)", "tensione", "voltage (v)", "voltage", "voltage_v"],
+    "current_a": ["corrente (a)", "corrente", "current (a)", "current", "current_a"],
+    "power_kw": ["potenza (kw)", "power (kw)", "power_kw", "power"],
+}
+
+# Output columns (in record order); "power" mirrors power_kw for existing dashboards/baseline
+SIGNAL_KEYS = (
+    "voltage_v",
+    "current_a",
+    "power_factor",
+    "power_kw",
+    "energy_total_kwh",
+    "energy_grid_kwh",
+    "energy_self_kwh",
+    "reactive_varh",
+)
+# Record keys produced by the importer itself, never taken from extra columns
+RESERVED_KEYS = frozenset(("timestamp", "power", "device", *SIGNAL_KEYS))
+
+
+def frame_to_columns(
+    df: pd.DataFrame,
     max_rows: int = 200_000,
     electrical_mode: str = "three_phase",
-) -> Tuple[List[Dict[str, Any]], ImportSummary]:
-    df = pd.read_excel(file_path)
+    keep_extra: bool = False,
+) -> Tuple[Dict[str, np.ndarray], ImportSummary]:
+    """
+    Normalize a raw sheet into typed float64 column arrays sorted by timestamp.
+    Keys: "timestamp" plus SIGNAL_KEYS (missing values are NaN). With keep_extra,
+    unmapped columns are also returned under their own name, in their own dtype.
+    """
     rows_total = int(len(df))
     if rows_total == 0:
-        return [], ImportSummary(0, 0, None, None, {})
+        return {}, ImportSummary(0, 0, None, None, {})
 
     if rows_total > max_rows:
-        df = df.iloc[-max_rows:].copy()
+        df = df.iloc[-max_rows:]
 
     normalized_cols = {_normalize_col(c): c for c in df.columns}
-
-    col_map = {
-        "date": ["data", "date", "giorno"],
-        "time": ["ora", "time"],
-        "energy_total_kwh": ["energia consumata totale (kwh)", "energia consumata totale", "energia totale (kwh)", "energia totale"],
-        "energy_grid_kwh": ["energia prelevata dalla rete (kwh)", "energia prelevata dalla rete"],
-        "energy_self_kwh": ["energia autoconsumata (kwh)", "energia autoconsumata"],
-        "reactive_varh": ["energia reattiva (varh)", "energia reattiva"],
-        "power_factor": ["fattore di potenza (units)", "fattore di potenza", "cosφ", "cosfi", "cosphi"],
-        "voltage_v": ["tensione (v)", "tensione", "voltage (v)", "voltage"],
-        "current_a": ["corrente (a)", "corrente", "current (a)", "current"],
-        "power_kw": ["potenza (kw)", "power (kw)", "power_kw", "power"],
-    }
-
-    _, detected = _first_present(col_map, normalized_cols)
-
-    if "date" not in detected or "time" not in detected:
-        raise ValueError("Missing required columns: Data/Ora (date/time).")
-
-    ts = _build_timestamp(df, detected["date"], detected["time"])
-    df = df.assign(_timestamp=ts)
-    df = df.dropna(subset=["_timestamp"]).copy()
-    if df.empty:
-        return [], ImportSummary(rows_total, 0, None, None, detected)
-
-    df["_timestamp_epoch"] = (df["_timestamp"].astype("int64") / 1e9).astype(float)
-    df = df.sort_values("_timestamp_epoch", ascending=True)
+    _, detected = _first_present(COL_MAP, normalized_cols)
+
+    if "date" in detected and "time" in detected:
+        timestamps = _to_epoch_seconds(_build_timestamp(df, detected["date"], detected["time"]))
+    elif "timestamp" in detected:
+        timestamps = _parse_timestamp_column(df[detected["timestamp"]])
+    else:
+        raise ValueError("Missing required columns: Data/Ora (date/time) or timestamp.")
+    valid = np.isfinite(timestamps)
+    if not valid.any():
+        return {}, ImportSummary(rows_total, 0, None, None, detected)
+
+    order = np.argsort(timestamps[valid], kind="stable")
+    columns: Dict[str, np.ndarray] = {"timestamp": timestamps[valid][order]}
+    n = len(order)
+    for key in SIGNAL_KEYS:
+        src = detected.get(key)
+        columns[key] = _to_float_series(df[src])[valid][order] if src else np.full(n, np.nan)
+
+    if keep_extra:
+        mapped = set(detected.values())
+        for col in df.columns:
+            name = str(col)
+            if col not in mapped and name not in columns and name not in RESERVED_KEYS:
+                columns[name] = df[col].to_numpy()[valid][order]
 
     mode = electrical_mode
     if mode not in ("single_phase", "three_phase"):
         mode = "three_phase"
+    scale = math.sqrt(3.0) if mode == "three_phase" else 1.0
+    computed = (scale * columns["voltage_v"] * columns["current_a"] * columns["power_factor"]) / 1000.0
+    columns["power_kw"] = np.where(np.isnan(columns["power_kw"]), computed, columns["power_kw"])
+
+    ts = columns["timestamp"]
+    return columns, ImportSummary(
+        rows_total=rows_total,
+        rows_imported=n,
+        timestamp_min=float(ts[0]),
+        timestamp_max=float(ts[-1]),
+        detected_columns=detected,
+    )
+
+
+def columns_to_records(columns: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """Column arrays -> list of point dicts (NaN -> None), in a single pass."""
+    if not columns:
+        return []
+    keys = ["timestamp", *SIGNAL_KEYS]
+    out_keys = keys + ["power"]
+    cols = [columns[k].astype(object) for k in keys]
+    for c in cols:
+        c[pd.isna(c)] = None
+    cols.append(cols[keys.index("power_kw")])
+    return [dict(zip(out_keys, row)) for row in zip(*(c.tolist() for c in cols))]
+
+
+def merge_columns(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Concatenate column chunks into one set of arrays sorted by timestamp (stable)."""
+    parts = [p for p in parts if p]
+    if not parts:
+        return {}
+    merged = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    order = np.argsort(merged["timestamp"], kind="stable")
+    return {k: v[order] for k, v in merged.items()}
+
+
+def iter_column_chunks(columns: Dict[str, np.ndarray], chunk_size: int):
+    """Slices of at most chunk_size rows over a set of column arrays."""
+    n = len(columns.get("timestamp", ()))
+    for start in range(0, n, max(1, chunk_size)):
+        yield {k: v[start:start + chunk_size] for k, v in columns.items()}
 
-    out: List[Dict[str, Any]] = []
-    for _, row in df.iterrows():
-        timestamp = _to_float(row["_timestamp_epoch"])
-        if timestamp is None:
-            continue
-
-        voltage_v = _to_float(row.get(detected.get("voltage_v"))) if detected.get("voltage_v") else None
-        current_a = _to_float(row.get(detected.get("current_a"))) if detected.get("current_a") else None
-        power_factor = _to_float(row.get(detected.get("power_factor"))) if detected.get("power_factor") else None
-
-        power_kw = _to_float(row.get(detected.get("power_kw"))) if detected.get("power_kw") else None
-        if power_kw is None and voltage_v is not None and current_a is not None and power_factor is not None:
-            scale = math.sqrt(3.0) if mode == "three_phase" else 1.0
-            power_kw = (scale * voltage_v * current_a * power_factor) / 1000.0
-
-        record: Dict[str, Any] = {
-            "timestamp": timestamp,
-            "voltage_v": voltage_v,
-            "current_a": current_a,
-            "power_factor": power_factor,
-            "power_kw": power_kw,
-            "power": power_kw,  # compatibility with existing dashboards/baseline
-            "energy_total_kwh": _to_float(row.get(detected.get("energy_total_kwh"))) if detected.get("energy_total_kwh") else None,
-            "energy_grid_kwh": _to_float(row.get(detected.get("energy_grid_kwh"))) if detected.get("energy_grid_kwh") else None,
-            "energy_self_kwh": _to_float(row.get(detected.get("energy_self_kwh"))) if detected.get("energy_self_kwh") else None,
-            "reactive_varh": _to_float(row.get(detected.get("reactive_varh"))) if detected.get("reactive_varh") else None,
-        }
-
-        out.append(record)
-
-    ts_min = float(out[0]["timestamp"]) if out else None
-    ts_max = float(out[-1]["timestamp"]) if out else None
-    return out, ImportSummary(rows_total=rows_total, rows_imported=len(out), timestamp_min=ts_min, timestamp_max=ts_max, detected_columns=detected)
 
+def import_termoformatrice_columns(
+    file_path: str,
+    max_rows: int = 200_000,
+    electrical_mode: str = "three_phase",
+) -> Tuple[Dict[str, np.ndarray], ImportSummary]:
+    return frame_to_columns(_read_excel(file_path), max_rows=max_rows, electrical_mode=electrical_mode)
+
+
+def import_termoformatrice_xlsx(
+    file_path: str,
+    max_rows: int = 200_000,
+    electrical_mode: str = "three_phase",
+) -> Tuple[List[Dict[str, Any]], ImportSummary]:
+    columns, summary = import_termoformatrice_columns(file_path, max_rows=max_rows, electrical_mode=electrical_mode)
+    return columns_to_records(columns), summary
+
+
+def stream_termoformatrice_xlsx(
+    file_path: str,
+    on_chunk: Callable[[Dict[str, np.ndarray]], None],
+    chunk_size: int = 5000,
+    max_rows: int = 200_000,
+    electrical_mode: str = "three_phase",
+    on_progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> ImportSummary:
+    """
+    Constant-memory import: read the first sheet row by row (openpyxl read-only mode)
+    and hand normalized column arrays to `on_chunk` every `chunk_size` rows.
+    Only one chunk is held in memory at a time. Chunks are in file order (each one
+    sorted by timestamp internally).
+
+    When the sheet declares its size, only the last `max_rows` data rows are imported,
+    like the in-memory importer. `on_progress(rows_read, rows_total_estimate)` is called
+    after every chunk.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return ImportSummary(0, 0, None, None, {})
+        header = [c if c is not None else f"_col{i}" for i, c in enumerate(header)]
+
+        rows_estimate = (ws.max_row - 1) if ws.max_row else None
+        skip = max(0, rows_estimate - max_rows) if rows_estimate else 0
+
+        rows_read = 0
+        rows_imported = 0
+        ts_min: Optional[float] = None
+        ts_max: Optional[float] = None
+        detected: Dict[str, str] = {}
+        chunk: List[tuple] = []
+
+        def flush():
+            nonlocal rows_imported, ts_min, ts_max, detected
+            frame = pd.DataFrame.from_records(chunk, columns=header)
+            chunk.clear()
+            columns, summary = frame_to_columns(frame, max_rows=len(frame) or 1, electrical_mode=electrical_mode)
+            detected = summary.detected_columns or detected
+            if summary.rows_imported:
+                rows_imported += summary.rows_imported
+                ts_min = summary.timestamp_min if ts_min is None else min(ts_min, summary.timestamp_min)
+                ts_max = summary.timestamp_max if ts_max is None else max(ts_max, summary.timestamp_max)
+                on_chunk(columns)
+            if on_progress:
+                on_progress(rows_read, rows_estimate)
+
+        for row in rows:
+            rows_read += 1
+            if rows_read <= skip:
+                continue
+            if rows_read - skip > max_rows:
+                break
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+        elif on_progress:
+            on_progress(rows_read, rows_estimate)
+
+        return ImportSummary(
+            rows_total=rows_read,
+            rows_imported=rows_imported,
+            timestamp_min=ts_min,
+            timestamp_max=ts_max,
+            detected_columns=detected,
+        )
+    finally:
+        wb.close()
@@ -0,0 +1,373 @@
+"""
+Fleet simulator - N machines advanced at once with NumPy, for load generation.
+
+Same machine model as PLCSimulator, on arrays instead of one object per
+machine: a RUN/STOP/FAULT Markov chain (RUN leaves with 5%/s after 10 s, STOP
+and FAULT hold for a random dwell time), recipes with their target speed and
+power, wear drift reset by maintenance, first-order temperature response,
+vibration from speed and drift, electrical signals (voltage, current, power
+factor) and piece/energy counters. Faults can be injected (overheat,
+imbalance, jam) or drawn at random; overheating and imbalance trip the machine
+into FAULT at the PLCSimulator's critical thresholds.
+
+Each step produces one sample per machine ("device" M000, M001, ...). Steps are
+generated in blocks and written to a sink in one call. DatabaseSink writes
+through save_samples_bulk; FileSink writes NDJSON / CSV / Parquet, which
+modules.realtime.ingest loads back with every field (device, state, reason,
+temperature, ...) and per-device deduplication. Without a
+rate the simulation runs as fast as it can; with rate=k it is paced at k
+simulated seconds per wall second (1 = real time).
+
+CLI (from backend/):
+    python -m modules.foundation.fleet_simulator --machines 100 --duration 86400 --out db
+    python -m modules.foundation.fleet_simulator --machines 20 --duration 3600 --rate 1 --out fleet.ndjson
+"""
+from __future__ import annotations
+
+import abc
+import argparse
+import json
+import logging
+import math
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from modules.realtime.database import init_database, save_samples_bulk
+
+logger = logging.getLogger(__name__)
+
+STOP, RUN, FAULT = 0, 1, 2
+STATE_NAMES = np.array(["STOP", "RUN", "FAULT"], dtype=object)
+
+# (name, target speed pieces/min, base power kW) - as PLCSimulator.recipes
+RECIPES = (("Recipe_A", 120.0, 45.0), ("Recipe_B", 80.0, 60.0), ("Recipe_C", 150.0, 30.0))
+RECIPE_NAMES = np.array([r[0] for r in RECIPES], dtype=object)
+RECIPE_SPEED = np.array([r[1] for r in RECIPES])
+RECIPE_POWER = np.array([r[2] for r in RECIPES])
+
+# Random fault reasons, then the reasons of trips and injected faults
+FAULT_REASONS = ("Emergency Stop", "Motor Overload", "feeder_jam", "quality_check_fail")
+REASON_NAMES = np.array(FAULT_REASONS + ("Overheating", "Motor Imbalance"), dtype=object)
+REASON_OVERHEAT = len(FAULT_REASONS)
+REASON_IMBALANCE = REASON_OVERHEAT + 1
+REASON_JAM = FAULT_REASONS.index("feeder_jam")
+
+INJECTED_FAULTS = ("overheat", "imbalance", "jam")
+# Extra temperature (°C) / vibration (mm/s) target while an injected fault is active
+OVERHEAT_EXTRA_C = 60.0
+IMBALANCE_EXTRA_MM_S = 8.0
+# Protective trips (PLCSimulator critical alert thresholds)
+TRIP_TEMPERATURE_C = 95.0
+TRIP_VIBRATION_MM_S = 8.0
+
+FILE_EXTENSIONS = {".jsonl": "ndjson", ".pq": "parquet"}
+
+
+class FleetSimulator:
+    def __init__(
+        self,
+        machines: int = 10,
+        dt_s: float = 1.0,
+        start_ts: Optional[float] = None,
+        seed: Optional[int] = None,
+        fault_rate_per_h: float = 0.0,
+    ):
+        if machines < 1 or dt_s <= 0:
+            raise ValueError("machines must be >= 1 and dt_s > 0")
+        n = int(machines)
+        self.n = n
+        self.dt_s = float(dt_s)
+        self.ts = float(start_ts if start_ts is not None else time.time())
+        self.fault_rate_per_h = float(fault_rate_per_h)
+        self.rng = np.random.default_rng(seed)
+        rng = self.rng
+
+        self.devices = np.array([f"M{i:03d}" for i in range(n)], dtype=object)
+        self.state = np.full(n, STOP, dtype=np.int8)
+        self.state_s = np.zeros(n)
+        self.hold_s = rng.uniform(5, 20, n)
+        self.reason = np.full(n, -1, dtype=np.int8)
+        self.recipe = rng.integers(0, len(RECIPES), n)
+        self.speed = np.zeros(n)
+        self.power_kw = np.full(n, 5.0)
+        self.temperature = np.full(n, 45.0)
+        self.vibration = np.full(n, 0.5)
+        self.drift = np.zeros(n)
+        self.produced = np.zeros(n)
+        self.scrap = np.zeros(n)
+        self.energy_kwh = 12500.0 + rng.uniform(0, 1000, n)
+        self.voltage_v = np.full(n, 400.0)
+        self.current_a = np.zeros(n)
+        self.power_factor = np.full(n, 0.9)
+        # Remaining seconds of each injected fault, per machine
+        self.injected = {kind: np.zeros(n) for kind in INJECTED_FAULTS}
+        self.steps = 0
+
+    def inject_fault(self, machines: Iterable[int], kind: str, duration_s: float = 300.0):
+        """Start an injected fault on the given machine indexes"""
+        if kind not in INJECTED_FAULTS:
+            raise ValueError(f"Unknown fault '{kind}'. Use one of: {', '.join(INJECTED_FAULTS)}")
+        idx = np.asarray(list(machines), dtype=np.int64)
+        self.injected[kind][idx] = np.maximum(self.injected[kind][idx], float(duration_s))
+        if kind == "jam":
+            self._enter(np.isin(np.arange(self.n), idx), FAULT, float(duration_s), REASON_JAM)
+
+    def _enter(self, mask: np.ndarray, state: int, hold: Any, reason: Any = -1):
+        self.state[mask] = state
+        self.state_s[mask] = 0.0
+        self.hold_s[mask] = hold if np.isscalar(hold) else hold[mask]
+        self.reason[mask] = reason if np.isscalar(reason) else reason[mask]
+
+    def step(self):
+        """Advance every machine by dt_s"""
+        n, dt, rng = self.n, self.dt_s, self.rng
+        self.ts += dt
+        self.steps += 1
+        self.state_s += dt
+        for remaining in self.injected.values():
+            np.maximum(remaining - dt, 0.0, out=remaining)
+
+        if self.fault_rate_per_h > 0:
+            hit = rng.random(n) < 1.0 - math.exp(-self.fault_rate_per_h * dt / 3600.0)
+            if hit.any():
+                kinds = rng.integers(0, len(INJECTED_FAULTS), n)
+                for k, kind in enumerate(INJECTED_FAULTS):
+                    chosen = np.flatnonzero(hit & (kinds == k))
+                    if len(chosen):
+                        self.inject_fault(chosen, kind, float(rng.uniform(120, 900)))
+
+        # Markov chain (per-second probabilities of PLCSimulator scaled to dt)
+        run = self.state == RUN
+        leave = run & (self.state_s > 10) & (rng.random(n) < 1.0 - 0.95 ** dt)
+        to_fault = leave & (rng.random(n) < 0.3)
+        tripped_hot = run & ~leave & (self.temperature > TRIP_TEMPERATURE_C)
+        tripped_vib = run & ~leave & ~tripped_hot & (self.vibration > TRIP_VIBRATION_MM_S)
+        resume = ~run & (self.state_s > self.hold_s) & (self.injected["jam"] <= 0)
+
+        self._enter(leave & ~to_fault, STOP, rng.uniform(5, 20, n))
+        self._enter(to_fault, FAULT, rng.uniform(10, 40, n), rng.integers(0, len(FAULT_REASONS), n).astype(np.int8))
+        self._enter(tripped_hot, FAULT, rng.uniform(60, 300, n), REASON_OVERHEAT)
+        self._enter(tripped_vib, FAULT, rng.uniform(60, 300, n), REASON_IMBALANCE)
+        # Recipe changeover on 10% of the restarts
+        change = resume & (rng.random(n) < 0.1)
+        self.recipe[change] = rng.integers(0, len(RECIPES), int(change.sum()))
+        self._enter(resume, RUN, 0.0)
+
+        # Process values by state
+        run = self.state == RUN
+        self.speed = np.where(run, RECIPE_SPEED[self.recipe] * rng.uniform(0.9, 1.05, n), 0.0)
+        self.power_kw = np.where(
+            run,
+            RECIPE_POWER[self.recipe] * rng.uniform(0.95, 1.1, n),
+            np.where(self.state == STOP, 5.0, 2.0),
+        )
+        pieces = self.speed / 60.0 * dt
+        scrapped = run & (rng.random(n) < 0.02)
+        self.scrap += np.where(scrapped, pieces, 0.0)
+        self.produced += np.where(scrapped, 0.0, pieces)
+        self.energy_kwh += self.power_kw * dt / 3600.0
+
+        # Wear while running, reset by maintenance during faults
+        self.drift += np.where(run & (rng.random(n) < 1.0 - 0.95 ** dt), 0.01, 0.0)
+        self.drift[(self.state == FAULT) & (rng.random(n) < 1.0 - 0.95 ** dt)] = 0.0
+
+        overheat = np.where(self.injected["overheat"] > 0, OVERHEAT_EXTRA_C, 0.0)
+        imbalance = np.where(self.injected["imbalance"] > 0, IMBALANCE_EXTRA_MM_S, 0.0)
+        target_temp = 45.0 + self.power_kw * 0.4 + self.drift * 40.0 + overheat
+        self.temperature += (target_temp - self.temperature) * (1.0 - 0.9 ** dt) + rng.uniform(-0.5, 0.5, n)
+        self.vibration = self.speed / 100.0 + self.drift * 8.0 + imbalance + rng.uniform(0, 0.3, n)
+
+        self.voltage_v = 400.0 + rng.normal(0.0, 2.0, n)
+        self.power_factor = np.clip(
+            0.9 - self.drift * 0.1 - np.where(run, 0.0, 0.05) + rng.normal(0.0, 0.005, n), 0.3, 1.0
+        )
+        self.current_a = self.power_kw * 1000.0 / (math.sqrt(3.0) * self.voltage_v * self.power_factor)
+
+    def run_block(self, steps: int) -> pd.DataFrame:
+        """Advance `steps` steps; one row per machine and step (ordered by time)"""
+        n = self.n
+        numeric = (
+            "speed", "power_kw", "temperature", "vibration", "voltage_v", "current_a",
+            "power_factor", "energy_kwh", "produced", "scrap",
+        )
+        out = {name: np.empty((steps, n)) for name in numeric}
+        ts = np.empty(steps)
+        state = np.empty((steps, n), dtype=np.int8)
+        recipe = np.empty((steps, n), dtype=np.int64)
+        reason = np.empty((steps, n), dtype=np.int8)
+        for i in range(steps):
+            self.step()
+            ts[i] = self.ts
+            state[i], recipe[i], reason[i] = self.state, self.recipe, self.reason
+            for name in numeric:
+                out[name][i] = getattr(self, name)
+
+        reason = reason.ravel()
+        reasons = REASON_NAMES[np.maximum(reason, 0)]
+        reasons[reason < 0] = None
+        frame = pd.DataFrame({
+            "timestamp": np.repeat(ts, n),
+            "device": np.tile(self.devices, steps),
+            "state": STATE_NAMES[state.ravel()],
+            "recipe": RECIPE_NAMES[recipe.ravel()],
+            "reason": reasons,
+            "speed": out["speed"].ravel().round(1),
+            "power_kw": out["power_kw"].ravel().round(3),
+            "temperature": out["temperature"].ravel().round(2),
+            "vibration": out["vibration"].ravel().round(3),
+            "voltage_v": out["voltage_v"].ravel().round(1),
+            "current_a": out["current_a"].ravel().round(2),
+            "power_factor": out["power_factor"].ravel().round(3),
+            "energy_total_kwh": out["energy_kwh"].ravel().round(3),
+            "produced": np.floor(out["produced"].ravel()),
+            "scrap": np.floor(out["scrap"].ravel()),
+        })
+        frame["power"] = frame["power_kw"]
+        return frame
+
+    def run(
+        self,
+        duration_s: float,
+        sink: "SampleSink",
+        rate: Optional[float] = None,
+        block_steps: int = 600,
+    ) -> Dict[str, Any]:
+        """
+        Simulate duration_s seconds into sink. rate=None runs unpaced; rate=k
+        paces blocks at k simulated seconds per wall second.
+        """
+        total_steps = max(1, int(round(duration_s / self.dt_s)))
+        if rate:
+            # About one block per wall second when paced
+            block_steps = max(1, int(round(rate / self.dt_s)))
+        started = time.perf_counter()
+        done = samples = 0
+        while done < total_steps:
+            steps = min(block_steps, total_steps - done)
+            frame = self.run_block(steps)
+            sink.write(frame)
+            done += steps
+            samples += len(frame)
+            if rate:
+                ahead = done * self.dt_s / rate - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        sink.close()
+        elapsed = time.perf_counter() - started
+        return {
+            "machines": self.n,
+            "steps": done,
+            "samples": samples,
+            "simulated_s": round(done * self.dt_s, 3),
+            "elapsed_s": round(elapsed, 3),
+            "samples_per_s": round(samples / elapsed, 1) if elapsed > 0 else None,
+            "speedup": round(done * self.dt_s / elapsed, 1) if elapsed > 0 else None,
+            "last_timestamp": self.ts,
+        }
+
+
+class SampleSink(abc.ABC):
+    """Destination of the simulated blocks (one row per machine and step)"""
+
+    @abc.abstractmethod
+    def write(self, frame: pd.DataFrame):
+        ...
+
+    def close(self):
+        pass
+
+
+class DatabaseSink(SampleSink):
+    """Write blocks into realtime_samples through save_samples_bulk"""
+
+    def __init__(self):
+        init_database()
+        self.rows = 0
+
+    def write(self, frame: pd.DataFrame):
+        payloads = frame.drop(columns="timestamp").to_json(
+            orient="records", lines=True, double_precision=15
+        ).splitlines()
+        self.rows += save_samples_bulk(list(zip(frame["timestamp"].tolist(), payloads)))
+
+
+class FileSink(SampleSink):
+    """
+    Append blocks to an NDJSON / CSV / Parquet file, one row per machine and
+    step, in the format modules.realtime.ingest reads back.
+    """
+
+    def __init__(self, path: str, fmt: Optional[str] = None):
+        self.path = Path(path)
+        suffix = self.path.suffix.lower()
+        self.fmt = (fmt or FILE_EXTENSIONS.get(suffix, suffix.lstrip("."))).lower()
+        if self.fmt not in ("ndjson", "csv", "parquet"):
+            raise ValueError(f"Unsupported file format '{self.fmt}'. Use ndjson, csv or parquet")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.rows = 0
+        self._writer = None
+        if self.fmt != "parquet":
+            self.path.write_text("")
+
+    def write(self, frame: pd.DataFrame):
+        if self.fmt == "ndjson":
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(frame.to_json(orient="records", lines=True, double_precision=15))
+                f.write("\n")
+        elif self.fmt == "csv":
+            frame.to_csv(self.path, mode="a", header=self.rows == 0, index=False)
+        else:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise ValueError("Parquet output requires pyarrow (pip install pyarrow)") from e
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(str(self.path), table.schema)
+            self._writer.write_table(table)
+        self.rows += len(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of machines into the samples DB or a file")
+    parser.add_argument("--machines", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated seconds")
+    parser.add_argument("--dt", type=float, default=1.0, help="seconds between samples")
+    parser.add_argument("--rate", type=float, default=None, help="simulated seconds per wall second (default: unpaced)")
+    parser.add_argument("--start", type=float, default=None, help="first timestamp (default: now, or now - duration when unpaced)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="injected faults per machine per hour")
+    parser.add_argument("--out", default="db", help="'db' (realtime samples DB) or an .ndjson/.csv/.parquet path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    start = args.start
+    if start is None:
+        # Unpaced runs generate history that ends now; paced runs follow the wall clock
+        start = time.time() - (0.0 if args.rate else args.duration)
+    sim = FleetSimulator(
+        machines=args.machines,
+        dt_s=args.dt,
+        start_ts=start,
+        seed=args.seed,
+        fault_rate_per_h=args.fault_rate,
+    )
+    sink = DatabaseSink() if args.out == "db" else FileSink(args.out)
+    report = sim.run(args.duration, sink, rate=args.rate)
+    report["out"] = args.out
+    report["rows_written"] = sink.rows
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
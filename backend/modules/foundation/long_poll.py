@@ -0,0 +1,74 @@
+"""
+Change notification for incremental (`since` cursor) endpoints with long-poll.
+
+A ChangeFeed is notified by the writers of a data set (any thread); a request
+that found nothing new after its cursor can wait on it instead of returning an
+empty page, so clients poll at the rate data arrives rather than on a timer.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Any, Callable, List, Set, Tuple
+
+# Upper bound of the wait a client may ask for (seconds)
+MAX_WAIT_S = 30.0
+
+
+class ChangeFeed:
+    def __init__(self):
+        self.version = 0
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = set()
+        self._lock = threading.Lock()
+
+    def notify(self):
+        """Wake the waiting requests (safe from any thread)"""
+        with self._lock:
+            self.version += 1
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    async def wait(self, timeout: float, version: int) -> bool:
+        """
+        Wait until notified after `version` (returns at once if that already
+        happened). False on timeout.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            if self.version != version:
+                return True
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+async def long_poll(feed: ChangeFeed, fetch: Callable[[], List[Any]], wait_s: float) -> List[Any]:
+    """
+    fetch() (run in a worker thread) until it returns items or wait_s elapses.
+    The feed version is read before each fetch, so a write between the fetch
+    and the wait is never missed.
+    """
+    deadline = time.monotonic() + max(0.0, min(float(wait_s), MAX_WAIT_S))
+    while True:
+        version = feed.version
+        items = await asyncio.to_thread(fetch)
+        remaining = deadline - time.monotonic()
+        if items or remaining <= 0:
+            return items
+        if not await feed.wait(remaining, version):
+            return items
@@ -1,6 +1,12 @@
-from fastapi import APIRouter
+import time
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
 from modules.realtime.collector import collector
-from modules.realtime.database import get_latest_events, get_latest_sample
+from modules.realtime.database import get_downtime_segments, get_latest_events, get_latest_sample
+from modules.realtime.downtime import downtime_tracker
+from modules.realtime.oee import oee_engine, shift_bounds
 
 router = APIRouter(
     prefix="/api",
@@ -11,27 +17,87 @@ router = APIRouter(
 def get_status():
     status = collector.get_status()
     last = status.get("last_sample") or get_latest_sample() or {}
+    oee = oee_engine.get_current()
     # Keep fields used by frontend header; fall back to safe defaults.
     return {
-        "state": "RUN" if status.get("connected") else "STOP",
-        "recipe": "Realtime",
-        "speed": 0,
-        "produced": 0,
-        "scrap": 0,
+        "state": oee["state"] or ("RUN" if status.get("connected") else "STOP"),
+        "recipe": oee["recipe"] or "Realtime",
+        "speed": oee["speed"],
+        "produced": int(oee["good"]),
+        "scrap": int(oee["scrap"]),
         "energy_kwh": last.get("energy_total_kwh") or 0,
-        "oee_percent": 0,
+        "oee_percent": oee["oee_percent"],
         "timestamp": (last.get("timestamp") and __import__("datetime").datetime.fromtimestamp(last["timestamp"]).isoformat())
         or __import__("datetime").datetime.now().isoformat(),
         # Include raw realtime fields for convenience
         "realtime": status,
+        "oee": oee,
     }
 
+@router.get("/oee")
+def get_oee():
+    """OEE of the current shift (availability, performance, quality and their accumulators)"""
+    return oee_engine.get_current()
+
+@router.get("/oee/shift")
+def get_oee_shift(at: float):
+    """OEE of the shift containing the `at` timestamp"""
+    shift = oee_engine.get_shift(float(at))
+    if shift is None:
+        raise HTTPException(status_code=404, detail="No OEE data for that shift")
+    return shift
+
+@router.get("/oee/shifts")
+def get_oee_shifts(ts_from: Optional[float] = None, ts_to: Optional[float] = None, limit: int = 100):
+    """Per-shift OEE results (default: the last 7 days)"""
+    ts_to = time.time() if ts_to is None else float(ts_to)
+    ts_from = ts_to - 7 * 86400 if ts_from is None else float(ts_from)
+    limit = max(1, min(int(limit), 1000))
+    return oee_engine.get_shifts(ts_from, ts_to, limit=limit)
+
 @router.get("/metrics")
 def get_metrics():
     # Deprecated: kept for frontend compatibility; use /api/realtime/stream instead.
     return {"history": []}
 
+# Pareto ranges ending now (seconds); "shift" and "day" start at the shift / local midnight
+PARETO_PERIODS = {"week": 7 * 86400, "month": 30 * 86400, "year": 365 * 86400}
+
+def _period_range(period: str, ts_from: Optional[float], ts_to: Optional[float]):
+    now = time.time()
+    ts_to = now if ts_to is None else float(ts_to)
+    if ts_from is not None:
+        return float(ts_from), ts_to
+    if period == "shift":
+        return shift_bounds(ts_to, oee_engine.shift_starts)[0], ts_to
+    if period == "day":
+        return datetime.fromtimestamp(ts_to).replace(hour=0, minute=0, second=0, microsecond=0).timestamp(), ts_to
+    if period not in PARETO_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Unknown period: {period}")
+    return ts_to - PARETO_PERIODS[period], ts_to
+
 @router.get("/pareto")
-def get_pareto():
-    # Deprecated: kept for frontend compatibility.
-    return []
+def get_pareto(
+    period: str = "week",
+    ts_from: Optional[float] = None,
+    ts_to: Optional[float] = None,
+    state: Optional[str] = None,
+):
+    """
+    Downtime per reason (longest first) over a period (shift, day, week, month,
+    year) or an explicit ts_from/ts_to range; state filters STOP or FAULT.
+    """
+    ts_from, ts_to = _period_range(period, ts_from, ts_to)
+    states = [s.strip().upper() for s in state.split(",") if s.strip()] if state else None
+    return downtime_tracker.pareto(ts_from, ts_to, states=states)
+
+@router.get("/downtime/intervals")
+def get_downtime_intervals(period: str = "day", ts_from: Optional[float] = None, ts_to: Optional[float] = None, limit: int = 1000):
+    """Closed stop/fault intervals (split at midnight) overlapping the range"""
+    ts_from, ts_to = _period_range(period, ts_from, ts_to)
+    limit = max(1, min(int(limit), 10_000))
+    return get_downtime_segments(ts_from, ts_to, limit=limit)
+
+@router.get("/downtime/status")
+def get_downtime_status():
+    return downtime_tracker.get_status()
@@ -1,7 +1,9 @@
 import random
 import time
+from collections import deque
 from datetime import datetime
 import pandas as pd
+from modules.realtime.oee import OEEEngine
 
 class PLCSimulator:
     def __init__(self):
@@ -27,14 +29,20 @@ class PLCSimulator:
             "Recipe_C": {"target_speed": 150, "power_base": 30.0},
         }
         
-        # History for OEE and charts
-        self.history = []
+        # History for charts; OEE is accumulated incrementally per shift
+        self.history = deque(maxlen=3600) # keep last hour roughly
         self.alarms_history = []
+        self.oee = OEEEngine(
+            persist=False,
+            ideal_rates={name: r["target_speed"] for name, r in self.recipes.items()},
+        )
         
         # Fault reasons
         self.fault_reasons = [
             "Emergency Stop", "Motor Overload", "feeder_jam", "quality_check_fail"
         ]
+        # Downtime per reason: [count, seconds], added as each stop/fault ends
+        self.downtime = {}
         
     def _transition_logic(self):
         now = time.time()
@@ -61,15 +69,23 @@ class PLCSimulator:
             # IDLE state, operator logic
             if time_in_state > random.randint(5, 20):
                 self.state = "RUN"
+                self._record_downtime("Operator Stop", time_in_state)
                 self.last_state_change = now
                 
         elif self.state == "FAULT":
             # Time to fix fault
             if time_in_state > random.randint(10, 40):
                 self.state = "RUN"
-                # Close the alarm entry logic would go here ideally
+                alarm = self.alarms_history[-1]
+                alarm["duration"] = round(time_in_state)
+                self._record_downtime(alarm["reason"], time_in_state)
                 self.last_state_change = now
 
+    def _record_downtime(self, reason, seconds):
+        entry = self.downtime.setdefault(reason, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
     def update(self):
         self._transition_logic()
         
@@ -134,8 +150,13 @@ class PLCSimulator:
             "scrap": int(self.total_scrap)
         }
         self.history.append(snapshot)
-        if len(self.history) > 3600: # keep last hour roughly
-            self.history.pop(0)
+        self.oee.update(time.time(), {
+            "state": self.state,
+            "recipe": self.current_recipe,
+            "speed": self.speed,
+            "produced": self.total_produced,
+            "scrap": self.total_scrap,
+        })
             
     def _check_anomalies(self):
         self.active_alerts = []
@@ -169,49 +190,15 @@ class PLCSimulator:
         }
         
     def _calculate_realtime_oee(self):
-        # Very simplified OEE for realtime display
-        # Availability implies time running vs total time (simplified here)
-        # Performance is speed / target speed
-        # Quality is good / total
-        
-        if self.total_produced + self.total_scrap == 0:
-            return 0
-            
-        quality = self.total_produced / (self.total_produced + self.total_scrap)
-        
-        # Performance (instant)
-        target = self.recipes[self.current_recipe]["target_speed"]
-        performance = 0 
-        if self.state == "RUN":
-             performance = min(self.speed / target, 1.0)
-             
-        # Availability (windowed over history) or instant state
-        # Usually availability is calculated over a shift. Here we use instant state for visual flair 'proxy'
-        # But a correct OEE is historical. Let's do a "Shift OEE" approximation
-        availability = 0.85 # default dummy
-        if len(self.history) > 0:
-            run_count = sum(1 for h in self.history if h['state'] == 'RUN')
-            availability = run_count / len(self.history)
-            
-        oee = availability * performance * quality
-        return round(oee * 100, 1)
+        # Shift OEE from the engine's accumulators (state durations, piece counters)
+        return self.oee.get_current()["oee_percent"]
 
     def get_pareto_data(self):
-        # Fake aggregation if history is too short
-        if not self.alarms_history:
-             return [
-                 {"reason": "Emergency Stop", "count": 5, "duration_min": 45},
-                 {"reason": "feeder_jam", "count": 12, "duration_min": 30},
-                 {"reason": "Motor Overload", "count": 2, "duration_min": 20},
-                 {"reason": "quality_check_fail", "count": 8, "duration_min": 15},
-             ]
-        # Real aggregation logic could go here
+        # Ended stops/faults per reason, longest total downtime first
         return [
-             {"reason": "Emergency Stop", "count": 5, "duration_min": 45},
-             {"reason": "feeder_jam", "count": 12, "duration_min": 30},
-             {"reason": "Motor Overload", "count": 2, "duration_min": 20},
-             {"reason": "quality_check_fail", "count": 8, "duration_min": 15},
-         ]
+            {"reason": reason, "count": count, "duration_min": round(seconds / 60.0, 1)}
+            for reason, (count, seconds) in sorted(self.downtime.items(), key=lambda kv: -kv[1][1])
+        ]
 
 # Singleton Instance
 simulator = PLCSimulator()
@@ -0,0 +1,335 @@
+"""
+Anomaly context summarizer - turns an anomaly event plus the surrounding window of
+realtime samples into a compact prompt section, instead of interpolating the raw
+`_process_point` record (full rolling stats of every signal, nested dicts).
+
+The summary keeps what a diagnosis needs: the deviating signals with their
+σ distance and limit, min/avg/max over the window, other signals drifting away
+from their window mean, the ML score, and the rule events fired around the anomaly.
+
+Summaries of stored events are cached per event id in the guided diagnosis DB
+once the window is complete (the samples after the event have arrived). A
+background loop precomputes them for new events, so a diagnosis rarely pays for
+the window query.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .config_store import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Window around the event read from realtime_samples / realtime_events
+WINDOW_BEFORE_S = float(os.getenv("DIAGNOSIS_CONTEXT_BEFORE_S", "300"))
+WINDOW_AFTER_S = float(os.getenv("DIAGNOSIS_CONTEXT_AFTER_S", "60"))
+# Non-flagged signals this far from their window mean are reported as drifting
+DRIFT_SIGMA = 2.0
+MAX_RULE_EVENTS = 5
+# Seconds between precompute passes over new events (0 disables the loop)
+PRECOMPUTE_INTERVAL_S = float(os.getenv("DIAGNOSIS_CONTEXT_PRECOMPUTE_S", "60"))
+PRECOMPUTE_BATCH = 50
+
+# Signals scored by the anomaly service
+CONTEXT_SIGNALS = ("temperature", "vibration", "power", "voltage_v", "current_a", "power_factor")
+
+# Bump when the summary layout changes, so cached summaries are rebuilt
+SUMMARY_VERSION = 1
+
+
+def _num(value: Any) -> Optional[float]:
+    try:
+        out = float(value)
+    except (TypeError, ValueError):
+        return None
+    return out if np.isfinite(out) else None
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.4g}"
+
+
+def _window_stats(samples: List[Dict[str, Any]], event_ts: float) -> Dict[str, Dict[str, float]]:
+    """Per signal: min/avg/max over the window, mean/std of the samples before the event"""
+    if not samples:
+        return {}
+    ts = np.array([s["timestamp"] for s in samples], dtype=float)
+    before = ts < event_ts
+    out: Dict[str, Dict[str, float]] = {}
+    for name in CONTEXT_SIGNALS:
+        values = np.array([_num(s.get(name)) for s in samples], dtype=float)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            continue
+        stats = {
+            "min": float(values[valid].min()),
+            "avg": float(values[valid].mean()),
+            "max": float(values[valid].max()),
+        }
+        ref = values[before & valid]
+        if len(ref) >= 2:
+            stats["ref_mean"] = float(ref.mean())
+            stats["ref_std"] = float(ref.std())
+        out[name] = stats
+    return out
+
+
+def _rule_events(events: List[Dict[str, Any]], event_ts: float) -> List[Dict[str, Any]]:
+    """Rule events grouped by (type, message): first offset from the anomaly and count"""
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    counts: Counter = Counter()
+    for ev in events:
+        key = (ev.get("type"), ev.get("message"))
+        counts[key] += 1
+        if key not in groups:
+            groups[key] = {"type": key[0], "message": key[1], "offset_s": round(ev["timestamp"] - event_ts, 1)}
+    ranked = sorted(groups.values(), key=lambda g: (g["type"] != "CRITICAL", abs(g["offset_s"])))
+    for g in ranked:
+        g["count"] = counts[(g["type"], g["message"])]
+    return ranked[:MAX_RULE_EVENTS]
+
+
+def summarize_event(
+    event: Dict[str, Any],
+    before_s: float = WINDOW_BEFORE_S,
+    after_s: float = WINDOW_AFTER_S,
+) -> Dict[str, Any]:
+    """
+    Compact summary of an anomaly event ({timestamp, type, message, details}) and
+    its window. "text" is the prompt section; the other keys are the same facts
+    as data. "complete" is False while the window still extends into the future.
+    """
+    # Lazy import: realtime storage is owned by the realtime module
+    from modules.realtime.database import get_events_between, get_samples_between
+
+    details = event.get("details") or {}
+    event_ts = _num(event.get("timestamp")) or _num(details.get("timestamp"))
+    samples: List[Dict[str, Any]] = []
+    rule_events: List[Dict[str, Any]] = []
+    if event_ts is not None:
+        samples = get_samples_between(event_ts - before_s, event_ts + after_s)
+        rule_events = _rule_events(get_events_between(event_ts - before_s, event_ts + after_s), event_ts)
+    window = _window_stats(samples, event_ts) if event_ts is not None else {}
+    baseline = details.get("stats") or {}
+
+    deviating = []
+    for name, info in (details.get("anomalies") or {}).items():
+        item = {
+            "signal": name,
+            "direction": info.get("type"),
+            "value": _num(info.get("value")),
+            "sigma": round(_num(info.get("deviation_sigma")) or 0.0, 2),
+            "limit": _num(info.get("threshold")),
+        }
+        stats = window.get(name) or baseline.get(name) or {}
+        item["min"], item["max"] = _num(stats.get("min")), _num(stats.get("max"))
+        item["avg"] = _num(stats.get("avg", stats.get("mean")))
+        deviating.append(item)
+    deviating.sort(key=lambda d: -d["sigma"])
+    flagged = {d["signal"] for d in deviating}
+
+    drifting = []
+    in_band = {}
+    for name in CONTEXT_SIGNALS:
+        if name in flagged:
+            continue
+        value = _num(details.get(name))
+        if value is None:
+            continue
+        stats = window.get(name, {})
+        std = stats.get("ref_std") or 0.0
+        z = (value - stats["ref_mean"]) / std if std > 0 else 0.0
+        if abs(z) >= DRIFT_SIGMA:
+            drifting.append({"signal": name, "value": value, "sigma": round(z, 2)})
+        else:
+            in_band[name] = value
+
+    ml = None
+    if details.get("ml_ready"):
+        ml = {"score": _num(details.get("ml_score")), "anomalous": bool(details.get("ml_anomaly"))}
+
+    lines = []
+    if deviating:
+        lines.append("Deviating signals (value, σ from baseline, limit | window min/avg/max):")
+        for d in deviating:
+            lines.append(
+                f"- {d['signal']}: {_fmt(d['value'])} {d['direction'] or ''} {d['sigma']:.1f}σ, "
+                f"limit {_fmt(d['limit'])} | {_fmt(d['min'])}/{_fmt(d['avg'])}/{_fmt(d['max'])}"
+            )
+    if drifting:
+        lines.append("Drifting from window mean: " + ", ".join(
+            f"{d['signal']} {_fmt(d['value'])} ({d['sigma']:+.1f}σ)" for d in drifting
+        ))
+    if in_band:
+        lines.append("Other signals in band: " + ", ".join(f"{k} {_fmt(v)}" for k, v in in_band.items()))
+    if ml is not None:
+        lines.append(f"ML score: {_fmt(ml['score'])} ({'anomalous' if ml['anomalous'] else 'normal'})")
+    if samples:
+        lines.append(f"Window: -{before_s:g}s/+{after_s:g}s around the event, {len(samples)} samples")
+    if rule_events:
+        lines.append("Rule events in window: " + "; ".join(
+            f"{g['offset_s']:+g}s {g['type']} {g['message']}" + (f" (x{g['count']})" if g["count"] > 1 else "")
+            for g in rule_events
+        ))
+
+    return {
+        "event_id": event.get("id"),
+        "timestamp": event_ts,
+        "severity": event.get("type"),
+        "deviating": deviating,
+        "drifting": drifting,
+        "in_band": in_band,
+        "ml": ml,
+        "rule_events": rule_events,
+        "window": {"before_s": before_s, "after_s": after_s, "samples": len(samples)},
+        "complete": event_ts is None or time.time() >= event_ts + after_s,
+        "text": "\n".join(lines),
+    }
+
+
+class AnomalyContextCache:
+    def __init__(self, before_s: float = WINDOW_BEFORE_S, after_s: float = WINDOW_AFTER_S):
+        self.before_s = before_s
+        self.after_s = after_s
+        self.hits = 0
+        self.misses = 0
+        self.precomputed = 0
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    @property
+    def _params(self) -> str:
+        return f"v{SUMMARY_VERSION}|{self.before_s:g}|{self.after_s:g}"
+
+    def init_db(self):
+        with get_db_connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS anomaly_context_cache (
+                    event_id INTEGER PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.commit()
+
+    def for_event(self, event_id: int, fallback: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Summary of a stored anomaly event (cached once its window is complete).
+        fallback is summarized, uncached, when the event is not in the DB.
+        """
+        with get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT summary FROM anomaly_context_cache WHERE event_id = ? AND params = ?",
+                (int(event_id), self._params),
+            ).fetchone()
+        if row is not None:
+            with self._lock:
+                self.hits += 1
+            return json.loads(row["summary"])
+        with self._lock:
+            self.misses += 1
+
+        from modules.anomaly_detection.database import get_anomaly_event_by_id
+
+        event = get_anomaly_event_by_id(int(event_id))
+        if event is None:
+            return summarize_event(fallback, self.before_s, self.after_s) if fallback else None
+        summary = summarize_event(event, self.before_s, self.after_s)
+        if summary["complete"]:
+            self._store(event_id, summary)
+        return summary
+
+    def _store(self, event_id: int, summary: Dict[str, Any]):
+        with get_db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO anomaly_context_cache (event_id, params, summary, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (int(event_id), self._params, json.dumps(summary), time.time()),
+            )
+            conn.commit()
+
+    def precompute_pending(self, limit: int = PRECOMPUTE_BATCH) -> int:
+        """Summarize recent events whose window is complete and not cached yet"""
+        from modules.anomaly_detection.database import get_anomaly_events
+
+        cutoff = time.time() - self.after_s
+        events = [e for e in get_anomaly_events(limit=limit) if (_num(e.get("timestamp")) or 0) <= cutoff]
+        if not events:
+            return 0
+        ids = [int(e["id"]) for e in events]
+        with get_db_connection() as conn:
+            placeholders = ",".join("?" * len(ids))
+            cached = {
+                row["event_id"]
+                for row in conn.execute(
+                    f"SELECT event_id FROM anomaly_context_cache WHERE params = ? AND event_id IN ({placeholders})",
+                    (self._params, *ids),
+                )
+            }
+        done = 0
+        for event in events:
+            if int(event["id"]) in cached:
+                continue
+            self._store(event["id"], summarize_event(event, self.before_s, self.after_s))
+            done += 1
+        with self._lock:
+            self.precomputed += done
+        return done
+
+    async def start(self):
+        """Start the precompute loop and return its task (None when disabled)"""
+        if PRECOMPUTE_INTERVAL_S <= 0:
+            return None
+        if self.running and self._task:
+            return self._task
+        self.running = True
+        self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await asyncio.wait_for(self._task, timeout=2.0)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+        self._task = None
+
+    async def _loop(self):
+        while self.running:
+            try:
+                done = await asyncio.to_thread(self.precompute_pending)
+                if done:
+                    logger.info(f"Precomputed diagnosis context of {done} anomaly event(s)")
+            except Exception as e:
+                logger.warning(f"Anomaly context precompute failed: {e}")
+            await asyncio.sleep(PRECOMPUTE_INTERVAL_S)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT COUNT(*) AS n FROM anomaly_context_cache").fetchone()
+        with self._lock:
+            return {
+                "entries": int(row["n"]),
+                "hits": self.hits,
+                "misses": self.misses,
+                "precomputed": self.precomputed,
+                "window": {"before_s": self.before_s, "after_s": self.after_s},
+            }
+
+
+anomaly_context_cache = AnomalyContextCache()
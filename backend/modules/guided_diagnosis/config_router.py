@@ -1,9 +1,10 @@
 import logging
 import os
 from fastapi import APIRouter, HTTPException, Body, Query
-import requests
+from fastapi.concurrency import run_in_threadpool
 
 from .config_store import get_config, set_config
+from .http_pool import request_with_retry
 
 logger = logging.getLogger(__name__)
 
@@ -36,14 +37,13 @@ def write_config(values: dict = Body(default={})):
 
 
 @router.get("/ollama/models")
-def list_ollama_models(base_url: str = Query(default="")):
-    cfg = read_config()
+async def list_ollama_models(base_url: str = Query(default="")):
+    cfg = await run_in_threadpool(read_config)
     base_url = (base_url or "").strip() or str(cfg.get("ollama_base_url") or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
     base_url = base_url.rstrip("/")
     url = f"{base_url}/api/tags"
     try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
+        r = await request_with_retry("GET", url, timeout=10)
         data = r.json()
         models = [m.get("name") for m in (data.get("models") or []) if m.get("name")]
         return {"base_url": base_url, "models": models}
@@ -3,6 +3,7 @@ from __future__ import annotations
 import json
 import logging
 import sqlite3
+import threading
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Any, Dict, Optional
@@ -11,6 +12,12 @@ logger = logging.getLogger(__name__)
 
 DB_PATH = Path(__file__).parent / "guided_diagnosis.db"
 
+# The stored config is read on every diagnosis: keep it in memory, reloaded after
+# set_config. The version lets holders of derived state (LLM clients) notice changes.
+_cache: Optional[Dict[str, Any]] = None
+_version = 0
+_lock = threading.Lock()
+
 
 @contextmanager
 def get_db_connection():
@@ -38,6 +45,24 @@ def init_db():
 
 
 def get_config() -> Dict[str, Any]:
+    global _cache
+    with _lock:
+        if _cache is not None:
+            return dict(_cache)
+        version = _version
+    cfg = _load_config()
+    with _lock:
+        # Not kept if set_config ran meanwhile (the read may predate the write)
+        if version == _version:
+            _cache = cfg
+    return dict(cfg)
+
+
+def get_config_version() -> int:
+    return _version
+
+
+def _load_config() -> Dict[str, Any]:
     with get_db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT key, value FROM llm_config")
@@ -63,5 +88,13 @@ def set_config(values: Dict[str, Any]) -> Dict[str, Any]:
                 (str(k), json.dumps(v)),
             )
         conn.commit()
+    invalidate_config()
     return get_config()
 
+
+def invalidate_config():
+    global _cache, _version
+    with _lock:
+        _cache = None
+        _version += 1
+
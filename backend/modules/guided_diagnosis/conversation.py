@@ -0,0 +1,177 @@
+"""
+Conversation memory for anomaly chats.
+
+build_history() turns the stored chat of an anomaly into a prompt section that
+fits a token budget: the most recent turns are kept verbatim, older ones are
+compacted into a short extractive summary (no extra LLM call, which on a
+CPU-only Ollama box would cost as much as the answer itself).
+
+ChatSessions keeps the Ollama `context` (the evaluated prompt state returned by
+/api/generate) of each anomaly chat, so a follow-up only sends the new turn
+instead of re-evaluating the whole shared prefix.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# Prompt budget for prior turns (tokens, estimated from characters)
+HISTORY_TOKENS = int(os.getenv("DIAGNOSIS_HISTORY_TOKENS", "1500"))
+# Share of the history budget the summary of older turns may use
+SUMMARY_SHARE = float(os.getenv("DIAGNOSIS_HISTORY_SUMMARY_SHARE", "0.3"))
+# Characters kept from each summarized turn
+SUMMARY_TURN_CHARS = 160
+# Anomaly chats whose Ollama context is kept in memory
+MAX_SESSIONS = int(os.getenv("DIAGNOSIS_MAX_SESSIONS", "64"))
+SESSION_TTL_S = float(os.getenv("DIAGNOSIS_SESSION_TTL_S", "3600"))
+
+# Rough average for English/Italian text with LLaMA-style tokenizers
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+_ROLE_LABELS = {"user": "User", "assistant": "Assistant"}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _format_turn(message: Dict[str, Any]) -> str:
+    return f"{_ROLE_LABELS.get(message['role'], message['role'].title())}: {message['content'].strip()}"
+
+
+def _summarize_turn(message: Dict[str, Any]) -> str:
+    """First sentence of the turn, capped at SUMMARY_TURN_CHARS"""
+    text = " ".join(message["content"].split())
+    first = _SENTENCE_END_RE.split(text, maxsplit=1)[0]
+    if len(first) > SUMMARY_TURN_CHARS:
+        first = first[: SUMMARY_TURN_CHARS - 3].rstrip() + "..."
+    return f"- {_ROLE_LABELS.get(message['role'], message['role'].title())}: {first}"
+
+
+def build_history(messages: List[Dict[str, Any]], budget_tokens: int = HISTORY_TOKENS) -> Dict[str, Any]:
+    """
+    Prompt section for the prior turns of a chat (oldest first), within
+    budget_tokens. Returns {"text", "turns_verbatim", "turns_summarized", "tokens"}.
+    """
+    if not messages or budget_tokens <= 0:
+        return {"text": "", "turns_verbatim": 0, "turns_summarized": 0, "tokens": 0}
+
+    summary_budget = int(budget_tokens * SUMMARY_SHARE) if len(messages) > 1 else 0
+    verbatim_budget = budget_tokens - summary_budget
+
+    # Newest turns first, verbatim, while they fit
+    verbatim: List[str] = []
+    used = 0
+    split = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        turn = _format_turn(messages[i])
+        cost = estimate_tokens(turn)
+        if used + cost > verbatim_budget:
+            break
+        verbatim.append(turn)
+        used += cost
+        split = i
+    verbatim.reverse()
+
+    # Older turns: one line each, the most recent ones kept when over budget
+    summary: List[str] = []
+    summary_used = 0
+    for message in reversed(messages[:split]):
+        line = _summarize_turn(message)
+        cost = estimate_tokens(line)
+        if summary_used + cost > summary_budget:
+            break
+        summary.append(line)
+        summary_used += cost
+    summary.reverse()
+
+    sections = []
+    if summary:
+        omitted = split - len(summary)
+        header = "Earlier in this conversation (summarized"
+        header += f", {omitted} older turns omitted):" if omitted else "):"
+        sections.append(header + "\n" + "\n".join(summary))
+    if verbatim:
+        sections.append("Recent conversation:\n" + "\n\n".join(verbatim))
+    text = "\n\n".join(sections)
+    return {
+        "text": text,
+        "turns_verbatim": len(verbatim),
+        "turns_summarized": len(summary),
+        "tokens": estimate_tokens(text),
+    }
+
+
+@dataclass
+class ChatSession:
+    # Provider endpoint + model the context belongs to
+    model_key: Tuple[str, ...]
+    context: List[int]
+    # Number of stored chat messages the context accounts for
+    history_len: int
+    # Manual chunks already in the context: chunk_id -> citation ref
+    refs: Dict[str, str] = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)
+
+
+class ChatSessions:
+    """Bounded LRU of per-anomaly Ollama contexts"""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl_s: float = SESSION_TTL_S):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.reused = 0
+        self.rebuilt = 0
+        self._sessions: "OrderedDict[int, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, anomaly_id: int, model_key: Tuple[str, ...], history_len: int) -> Optional[ChatSession]:
+        """
+        The session of the chat, if its context still matches: same model, not
+        expired, and no messages stored since (e.g. from another client).
+        """
+        with self._lock:
+            session = self._sessions.get(anomaly_id)
+            valid = (
+                session is not None
+                and session.model_key == model_key
+                and session.history_len == history_len
+                and time.time() - session.updated_at <= self.ttl_s
+            )
+            if not valid:
+                if session is not None:
+                    del self._sessions[anomaly_id]
+                self.rebuilt += 1
+                return None
+            self._sessions.move_to_end(anomaly_id)
+            self.reused += 1
+            return session
+
+    def put(self, anomaly_id: int, session: ChatSession):
+        with self._lock:
+            self._sessions[anomaly_id] = session
+            self._sessions.move_to_end(anomaly_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def drop(self, anomaly_id: int):
+        with self._lock:
+            self._sessions.pop(anomaly_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "context_reused": self.reused,
+                "context_rebuilt": self.rebuilt,
+            }
+
+
+chat_sessions = ChatSessions()
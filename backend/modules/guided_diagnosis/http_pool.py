@@ -0,0 +1,90 @@
+"""
+Shared async HTTP client for LLM providers - one keep-alive connection pool for
+the whole process, explicit timeouts and retry with exponential backoff, so LLM
+calls never block the event loop (and the background collectors running on it).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+from typing import Any, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+LLM_CONNECT_TIMEOUT_S = float(os.getenv("LLM_CONNECT_TIMEOUT_S", "10"))
+# Max wait between two chunks of a response (not the whole generation when streaming)
+LLM_READ_TIMEOUT_S = float(os.getenv("LLM_READ_TIMEOUT_S", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_HTTP_RETRIES = int(os.getenv("LLM_HTTP_RETRIES", "2"))
+LLM_RETRY_BACKOFF_S = float(os.getenv("LLM_RETRY_BACKOFF_S", "0.5"))
+
+# Responses worth retrying: overload / gateway errors
+RETRY_STATUS = frozenset({429, 502, 503, 504})
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The process-wide client; pooled connections are bound to the event loop that opened them"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client_loop = loop
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=LLM_CONNECT_TIMEOUT_S,
+                read=LLM_READ_TIMEOUT_S,
+                write=30.0,
+                pool=30.0,
+            ),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _client_loop = None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUS
+    # Connection refused/reset and connect/pool timeouts; a read timeout means the
+    # model is busy generating and retrying would only queue the same work again
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError))
+
+
+async def backoff(attempt: int):
+    """Sleep before retry number `attempt` (1-based): exponential with jitter"""
+    delay = LLM_RETRY_BACKOFF_S * (2 ** (attempt - 1))
+    await asyncio.sleep(delay * (0.5 + random.random()))
+
+
+async def request_with_retry(method: str, url: str, retries: int = LLM_HTTP_RETRIES, **kwargs: Any) -> httpx.Response:
+    """Non-streaming request on the shared pool; raises for HTTP errors after retries"""
+    client = get_http_client()
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except Exception as e:
+            attempt += 1
+            if attempt > retries or not is_retryable(e):
+                raise
+            logger.warning(f"{method} {url} failed ({e!r}), retry {attempt}/{retries}")
+            await backoff(attempt)
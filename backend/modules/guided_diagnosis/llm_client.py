@@ -1,9 +1,12 @@
 import os
+import json
 import logging
-import requests
-import google.generativeai as genai
+import threading
+import httpx
 from pathlib import Path
-from .config_store import get_config
+from collections import OrderedDict
+from .config_store import get_config, get_config_version
+from .http_pool import LLM_HTTP_RETRIES, backoff, get_http_client, is_retryable, request_with_retry
 
 # Load environment variables
 try:
@@ -14,11 +17,42 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# How long Ollama keeps the model loaded after a call (Ollama duration syntax)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
+# Gemini REST endpoint (the API key is sent per request, never configured globally)
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+# Warm client instances kept by LLMFactory (distinct provider configurations)
+LLM_CLIENT_POOL_SIZE = int(os.getenv("LLM_CLIENT_POOL_SIZE", "16"))
+# Load the configured Ollama model at startup (keep-alive request without a prompt)
+LLM_PREWARM = os.getenv("LLM_PREWARM", "false").lower() in ("1", "true", "yes")
+
+
 class LLMClient:
-    def generate(self, prompt: str, system_context: str = ""):
+    """
+    Clients are pooled and shared by concurrent requests: per-call results are
+    reported through the `stats` dict a caller passes in, never stored on the
+    instance. Keys filled by providers: tokens, prompt_tokens, eval_duration_s,
+    context (provider state to resume from, see supports_context). All calls go
+    through the shared async HTTP pool (http_pool).
+    """
+    # Model identifier (part of the response cache key)
+    model_name: str = ""
+    # Whether the provider can resume from the evaluated state of a previous call
+    # (agenerate/astream `context`)
+    supports_context: bool = False
+
+    async def agenerate(self, prompt: str, system_context: str = "", context=None, stats: dict = None):
         raise NotImplementedError
 
+    async def astream(self, prompt: str, system_context: str = "", context=None, stats: dict = None):
+        """Yield the response text as it is generated"""
+        raise NotImplementedError
+        yield
+
 class OllamaClient(LLMClient):
+    supports_context = True
+
     def __init__(self, base_url=None, model=None):
         cfg = {}
         try:
@@ -27,33 +61,97 @@ class OllamaClient(LLMClient):
             cfg = {}
         self.base_url = base_url or cfg.get("ollama_base_url") or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         self.model = model or cfg.get("ollama_model") or os.getenv("OLLAMA_MODEL", "llama3.1:latest")
+        self.model_name = self.model
         logger.info(f"Ollama client initialized: {self.base_url} with model {self.model}")
 
-    def generate(self, prompt: str, system_context: str = ""):
-        url = f"{self.base_url}/api/generate"
-        
+    def _payload(self, prompt: str, system_context: str, stream: bool, context=None) -> dict:
         full_prompt = f"System: {system_context}\n\nUser: {prompt}" if system_context else prompt
-
         payload = {
             "model": self.model,
             "prompt": full_prompt,
-            "stream": False
+            "stream": stream,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
         }
-        
+        if context:
+            # Continue from the evaluated prompt/answer of the previous turn
+            payload["context"] = context
+        return payload
+
+    async def agenerate(self, prompt: str, system_context: str = "", context=None, stats: dict = None):
+        url = f"{self.base_url}/api/generate"
         try:
             logger.debug(f"Calling Ollama with model {self.model}")
-            response = requests.post(url, json=payload, timeout=120)
-            response.raise_for_status()
-            return response.json().get("response", "")
-        except requests.exceptions.Timeout:
+            response = await request_with_retry("POST", url, json=self._payload(prompt, system_context, False, context))
+            data = response.json()
+            if stats is not None:
+                stats.update(self._stats(data))
+            return data.get("response", "")
+        except httpx.TimeoutException:
             logger.error("Ollama request timed out")
             return "Error: Request timed out. The model may be loading or overwhelmed."
         except Exception as e:
             logger.error(f"Ollama error: {str(e)}")
             return f"Error contacting Ollama: {str(e)}"
 
+    @staticmethod
+    def _stats(final: dict) -> dict:
+        """Figures of the final (done) response object"""
+        return {
+            "tokens": final.get("eval_count"),
+            "prompt_tokens": final.get("prompt_eval_count"),
+            "eval_duration_s": (final.get("eval_duration") or 0) / 1e9 or None,
+            "context": final.get("context"),
+        }
+
+    async def prewarm(self) -> bool:
+        """Load the model into memory (an empty generate with keep_alive)"""
+        url = f"{self.base_url}/api/generate"
+        try:
+            await request_with_retry(
+                "POST", url, json={"model": self.model, "keep_alive": OLLAMA_KEEP_ALIVE},
+                # Loading a large model from disk can take minutes
+                timeout=300,
+            )
+            logger.info(f"Ollama model {self.model} pre-warmed (keep_alive {OLLAMA_KEEP_ALIVE})")
+            return True
+        except Exception as e:
+            logger.warning(f"Ollama pre-warm of {self.model} failed: {e}")
+            return False
+
+    async def astream(self, prompt: str, system_context: str = "", context=None, stats: dict = None):
+        url = f"{self.base_url}/api/generate"
+        payload = self._payload(prompt, system_context, True, context)
+        client = get_http_client()
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with client.stream("POST", url, json=payload) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise RuntimeError(f"Ollama error: {chunk['error']}")
+                        if chunk.get("response"):
+                            started = True
+                            yield chunk["response"]
+                        if chunk.get("done"):
+                            if stats is not None:
+                                stats.update(self._stats(chunk))
+                            return
+                return
+            except Exception as e:
+                # Only retry while nothing has been forwarded to the caller
+                attempt += 1
+                if started or attempt > LLM_HTTP_RETRIES or not is_retryable(e):
+                    raise
+                logger.warning(f"Ollama stream failed ({e!r}), retry {attempt}/{LLM_HTTP_RETRIES}")
+                await backoff(attempt)
+
 class GeminiClient(LLMClient):
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, model_name=None):
         cfg = {}
         try:
             cfg = get_config()
@@ -61,35 +159,197 @@ class GeminiClient(LLMClient):
             cfg = {}
 
         self.api_key = api_key or cfg.get("gemini_api_key") or os.getenv("GEMINI_API_KEY", "")
+        self.model_name = model_name or cfg.get("gemini_model") or os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+        model = self.model_name if self.model_name.startswith("models/") else f"models/{self.model_name}"
+        self.base_url = f"{GEMINI_API_BASE}/{model}"
         if not self.api_key:
             logger.warning("Gemini API key not configured")
         else:
-            genai.configure(api_key=self.api_key)
-            model_name = cfg.get("gemini_model") or os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
-            self.model = genai.GenerativeModel(model_name)
-            logger.info("Gemini client initialized")
+            logger.info(f"Gemini client initialized with model {self.model_name}")
 
-    def generate(self, prompt: str, system_context: str = ""):
+    def _request(self, prompt: str, system_context: str) -> dict:
+        full_prompt = f"{system_context}\n\n{prompt}" if system_context else prompt
+        return {
+            "json": {"contents": [{"role": "user", "parts": [{"text": full_prompt}]}]},
+            # Header rather than ?key=, so the key never shows up in logged URLs
+            "headers": {"x-goog-api-key": self.api_key},
+        }
+
+    @staticmethod
+    def _text(chunk: dict) -> str:
+        """Text of the first candidate; empty for chunks without text parts (e.g. safety feedback only)"""
+        candidates = chunk.get("candidates") or [{}]
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        return "".join(part.get("text", "") for part in parts)
+
+    @staticmethod
+    def _stats(chunk: dict) -> dict:
+        usage = chunk.get("usageMetadata") or {}
+        return {
+            "tokens": usage.get("candidatesTokenCount"),
+            "prompt_tokens": usage.get("promptTokenCount"),
+        }
+
+    @staticmethod
+    def _api_error(e: Exception) -> str:
+        """The API's own message for HTTP errors (e.g. "API key not valid"), else str(e)"""
+        if isinstance(e, httpx.HTTPStatusError):
+            try:
+                return f"HTTP {e.response.status_code}: {e.response.json()['error']['message']}"
+            except Exception:
+                pass
+        return str(e)
+
+    async def agenerate(self, prompt: str, system_context: str = "", context=None, stats: dict = None):
         if not self.api_key:
             return "Error: Gemini API key not configured. Set GEMINI_API_KEY environment variable."
         try:
-            full_prompt = f"{system_context}\n\n{prompt}" if system_context else prompt
             logger.debug("Calling Gemini API")
-            response = self.model.generate_content(full_prompt)
-            return response.text
+            response = await request_with_retry(
+                "POST", f"{self.base_url}:generateContent", **self._request(prompt, system_context)
+            )
+            data = response.json()
+            if stats is not None:
+                stats.update(self._stats(data))
+            return self._text(data)
+        except httpx.TimeoutException:
+            logger.error("Gemini request timed out")
+            return "Error: Request timed out."
         except Exception as e:
-            logger.error(f"Gemini error: {str(e)}")
-            return f"Error contacting Gemini: {str(e)}"
+            logger.error(f"Gemini error: {self._api_error(e)}")
+            return f"Error contacting Gemini: {self._api_error(e)}"
+
+    async def astream(self, prompt: str, system_context: str = "", context=None, stats: dict = None):
+        if not self.api_key:
+            raise RuntimeError("Gemini API key not configured. Set GEMINI_API_KEY environment variable.")
+        url = f"{self.base_url}:streamGenerateContent"
+        request = self._request(prompt, system_context)
+        client = get_http_client()
+        attempt = 0
+        while True:
+            started = False
+            usage = None
+            try:
+                # Server-sent events: one "data: {GenerateContentResponse}" line per chunk
+                async with client.stream("POST", url, params={"alt": "sse"}, **request) as response:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        chunk = json.loads(line[5:])
+                        if chunk.get("error"):
+                            raise RuntimeError(f"Gemini error: {chunk['error'].get('message', chunk['error'])}")
+                        usage = chunk if chunk.get("usageMetadata") else usage
+                        text = self._text(chunk)
+                        if text:
+                            started = True
+                            yield text
+                if usage is not None and stats is not None:
+                    stats.update(self._stats(usage))
+                return
+            except Exception as e:
+                # Only retry while nothing has been forwarded to the caller
+                attempt += 1
+                if started or attempt > LLM_HTTP_RETRIES or not is_retryable(e):
+                    if isinstance(e, httpx.HTTPStatusError):
+                        raise RuntimeError(f"Gemini error: {self._api_error(e)}") from e
+                    raise
+                logger.warning(f"Gemini stream failed ({e!r}), retry {attempt}/{LLM_HTTP_RETRIES}")
+                await backoff(attempt)
 
 class LLMFactory:
+    """
+    Clients are kept warm in a pool keyed by provider and effective configuration
+    (request overrides resolved against the stored config and env), so a diagnosis
+    does not rebuild them. The pool is
+    emptied when the stored LLM config changes.
+    """
+    _pool: "OrderedDict[tuple, LLMClient]" = OrderedDict()
+    _pool_version = None
+    _lock = threading.Lock()
+    created = 0
+    reused = 0
+
     @staticmethod
-    def get_client(provider: str, config: dict):
+    def effective_config(provider: str, config: dict) -> tuple:
+        config = config or {}
+        cfg = {}
+        try:
+            cfg = get_config()
+        except Exception:
+            cfg = {}
         if provider == "ollama":
-            return OllamaClient(
-                base_url=config.get("url") or os.getenv("OLLAMA_BASE_URL"),
-                model=config.get("model") or os.getenv("OLLAMA_MODEL")
+            base_url = (
+                config.get("url") or os.getenv("OLLAMA_BASE_URL")
+                or cfg.get("ollama_base_url") or "http://localhost:11434"
             )
+            model = (
+                config.get("model") or os.getenv("OLLAMA_MODEL")
+                or cfg.get("ollama_model") or "llama3.1:latest"
+            )
+            return ("ollama", base_url, model)
         elif provider == "gemini":
-            return GeminiClient(api_key=config.get("apiKey") or os.getenv("GEMINI_API_KEY"))
+            api_key = config.get("apiKey") or os.getenv("GEMINI_API_KEY") or cfg.get("gemini_api_key") or ""
+            model_name = cfg.get("gemini_model") or os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+            return ("gemini", api_key, model_name)
         else:
             raise ValueError(f"Unknown LLM provider: {provider}")
+
+    @classmethod
+    def get_client(cls, provider: str, config: dict):
+        key = cls.effective_config(provider, config)
+        with cls._lock:
+            version = get_config_version()
+            if version != cls._pool_version:
+                # Stored config changed: drop clients built from the old one
+                cls._pool.clear()
+                cls._pool_version = version
+            client = cls._pool.get(key)
+            if client is not None:
+                cls._pool.move_to_end(key)
+                cls.reused += 1
+                return client
+        if key[0] == "ollama":
+            client = OllamaClient(base_url=key[1], model=key[2])
+        else:
+            client = GeminiClient(api_key=key[1], model_name=key[2])
+        with cls._lock:
+            cls._pool[key] = client
+            cls.created += 1
+            while len(cls._pool) > LLM_CLIENT_POOL_SIZE:
+                cls._pool.popitem(last=False)
+        return client
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._pool.clear()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            return {
+                "clients": [
+                    {"provider": key[0], "model": key[2], **({"base_url": key[1]} if key[0] == "ollama" else {})}
+                    for key in cls._pool
+                ],
+                "max_clients": LLM_CLIENT_POOL_SIZE,
+                "created": cls.created,
+                "reused": cls.reused,
+            }
+
+
+async def prewarm_configured_model():
+    """Pre-load the configured Ollama model at startup (LLM_PREWARM=true)"""
+    cfg = {}
+    try:
+        cfg = get_config()
+    except Exception:
+        cfg = {}
+    provider = cfg.get("llm_provider") or os.getenv("LLM_PROVIDER", "ollama")
+    if provider != "ollama":
+        return False
+    client = LLMFactory.get_client("ollama", {})
+    return await client.prewarm()
@@ -0,0 +1,293 @@
+"""
+LLM request scheduler - sits between the diagnosis service and the LLM clients.
+
+- Bounded concurrency per provider (LLM_CONCURRENCY_<PROVIDER>): a local Ollama
+  only runs a few generations at once, the rest wait in a queue.
+- Priority queue: diagnoses of critical anomalies are served first, FIFO within
+  the same priority.
+- Singleflight: concurrent requests with the same dedupe key (same provider,
+  model, prompt and context) share one generation. A request joining late
+  replays the pieces generated so far, then follows live.
+- Queue position is observable while waiting (streamed to the caller), and queue
+  wait / service times are kept per provider.
+
+Generations run in their own task, so one caller disconnecting does not cancel a
+generation other callers are following; it is cancelled when nobody follows it.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CRITICAL = 0
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+PRIORITY_NAMES = {PRIORITY_CRITICAL: "critical", PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal"}
+
+_DEFAULT_CONCURRENCY = {"ollama": 1, "gemini": 4}
+# Recent (queue wait, service time) samples kept per provider
+METRICS_WINDOW = 500
+
+
+def provider_concurrency(provider: str) -> int:
+    default = _DEFAULT_CONCURRENCY.get(provider, 2)
+    return max(1, int(os.getenv(f"LLM_CONCURRENCY_{provider.upper()}", str(default))))
+
+
+class Flight:
+    """One scheduled generation and the callers following it"""
+
+    def __init__(self, lane: "_Lane", key: str, priority: int, owner: Any):
+        self.lane = lane
+        self.key = key
+        self.priority = priority
+        # Per-call state of the generation (provider stats dict); followers read it
+        self.owner = owner
+        self.state = "queued"  # queued -> running -> done | failed
+        self.pieces: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.joined = 0
+        self.queued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.position_at_enqueue: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def info(self) -> Dict[str, Any]:
+        """Queue figures of this generation, as returned to callers"""
+        started = self.started_at or time.perf_counter()
+        return {
+            "priority": PRIORITY_NAMES.get(self.priority, str(self.priority)),
+            "position_at_enqueue": self.position_at_enqueue,
+            "wait_s": round(started - self.queued_at, 3),
+            "service_s": round(self.finished_at - self.started_at, 3) if self.finished_at and self.started_at else None,
+            "shared_with": self.joined,
+        }
+
+    async def follow(self) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Yields ("queued", {"position", "queue_length"}) whenever the queue position
+        changes while waiting, then ("token", text) for every generated piece.
+        Raises the generation's exception if it failed.
+        """
+        self.followers += 1
+        sent = 0
+        last_position = None
+        try:
+            while True:
+                changed = self._changed
+                if self.state == "queued":
+                    position = self.lane.position(self)
+                    if position and position != last_position:
+                        last_position = position
+                        yield "queued", {"position": position, "queue_length": len(self.lane.waiting)}
+                while sent < len(self.pieces):
+                    piece = self.pieces[sent]
+                    sent += 1
+                    yield "token", piece
+                if self.state == "done":
+                    return
+                if self.state == "failed":
+                    raise self.error
+                await changed.wait()
+        finally:
+            self.followers -= 1
+            if self.followers == 0 and self.task is not None and not self.task.done():
+                self.task.cancel()
+
+    async def result(self) -> str:
+        """Wait for the whole generation (queue feedback is dropped)"""
+        pieces = []
+        async for kind, value in self.follow():
+            if kind == "token":
+                pieces.append(value)
+        return "".join(pieces)
+
+
+class _Lane:
+    """Concurrency slots and waiting queue of one provider"""
+
+    def __init__(self, provider: str, limit: int):
+        self.provider = provider
+        self.limit = limit
+        self.running = 0
+        # (priority, sequence, flight, grant future)
+        self.waiting: List[Tuple[int, int, Flight, asyncio.Future]] = []
+        self.submitted = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.wait_s: Deque[float] = deque(maxlen=METRICS_WINDOW)
+        self.service_s: Deque[float] = deque(maxlen=METRICS_WINDOW)
+
+    def position(self, flight: Flight) -> int:
+        """1-based place in the queue (0: not waiting)"""
+        for entry in self.waiting:
+            if entry[2] is flight:
+                return 1 + sum(1 for other in self.waiting if other[:2] < entry[:2])
+        return 0
+
+    async def acquire(self, flight: Flight, seq: int):
+        if self.running < self.limit and not self.waiting:
+            self.running += 1
+            flight.position_at_enqueue = 0
+            return
+        grant = asyncio.get_running_loop().create_future()
+        entry = (flight.priority, seq, flight, grant)
+        heapq.heappush(self.waiting, entry)
+        flight.position_at_enqueue = self.position(flight)
+        self._notify_waiting()
+        try:
+            await grant
+        except asyncio.CancelledError:
+            if grant.done() and not grant.cancelled():
+                # Granted just before the cancellation: hand the slot on
+                self.release()
+            else:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self._notify_waiting()
+            raise
+
+    def release(self):
+        self.running -= 1
+        while self.waiting and self.running < self.limit:
+            _, _, flight, grant = heapq.heappop(self.waiting)
+            if grant.done():
+                continue
+            self.running += 1
+            grant.set_result(None)
+        self._notify_waiting()
+
+    def _notify_waiting(self):
+        for entry in self.waiting:
+            entry[2].notify()
+
+    def get_stats(self) -> Dict[str, Any]:
+        def percentiles(values: Deque[float]) -> Dict[str, Optional[float]]:
+            ordered = sorted(values)
+            if not ordered:
+                return {"median": None, "p95": None}
+            return {
+                "median": round(ordered[len(ordered) // 2], 3),
+                # Nearest-rank percentile
+                "p95": round(ordered[math.ceil(0.95 * len(ordered)) - 1], 3),
+            }
+
+        return {
+            "concurrency": self.limit,
+            "running": self.running,
+            "queued": len(self.waiting),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "queue_wait_s": percentiles(self.wait_s),
+            "service_s": percentiles(self.service_s),
+        }
+
+
+class LLMScheduler:
+    def __init__(self):
+        self._lanes: Dict[str, _Lane] = {}
+        self._inflight: Dict[str, Flight] = {}
+        self._seq = itertools.count()
+
+    def _lane(self, provider: str) -> _Lane:
+        lane = self._lanes.get(provider)
+        if lane is None:
+            lane = self._lanes[provider] = _Lane(provider, provider_concurrency(provider))
+        return lane
+
+    def submit(
+        self,
+        provider: str,
+        key: str,
+        start: Callable[[], AsyncIterator[str]],
+        priority: int = PRIORITY_NORMAL,
+        owner: Any = None,
+    ) -> Flight:
+        """
+        Schedule start() (an async iterator of response pieces) on the provider's
+        lane, or join the in-flight generation with the same key. A joined
+        generation queued at a lower priority is promoted.
+        """
+        lane = self._lane(provider)
+        lane.submitted += 1
+        flight = self._inflight.get(key)
+        if flight is not None:
+            lane.deduplicated += 1
+            flight.joined += 1
+            if priority < flight.priority and flight.state == "queued":
+                self._promote(lane, flight, priority)
+            return flight
+
+        flight = Flight(lane, key, priority, owner)
+        self._inflight[key] = flight
+        flight.task = asyncio.create_task(self._run(lane, flight, start))
+        return flight
+
+    def _promote(self, lane: _Lane, flight: Flight, priority: int):
+        flight.priority = priority
+        for i, (_, seq, queued, grant) in enumerate(lane.waiting):
+            if queued is flight:
+                lane.waiting[i] = (priority, seq, queued, grant)
+                heapq.heapify(lane.waiting)
+                lane._notify_waiting()
+                break
+
+    async def _run(self, lane: _Lane, flight: Flight, start: Callable[[], AsyncIterator[str]]):
+        acquired = False
+        try:
+            await lane.acquire(flight, next(self._seq))
+            acquired = True
+            flight.started_at = time.perf_counter()
+            flight.state = "running"
+            flight.notify()
+            async for piece in start():
+                flight.pieces.append(piece)
+                flight.notify()
+            flight.state = "done"
+            lane.completed += 1
+        except asyncio.CancelledError as e:
+            flight.state, flight.error = "failed", e
+            lane.cancelled += 1
+            raise
+        except Exception as e:
+            flight.state, flight.error = "failed", e
+            lane.failed += 1
+        finally:
+            flight.finished_at = time.perf_counter()
+            if self._inflight.get(flight.key) is flight:
+                del self._inflight[flight.key]
+            if acquired:
+                lane.release()
+                lane.wait_s.append(flight.started_at - flight.queued_at)
+                lane.service_s.append(flight.finished_at - flight.started_at)
+            flight.notify()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "providers": {name: lane.get_stats() for name, lane in self._lanes.items()},
+            "inflight": len(self._inflight),
+        }
+
+
+llm_scheduler = LLMScheduler()
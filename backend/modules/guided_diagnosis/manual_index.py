@@ -0,0 +1,375 @@
+"""
+Manual retrieval index - the machine manual is split into overlapping chunks and
+indexed with BM25 (postings in the guided diagnosis SQLite DB), so a diagnosis
+prompt only carries the few sections relevant to the anomaly, with citations.
+
+Chunks are content-addressed (hash of their text): re-indexing an edited manual
+only tokenizes/embeds new chunks and drops the removed ones.
+
+Optional embeddings: with MANUAL_EMBED_MODEL set (an Ollama embedding model, e.g.
+"nomic-embed-text") chunk vectors are stored alongside and the ranking blends the
+BM25 score with cosine similarity. Embedding failures fall back to BM25 only.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from .config_store import get_config, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+CHUNK_WORDS = int(os.getenv("MANUAL_CHUNK_WORDS", "180"))
+CHUNK_OVERLAP_WORDS = int(os.getenv("MANUAL_CHUNK_OVERLAP_WORDS", "40"))
+EMBED_MODEL = os.getenv("MANUAL_EMBED_MODEL", "").strip()
+# Weight of the embedding similarity in the hybrid score (0..1)
+EMBED_WEIGHT = float(os.getenv("MANUAL_EMBED_WEIGHT", "0.5"))
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Markdown headings, numbered titles ("3.2 Lubrication") and ALL-CAPS lines
+_HEADING_RE = re.compile(r"^(#{1,6}\s+.+|\d+(\.\d+)*[.)]?\s+\S.*|[A-Z0-9][A-Z0-9 /\-]{3,})$")
+HEADING_MAX_CHARS = 80
+# Short function words (Italian and English manuals) carry no retrieval signal
+_STOP_WORDS = frozenset(
+    """
+    a an and are as at be by for from has have in is it its of on or that the this to was were will with
+    il lo la i gli le un una uno di da del della dei delle che e ed è per con su non si al alla
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in _STOP_WORDS]
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _is_heading(line: str) -> bool:
+    # Sentences ("1. Check the oil level.") are list items, not titles
+    if not line or len(line) > HEADING_MAX_CHARS or line[-1] in ".:;,":
+        return False
+    return bool(_HEADING_RE.match(line))
+
+
+def chunk_manual(text: str, chunk_words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> List[Dict[str, Any]]:
+    """
+    Split the manual into chunks of ~chunk_words words that do not cross section
+    headings; long sections are covered by overlapping windows.
+    Each chunk: {ord, section, start, end, text} with character offsets.
+    """
+    # Sections: (title, start offset, end offset)
+    sections: List[Tuple[str, int, int]] = []
+    title, start = "", 0
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        if _is_heading(line.strip()):
+            if offset > start:
+                sections.append((title, start, offset))
+            title, start = line.strip().lstrip("#").strip(), offset
+        offset += len(line)
+    sections.append((title, start, len(text)))
+
+    step = max(1, chunk_words - overlap)
+    chunks: List[Dict[str, Any]] = []
+    for title, s_start, s_end in sections:
+        words = [(m.start() + s_start, m.end() + s_start) for m in re.finditer(r"\S+", text[s_start:s_end])]
+        if not words:
+            continue
+        for w0 in range(0, len(words), step):
+            span = words[w0:w0 + chunk_words]
+            c_start, c_end = span[0][0], span[-1][1]
+            chunks.append(
+                {
+                    "ord": len(chunks),
+                    "section": title,
+                    "start": c_start,
+                    "end": c_end,
+                    "text": text[c_start:c_end],
+                }
+            )
+            if w0 + chunk_words >= len(words):
+                break
+    return chunks
+
+
+def _embed(texts: List[str]) -> Optional[List[List[float]]]:
+    """Embeddings from the configured Ollama server, or None if unavailable."""
+    if not EMBED_MODEL or not texts:
+        return None
+    try:
+        cfg = get_config()
+    except Exception:
+        cfg = {}
+    base_url = (cfg.get("ollama_base_url") or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")).rstrip("/")
+    try:
+        r = requests.post(f"{base_url}/api/embed", json={"model": EMBED_MODEL, "input": texts}, timeout=120)
+        r.raise_for_status()
+        return r.json().get("embeddings")
+    except Exception as e:
+        logger.warning(f"Manual embeddings unavailable ({EMBED_MODEL}): {e}")
+        return None
+
+
+class ManualIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Cached from the database on first use and kept current by sync()
+        self._manual_hash: Optional[str] = None
+        self._chunk_count: Optional[int] = None
+
+    def init_db(self):
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS manual_chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    ord INTEGER NOT NULL,
+                    section TEXT,
+                    start_char INTEGER NOT NULL,
+                    end_char INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    embedding BLOB
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS manual_postings (
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk_id)
+                ) WITHOUT ROWID
+                """
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_manual_postings_chunk ON manual_postings(chunk_id)")
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS manual_index_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+                """
+            )
+            conn.commit()
+        self._manual_hash = None
+        self._chunk_count = None
+
+    def indexed_manual_hash(self) -> Optional[str]:
+        if self._manual_hash is None:
+            with get_db_connection() as conn:
+                row = conn.execute("SELECT value FROM manual_index_meta WHERE key = 'manual_hash'").fetchone()
+            self._manual_hash = row["value"] if row else None
+        return self._manual_hash
+
+    def chunk_count(self) -> int:
+        """Number of indexed chunks, without a database round trip once known"""
+        if self._chunk_count is None:
+            with get_db_connection() as conn:
+                self._chunk_count = int(conn.execute("SELECT COUNT(*) FROM manual_chunks").fetchone()[0])
+        return self._chunk_count
+
+    def sync_if_changed(self, manual_text: str) -> Optional[Dict[str, Any]]:
+        """Re-index only if the manual differs from the indexed one"""
+        if self.indexed_manual_hash() == _text_hash(manual_text):
+            return None
+        return self.sync(manual_text)
+
+    def sync(self, manual_text: str) -> Dict[str, Any]:
+        """
+        Bring the index in line with the manual text. Only chunks whose text changed
+        are (re)indexed; unchanged chunks just get their position refreshed.
+        """
+        manual_hash = _text_hash(manual_text)
+        chunks = chunk_manual(manual_text)
+        for c in chunks:
+            c["chunk_id"] = _text_hash(f"{c['section']}\n{c['text']}")
+        # Identical repeated chunks are indexed once
+        by_id = {c["chunk_id"]: c for c in reversed(chunks)}
+
+        with self._lock, get_db_connection() as conn:
+            cur = conn.cursor()
+            existing = {row["chunk_id"] for row in cur.execute("SELECT chunk_id FROM manual_chunks")}
+            removed = existing - by_id.keys()
+            added = [c for cid, c in by_id.items() if cid not in existing]
+
+            cur.executemany("DELETE FROM manual_postings WHERE chunk_id = ?", [(cid,) for cid in removed])
+            cur.executemany("DELETE FROM manual_chunks WHERE chunk_id = ?", [(cid,) for cid in removed])
+
+            vectors = _embed([c["text"] for c in added]) if added else None
+            for i, c in enumerate(added):
+                tf = Counter(tokenize(c["section"] + " " + c["text"]))
+                blob = None
+                if vectors and i < len(vectors):
+                    v = np.asarray(vectors[i], dtype=np.float32)
+                    blob = (v / (np.linalg.norm(v) or 1.0)).tobytes()
+                cur.execute(
+                    """
+                    INSERT INTO manual_chunks (chunk_id, ord, section, start_char, end_char, text, length, embedding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (c["chunk_id"], c["ord"], c["section"], c["start"], c["end"], c["text"], sum(tf.values()), blob),
+                )
+                cur.executemany(
+                    "INSERT INTO manual_postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, c["chunk_id"], n) for term, n in tf.items()],
+                )
+            if EMBED_MODEL:
+                # Chunks indexed before embeddings were enabled
+                missing = cur.execute(
+                    "SELECT chunk_id, text FROM manual_chunks WHERE embedding IS NULL"
+                ).fetchall()
+                backfill = _embed([r["text"] for r in missing]) if missing else None
+                for r, v in zip(missing, backfill or []):
+                    v = np.asarray(v, dtype=np.float32)
+                    cur.execute(
+                        "UPDATE manual_chunks SET embedding = ? WHERE chunk_id = ?",
+                        ((v / (np.linalg.norm(v) or 1.0)).tobytes(), r["chunk_id"]),
+                    )
+            cur.executemany(
+                "UPDATE manual_chunks SET ord = ?, start_char = ?, end_char = ? WHERE chunk_id = ?",
+                [(c["ord"], c["start"], c["end"], cid) for cid, c in by_id.items() if cid in existing],
+            )
+            cur.execute(
+                "INSERT INTO manual_index_meta (key, value) VALUES ('manual_hash', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (manual_hash,),
+            )
+            conn.commit()
+            self._manual_hash = manual_hash
+            self._chunk_count = len(by_id)
+
+        stats = {"chunks_total": len(by_id), "chunks_added": len(added), "chunks_removed": len(removed)}
+        logger.info(f"Manual index synced: {stats}")
+        return stats
+
+    def search(self, query: str, k: int = 4) -> List[Dict[str, Any]]:
+        """Top-k chunks for the query (BM25, blended with embeddings when available)"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            row = cur.execute("SELECT COUNT(*) AS n, AVG(length) AS avgdl FROM manual_chunks").fetchone()
+            n_chunks, avgdl = int(row["n"] or 0), float(row["avgdl"] or 0.0) or 1.0
+            if n_chunks == 0:
+                return []
+
+            scores: Dict[str, float] = {}
+            if terms:
+                placeholders = ",".join("?" * len(terms))
+                rows = cur.execute(
+                    f"""
+                    WITH df AS (
+                        SELECT term, COUNT(*) AS df FROM manual_postings
+                        WHERE term IN ({placeholders}) GROUP BY term
+                    )
+                    SELECT p.chunk_id, p.tf, c.length, df.df
+                    FROM manual_postings p
+                    JOIN df ON df.term = p.term
+                    JOIN manual_chunks c ON c.chunk_id = p.chunk_id
+                    """,
+                    terms,
+                ).fetchall()
+                for r in rows:
+                    idf = math.log(1.0 + (n_chunks - r["df"] + 0.5) / (r["df"] + 0.5))
+                    norm = r["tf"] + BM25_K1 * (1.0 - BM25_B + BM25_B * r["length"] / avgdl)
+                    scores[r["chunk_id"]] = scores.get(r["chunk_id"], 0.0) + idf * r["tf"] * (BM25_K1 + 1.0) / norm
+
+            if EMBED_MODEL:
+                scores = self._blend_embeddings(cur, query, scores)
+
+            top = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+            top = [(cid, s) for cid, s in top if s > 0]
+            if not top:
+                return []
+            placeholders = ",".join("?" * len(top))
+            rows = {
+                r["chunk_id"]: r
+                for r in cur.execute(
+                    f"SELECT chunk_id, ord, section, start_char, end_char, text FROM manual_chunks "
+                    f"WHERE chunk_id IN ({placeholders})",
+                    [cid for cid, _ in top],
+                )
+            }
+        return [
+            {
+                "chunk_id": cid,
+                "ord": rows[cid]["ord"],
+                "section": rows[cid]["section"],
+                "start": rows[cid]["start_char"],
+                "end": rows[cid]["end_char"],
+                "score": round(score, 4),
+                "text": rows[cid]["text"],
+            }
+            for cid, score in top
+            if cid in rows
+        ]
+
+    def _blend_embeddings(self, cur, query: str, scores: Dict[str, float]) -> Dict[str, float]:
+        rows = cur.execute("SELECT chunk_id, embedding FROM manual_chunks WHERE embedding IS NOT NULL").fetchall()
+        vectors = _embed([query]) if rows else None
+        if not vectors:
+            return scores
+        q = np.asarray(vectors[0], dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        ids = [r["chunk_id"] for r in rows]
+        mat = np.vstack([np.frombuffer(r["embedding"], dtype=np.float32) for r in rows])
+        if mat.shape[1] != len(q):
+            return scores
+        cosine = np.clip(mat @ q, 0.0, 1.0)
+        top_bm25 = max(scores.values(), default=0.0) or 1.0
+        blended = {cid: (1.0 - EMBED_WEIGHT) * s / top_bm25 for cid, s in scores.items()}
+        for cid, c in zip(ids, cosine):
+            blended[cid] = blended.get(cid, 0.0) + EMBED_WEIGHT * float(c)
+        return blended
+
+    def all_chunks(self) -> List[Dict[str, Any]]:
+        with get_db_connection() as conn:
+            rows = conn.execute(
+                "SELECT chunk_id, ord, section, start_char, end_char, text FROM manual_chunks ORDER BY ord"
+            ).fetchall()
+        return [
+            {
+                "chunk_id": r["chunk_id"],
+                "ord": r["ord"],
+                "section": r["section"],
+                "start": r["start_char"],
+                "end": r["end_char"],
+                "score": None,
+                "text": r["text"],
+            }
+            for r in rows
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS n, SUM(embedding IS NOT NULL) AS embedded FROM manual_chunks"
+            ).fetchone()
+            terms = conn.execute("SELECT COUNT(DISTINCT term) AS t FROM manual_postings").fetchone()
+        return {
+            "chunks": int(row["n"] or 0),
+            "embedded_chunks": int(row["embedded"] or 0),
+            "terms": int(terms["t"] or 0),
+            "embed_model": EMBED_MODEL or None,
+            "manual_hash": self.indexed_manual_hash(),
+        }
+
+
+manual_index = ManualIndex()
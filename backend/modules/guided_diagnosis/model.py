@@ -11,3 +11,4 @@ class DiagnosisRequest(BaseModel):
     provider: str  # "ollama" or "gemini"
     config: Optional[Dict[str, Any]] = {} 
     # config can contain apiKey for Gemini, or url/model for Ollama
+    use_cache: bool = True  # False: skip the response cache lookup (the answer is still stored)
@@ -0,0 +1,186 @@
+"""
+LLM response cache - diagnoses stored in the guided diagnosis SQLite DB, so asking
+the same question about the same anomaly (or re-opening a chat) does not pay for
+another generation.
+
+Entries are keyed by provider, model, normalized query and the hashes of the
+manual and of the anomaly context: editing the manual or asking about a different
+event is always a miss. The chat history is not part of the key, so a question
+already answered for an anomaly is served from the cache in any conversation
+about it. Entries expire after LLM_CACHE_TTL_S; when the stored
+responses exceed LLM_CACHE_MAX_MB the least recently used ones are evicted.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .config_store import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+# Bump when the prompt layout changes, so answers to old prompts are never hit
+KEY_VERSION = 2
+
+
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").lower().split())
+
+
+def context_hash(context: Any) -> str:
+    """Stable hash of a JSON-like value (key order does not matter)"""
+    data = json.dumps(context or {}, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def cache_key(provider: str, model: str, query: str, manual_hash: str, anomaly_hash: str, **options: Any) -> str:
+    parts = [f"v{KEY_VERSION}", provider, model or "", normalize_query(query), manual_hash, anomaly_hash]
+    parts.extend(f"{k}={options[k]}" for k in sorted(options))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, ttl_s: float = CACHE_TTL_S, max_bytes: int = CACHE_MAX_BYTES, enabled: bool = CACHE_ENABLED):
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+    def init_db(self):
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    model TEXT,
+                    query TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    citations TEXT,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            cur.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_response_cache_used ON llm_response_cache(last_used_at)"
+            )
+            conn.commit()
+
+    def count_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached {"response", "citations", "created_at"} or None (expired entries are misses)"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT response, citations, created_at FROM llm_response_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_s),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE llm_response_cache SET last_used_at = ?, hit_count = hit_count + 1 WHERE key = ?",
+                    (now, key),
+                )
+                conn.commit()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {
+            "response": row["response"],
+            "citations": json.loads(row["citations"]) if row["citations"] else [],
+            "created_at": row["created_at"],
+        }
+
+    def put(
+        self,
+        key: str,
+        provider: str,
+        model: str,
+        query: str,
+        response: str,
+        citations: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        if not self.enabled or not response:
+            return
+        citations_json = json.dumps(citations or [])
+        size = len(response.encode("utf-8")) + len(citations_json) + len(query)
+        now = time.time()
+        with get_db_connection() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO llm_response_cache
+                    (key, provider, model, query, response, citations, size_bytes, created_at, last_used_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, provider, model, query, response, citations_json, size, now, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now: float):
+        expired = conn.execute("DELETE FROM llm_response_cache WHERE created_at < ?", (now - self.ttl_s,)).rowcount
+        # Keep the most recently used entries whose cumulative size fits in max_bytes
+        evicted = conn.execute(
+            """
+            DELETE FROM llm_response_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size_bytes) OVER (ORDER BY last_used_at DESC, key) AS cumulative
+                    FROM llm_response_cache
+                ) WHERE cumulative > ?
+            )
+            """,
+            (self.max_bytes,),
+        ).rowcount
+        if expired or evicted:
+            logger.info(f"LLM response cache: {expired} expired, {evicted} evicted")
+
+    def clear(self) -> int:
+        with get_db_connection() as conn:
+            removed = conn.execute("DELETE FROM llm_response_cache").rowcount
+            conn.commit()
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS n, COALESCE(SUM(size_bytes), 0) AS size FROM llm_response_cache"
+            ).fetchone()
+        with self._lock:
+            hits, misses, bypassed = self.hits, self.misses, self.bypassed
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "entries": int(row["n"]),
+            "size_bytes": int(row["size"]),
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl_s,
+            "hits": hits,
+            "misses": misses,
+            "bypassed": bypassed,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+        }
+
+
+response_cache = ResponseCache()
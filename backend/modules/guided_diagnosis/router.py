@@ -1,6 +1,13 @@
+import json
 import logging
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from .service import service
+from .manual_index import manual_index
+from .response_cache import response_cache
+from .llm_scheduler import llm_scheduler
+from .anomaly_context import anomaly_context_cache
 from .model import ManualUpdate, DiagnosisRequest
 from modules.anomaly_detection.database import save_chat_message
 
@@ -13,18 +20,33 @@ async def get_manual():
     return {"text": service.get_manual()}
 
 @router.post("/manual")
-async def update_manual(update: ManualUpdate):
+def update_manual(update: ManualUpdate):
+    """Save the manual and re-index it (plain def: indexing may block on the embedding model)"""
     return service.update_manual(update.text)
 
+@router.get("/manual/index")
+def get_manual_index():
+    """Manual retrieval index statistics"""
+    return manual_index.get_stats()
+
+@router.get("/manual/search")
+def search_manual(q: str, k: int = 4):
+    """Top-k manual chunks for a query (what a diagnosis prompt would cite)"""
+    k = max(1, min(int(k), 20))
+    service.sync_manual_index()
+    return {"query": q, "results": manual_index.search(q, k=k)}
+
 @router.post("/analyze")
 async def diagnose(request: DiagnosisRequest):
     logger.info(f"Diagnosis request for anomaly_id={request.anomaly_id}")
     
-    result = service.diagnose(
+    result = await service.diagnose(
         request.anomaly_context, 
         request.query, 
         request.provider, 
-        request.config
+        request.config,
+        anomaly_id=request.anomaly_id,
+        use_cache=request.use_cache,
     )
     
     if "error" in result:
@@ -34,11 +56,73 @@ async def diagnose(request: DiagnosisRequest):
     if request.anomaly_id:
         try:
             # Save user query
-            save_chat_message(request.anomaly_id, "user", request.query)
+            await run_in_threadpool(save_chat_message, request.anomaly_id, "user", request.query)
             # Save assistant response
-            save_chat_message(request.anomaly_id, "assistant", result.get("response", ""))
+            await run_in_threadpool(save_chat_message, request.anomaly_id, "assistant", result.get("response", ""))
             logger.info(f"Chat saved for anomaly {request.anomaly_id}")
         except Exception as e:
             logger.warning(f"Failed to save chat for anomaly {request.anomaly_id}: {e}")
     
     return result
+
+@router.post("/analyze/stream")
+async def diagnose_stream(request: DiagnosisRequest):
+    """
+    Streaming variant of /analyze: newline-delimited JSON events
+    (meta -> queued* -> token* -> done | error). The assembled reply is stored in the
+    anomaly chat once generation completes.
+    """
+    logger.info(f"Streaming diagnosis request for anomaly_id={request.anomaly_id}")
+
+    async def events():
+        async for event in service.diagnose_stream(
+            request.anomaly_context,
+            request.query,
+            request.provider,
+            request.config,
+            anomaly_id=request.anomaly_id,
+            use_cache=request.use_cache,
+        ):
+            if event["type"] == "done" and request.anomaly_id:
+                try:
+                    await run_in_threadpool(save_chat_message, request.anomaly_id, "user", request.query)
+                    await run_in_threadpool(save_chat_message, request.anomaly_id, "assistant", event["response"])
+                    logger.info(f"Chat saved for anomaly {request.anomaly_id}")
+                except Exception as e:
+                    logger.warning(f"Failed to save chat for anomaly {request.anomaly_id}: {e}")
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@router.get("/metrics")
+def get_diagnosis_metrics():
+    """Time-to-first-token and tokens/s of recent streamed diagnoses"""
+    return service.get_stream_metrics()
+
+@router.get("/context/{event_id}")
+def get_anomaly_context(event_id: int):
+    """Compact summary of an anomaly event and its sample window, as sent to the LLM"""
+    summary = anomaly_context_cache.for_event(event_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return summary
+
+@router.get("/context")
+def get_anomaly_context_stats():
+    """Anomaly context cache entries and hit/miss/precompute counters"""
+    return anomaly_context_cache.get_stats()
+
+@router.get("/scheduler")
+def get_scheduler_stats():
+    """Per-provider concurrency, queue length, dedupe counts and queue wait / service times"""
+    return llm_scheduler.get_stats()
+
+@router.get("/cache")
+def get_response_cache():
+    """LLM response cache usage and hit/miss counters"""
+    return response_cache.get_stats()
+
+@router.post("/cache/clear")
+def clear_response_cache():
+    """Drop all cached LLM responses"""
+    return {"status": "success", "entries_deleted": response_cache.clear()}
@@ -1,11 +1,40 @@
 import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import deque
 from .llm_client import LLMFactory
+from .manual_index import manual_index
+from .response_cache import cache_key, context_hash, response_cache
+from .conversation import ChatSession, build_history, chat_sessions
+from .anomaly_context import anomaly_context_cache, summarize_event
+from .llm_scheduler import PRIORITY_CRITICAL, PRIORITY_HIGH, PRIORITY_NORMAL, llm_scheduler
+from modules.anomaly_detection.database import get_anomaly_event_by_id, get_anomaly_events_by_ids, get_chat_history
+from modules.anomaly_detection.similarity_index import similarity_index
+
+logger = logging.getLogger(__name__)
 
 MANUAL_FILE = os.path.join(os.path.dirname(__file__), "manual.txt")
+# Manual chunks injected into the diagnosis prompt
+MANUAL_TOP_K = int(os.getenv("MANUAL_TOP_K", "4"))
+# Diagnosed past incidents similar to the anomaly shown in the prompt
+SIMILAR_INCIDENTS_K = int(os.getenv("DIAGNOSIS_SIMILAR_K", "3"))
+SIMILAR_INCIDENTS_MIN = float(os.getenv("DIAGNOSIS_SIMILAR_MIN", "0.4"))
+# Characters kept from the diagnosis of each similar incident
+SIMILAR_INCIDENT_CHARS = 400
+
+# generate() reports provider failures as text with these prefixes: never cache them
+_ERROR_PREFIXES = ("Error: ", "Error contacting ")
 
 class DiagnosisService:
     def __init__(self):
         self._ensure_manual_file()
+        # (mtime, size) of the manual file when the index was last checked against it
+        self._manual_stat = None
+        # Timing of recent streamed generations (time to first token, tokens/s)
+        self.stream_metrics = deque(maxlen=200)
 
     def _ensure_manual_file(self):
         if not os.path.exists(MANUAL_FILE):
@@ -19,19 +48,107 @@ class DiagnosisService:
     def update_manual(self, text: str):
         with open(MANUAL_FILE, "w") as f:
             f.write(text)
-        return {"status": "success", "message": "Manual updated"}
+        index_stats = manual_index.sync(text)
+        self._manual_stat = self._stat_manual()
+        return {"status": "success", "message": "Manual updated", "index": index_stats}
+
+    @staticmethod
+    def _stat_manual():
+        st = os.stat(MANUAL_FILE)
+        return st.st_mtime_ns, st.st_size
+
+    def sync_manual_index(self):
+        """
+        Re-index the manual if the file changed on disk since the last check.
+        An unchanged file costs one stat(); a changed one is read and compared by hash.
+        """
+        stat = self._stat_manual()
+        if stat == self._manual_stat:
+            return None
+        result = manual_index.sync_if_changed(self.get_manual())
+        self._manual_stat = stat
+        return result
+
+    def retrieve_manual(self, query: str, k: int = MANUAL_TOP_K):
+        """
+        Manual chunks relevant to the query. The index is refreshed first if the
+        manual file changed on disk; a manual that fits in k chunks is used whole.
+        """
+        self.sync_manual_index()
+        if manual_index.chunk_count() <= k:
+            return manual_index.all_chunks()
+        return manual_index.search(query, k=k)
+
+    @staticmethod
+    def _retrieval_query(anomaly_context: dict, user_query: str) -> str:
+        parts = [user_query]
+        if anomaly_context:
+            parts.append(str(anomaly_context.get("message", anomaly_context.get("description", ""))))
+            details = anomaly_context.get("details") or {}
+            if isinstance(details, dict):
+                parts.extend(str(sig) for sig in (details.get("anomalies") or {}))
+        return " ".join(p for p in parts if p)
+
+    def _build_prompt(
+        self, anomaly_context: dict, user_query: str, history_text: str = "", refs: dict = None,
+        context_summary: str = "", similar_text: str = "",
+    ):
+        """
+        Returns (user prompt, system context, manual citations).
+        context_summary (see anomaly_context) replaces the raw signal data of the event;
+        similar_text lists diagnosed past incidents (see _similar_incidents).
+        refs maps manual chunk ids to their citation refs and is updated in place.
+        A non-empty refs means the prompt continues a provider context that already
+        holds the system context, the anomaly and those excerpts: only the new
+        excerpts and the query are sent.
+        """
+        try:
+            chunks = self.retrieve_manual(self._retrieval_query(anomaly_context, user_query))
+        except Exception as e:
+            logger.warning(f"Manual retrieval failed, diagnosing without manual context: {e}")
+            chunks = []
+
+        refs = {} if refs is None else refs
+        continuing = bool(refs)
+        citations = []
+        excerpts = []
+        for chunk in chunks:
+            ref = refs.get(chunk["chunk_id"])
+            if ref is None:
+                ref = f"M{len(refs) + 1}"
+                refs[chunk["chunk_id"]] = ref
+                section = chunk["section"] or "Manual"
+                excerpts.append(f"[{ref}] {section} (chars {chunk['start']}-{chunk['end']})\n{chunk['text']}")
+            citations.append({
+                "ref": ref,
+                "chunk_id": chunk["chunk_id"],
+                "section": chunk["section"],
+                "start": chunk["start"],
+                "end": chunk["end"],
+                "score": chunk["score"],
+                "excerpt": chunk["text"][:200],
+            })
+
+        if continuing:
+            new_excerpts = ""
+            if excerpts:
+                new_excerpts = "Additional Machine Manual excerpts:\n" + "\n\n".join(excerpts) + "\n"
+            return f"""
+{new_excerpts}
+Follow-up User Query: {user_query}
+""", "", citations
+
+        manual_text = "\n\n".join(excerpts) if excerpts else "No relevant manual sections found."
 
-    def diagnose(self, anomaly_context: dict, user_query: str, provider: str, config: dict):
-        manual_text = self.get_manual()
-        
         # Prepare Context
         system_context = f"""
 You are an expert industrial machine diagnostician.
-Use the following Machine Manual context to answer the user's request and diagnosing the anomaly.
-        
---- MACHINE MANUAL BEGIN ---
+Use the following Machine Manual excerpts to answer the user's request and diagnosing the anomaly.
+Cite the excerpts you rely on by their reference, e.g. [M1]. If they do not cover the issue, say so.
+
+--- MACHINE MANUAL EXCERPTS BEGIN ---
 {manual_text}
---- MACHINE MANUAL END ---
+--- MACHINE MANUAL EXCERPTS END ---
 """
 
         # Prepare Anomaly Data presentation
@@ -44,27 +161,351 @@ Use the following Machine Manual context to answer the user's request and diagno
             # If it comes from the event list in UI:
             details = anomaly_context.get('details', {})
             
+            signal_data = details if details else anomaly_context.get('value', 'N/A')
+            if context_summary:
+                signal_data = f"\n{context_summary}"
             anomaly_str = f"""
 Detected Anomaly Context:
 - Type/Severity: {anomaly_context.get('type', anomaly_context.get('severity', 'N/A'))}
 - Message/Description: {anomaly_context.get('message', anomaly_context.get('description', 'N/A'))}
-- Signal Data: {details if details else anomaly_context.get('value', 'N/A')}
 - Timestamp: {anomaly_context.get('timestamp', 'N/A')}
+- Signal Data: {signal_data}
 """
 
+        similar_str = f"\n{similar_text}\n" if similar_text else ""
+        history_str = f"\n{history_text}\n" if history_text else ""
         full_user_query = f"""
 {anomaly_str}
-
+{similar_str}{history_str}
 User Query: {user_query}
 
 Provide a diagnosis and suggested steps.
 """
-        
+        return full_user_query, system_context, citations
+
+    def _manual_hash(self) -> str:
+        """Hash of the indexed manual, current with the file (one stat() when unchanged)"""
+        self.sync_manual_index()
+        return manual_index.indexed_manual_hash() or ""
+
+    def _cache_key(self, client, provider: str, anomaly_context: dict, user_query: str, similar: list) -> str:
+        # The conversation history is deliberately not part of the key: the same
+        # question on the same anomaly (again, or in a re-opened chat) is a hit
+        options = {}
+        if similar:
+            # New diagnosed incidents change the prompt
+            options["similar_hash"] = context_hash([(s["id"], s["chat_messages"]) for s in similar])
+        return cache_key(
+            provider,
+            client.model_name,
+            user_query,
+            manual_hash=self._manual_hash(),
+            anomaly_hash=context_hash(anomaly_context),
+            top_k=MANUAL_TOP_K,
+            **options,
+        )
+
+    @staticmethod
+    def _context_summary(anomaly_context: dict, anomaly_id) -> str:
+        """Compact event summary: cached per stored event, else built from the given context"""
+        if not anomaly_context:
+            return ""
+        event_id = anomaly_id or anomaly_context.get("id")
+        try:
+            if event_id:
+                summary = anomaly_context_cache.for_event(event_id, fallback=anomaly_context)
+            elif anomaly_context.get("details"):
+                summary = summarize_event(anomaly_context)
+            else:
+                return ""
+        except Exception as e:
+            logger.warning(f"Anomaly context summary failed, using raw details: {e}")
+            return ""
+        return (summary or {}).get("text", "")
+
+    @staticmethod
+    def _similar_incidents(anomaly_context: dict, anomaly_id, k: int = SIMILAR_INCIDENTS_K):
+        """
+        Returns (prompt section, incidents): the k most similar past anomaly events
+        that have a diagnosis chat, with the question asked and the answer given.
+        """
+        if not anomaly_context or k <= 0:
+            return "", []
+        event_id = anomaly_id or anomaly_context.get("id")
+        try:
+            event = anomaly_context
+            if event_id and not anomaly_context.get("details"):
+                event = get_anomaly_event_by_id(int(event_id)) or anomaly_context
+            neighbours = [
+                n for n in similarity_index.search(event, k=k, exclude_id=event_id, with_chats=True)
+                if n["similarity"] >= SIMILAR_INCIDENTS_MIN
+            ]
+            events = get_anomaly_events_by_ids([n["event_id"] for n in neighbours])
+        except Exception as e:
+            logger.warning(f"Similar incident lookup failed, diagnosing without them: {e}")
+            return "", []
+
+        incidents = []
+        lines = []
+        for n in neighbours:
+            past = events.get(n["event_id"])
+            if past is None:
+                continue
+            chat = get_chat_history(n["event_id"])
+            asked = next((m["content"] for m in chat if m["role"] == "user"), "")
+            answer = next((m["content"] for m in reversed(chat) if m["role"] == "assistant"), "")
+            answer = " ".join(answer.split())
+            if len(answer) > SIMILAR_INCIDENT_CHARS:
+                answer = answer[: SIMILAR_INCIDENT_CHARS - 3].rstrip() + "..."
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(past["timestamp"])) if past["timestamp"] else "n/a"
+            lines.append(
+                f"- Incident #{past['id']} ({when}, {past['type']}, similarity {n['similarity']:.2f}): {past['message']}\n"
+                f"  Asked: {' '.join(asked.split())[:160]}\n"
+                f"  Diagnosis given: {answer}"
+            )
+            incidents.append({**past, "similarity": n["similarity"]})
+        if not lines:
+            return "", []
+        text = "Similar past incidents and how they were diagnosed:\n" + "\n".join(lines)
+        return text, incidents
+
+    @staticmethod
+    def _session_key(client, provider: str) -> tuple:
+        return (provider, getattr(client, "base_url", ""), client.model_name)
+
+    def _prepare(self, client, provider: str, anomaly_context: dict, user_query: str, anomaly_id, use_cache: bool):
+        """
+        Everything before generation (SQLite and retrieval, run off the event loop):
+        chat history, cache lookup, then either a follow-up prompt on the stored
+        provider context or a full prompt with the token-budgeted history.
+        """
+        history = get_chat_history(anomaly_id) if anomaly_id else []
+        similar_text, similar = self._similar_incidents(anomaly_context, anomaly_id)
+        plan = {
+            "key": self._cache_key(client, provider, anomaly_context, user_query, similar),
+            "cached": None,
+            "similar": similar,
+        }
+        if not use_cache:
+            response_cache.count_bypass()
+        else:
+            plan["cached"] = response_cache.get(plan["key"])
+            if plan["cached"] is not None:
+                return plan
+
+        session = None
+        if anomaly_id and client.supports_context:
+            session = chat_sessions.get(anomaly_id, self._session_key(client, provider), len(history))
+        if session is not None:
+            refs = dict(session.refs)
+            # The event summary is already part of the provider context
+            prompt, system_context, citations = self._build_prompt(anomaly_context, user_query, refs=refs)
+            memory = {"context_reused": True, "turns_verbatim": 0, "turns_summarized": 0, "history_tokens": 0}
+        else:
+            refs = {}
+            past = build_history(history)
+            prompt, system_context, citations = self._build_prompt(
+                anomaly_context, user_query, history_text=past["text"], refs=refs,
+                context_summary=self._context_summary(anomaly_context, anomaly_id),
+                similar_text=similar_text,
+            )
+            memory = {
+                "context_reused": False,
+                "turns_verbatim": past["turns_verbatim"],
+                "turns_summarized": past["turns_summarized"],
+                "history_tokens": past["tokens"],
+            }
+        plan.update({
+            "prompt": prompt,
+            "system_context": system_context,
+            "citations": citations,
+            "context": session.context if session is not None else None,
+            "refs": refs,
+            "history_len": len(history),
+            "memory": memory,
+        })
+        return plan
+
+    def _finish(self, plan: dict, client, provider: str, anomaly_id, user_query: str, response: str, stats: dict):
+        """Store the answer in the cache and keep the provider context for the next turn"""
+        if not response or response.startswith(_ERROR_PREFIXES):
+            if anomaly_id:
+                chat_sessions.drop(anomaly_id)
+            return
+        response_cache.put(plan["key"], provider, client.model_name, user_query, response, plan["citations"])
+        if anomaly_id and stats.get("context"):
+            # The router stores this query and answer: the chat grows by two messages
+            chat_sessions.put(anomaly_id, ChatSession(
+                model_key=self._session_key(client, provider),
+                context=stats["context"],
+                history_len=plan["history_len"] + 2,
+                refs=plan["refs"],
+            ))
+
+    @staticmethod
+    def _priority(anomaly_context: dict) -> int:
+        """Scheduling priority from the anomaly severity: critical anomalies first"""
+        context = anomaly_context or {}
+        level = str(context.get("type") or context.get("severity") or "").lower()
+        if level == "critical":
+            return PRIORITY_CRITICAL
+        if level in ("warning", "high"):
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    def _flight_key(self, mode: str, client, provider: str, plan: dict) -> str:
+        """Identical generations (same model, prompt and provider context) run once"""
+        data = json.dumps(
+            [mode, self._session_key(client, provider), plan["prompt"], plan["system_context"], plan["context"]]
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    async def diagnose(
+        self, anomaly_context: dict, user_query: str, provider: str, config: dict,
+        anomaly_id: int = None, use_cache: bool = True,
+    ):
         try:
             client = LLMFactory.get_client(provider, config)
-            response = client.generate(full_user_query, system_context)
-            return {"response": response}
+            plan = await asyncio.to_thread(
+                self._prepare, client, provider, anomaly_context, user_query, anomaly_id, use_cache
+            )
+            cached = plan["cached"]
+            if cached is not None:
+                return {"response": cached["response"], "citations": cached["citations"], "cached": True}
+
+            stats = {}
+
+            async def generate():
+                yield await client.agenerate(
+                    plan["prompt"], plan["system_context"], context=plan["context"], stats=stats
+                )
+
+            flight = llm_scheduler.submit(
+                provider,
+                self._flight_key("generate", client, provider, plan),
+                generate,
+                priority=self._priority(anomaly_context),
+                owner=stats,
+            )
+            response = await flight.result()
+            # A deduplicated request reads the provider state of the shared generation
+            await asyncio.to_thread(
+                self._finish, plan, client, provider, anomaly_id, user_query, response, flight.owner
+            )
+            return {
+                "response": response,
+                "citations": plan["citations"],
+                "cached": False,
+                "memory": plan["memory"],
+                "similar_incidents": plan["similar"],
+                "queue": flight.info(),
+            }
         except Exception as e:
             return {"error": str(e)}
 
+    async def diagnose_stream(
+        self, anomaly_context: dict, user_query: str, provider: str, config: dict,
+        anomaly_id: int = None, use_cache: bool = True,
+    ):
+        """
+        Streaming diagnosis: yields {"type": "meta"} (citations), {"type": "queued"}
+        (queue position) while waiting for a provider slot, then {"type": "token"}
+        events as the provider generates, and finally {"type": "done"} with the
+        assembled response and timing metrics, or {"type": "error"}.
+        A cached response is sent as a single token event.
+        """
+        t_start = time.perf_counter()
+        try:
+            client = LLMFactory.get_client(provider, config)
+            plan = await asyncio.to_thread(
+                self._prepare, client, provider, anomaly_context, user_query, anomaly_id, use_cache
+            )
+        except Exception as e:
+            yield {"type": "error", "error": str(e), "partial_response": ""}
+            return
+        cached = plan["cached"]
+        if cached is not None:
+            yield {"type": "meta", "provider": provider, "citations": cached["citations"], "cached": True}
+            yield {"type": "token", "text": cached["response"]}
+            metrics = {"provider": provider, "cached": True, "total_s": round(time.perf_counter() - t_start, 3)}
+            yield {"type": "done", "response": cached["response"], "citations": cached["citations"], "metrics": metrics}
+            return
+
+        citations = plan["citations"]
+        yield {
+            "type": "meta", "provider": provider, "citations": citations, "cached": False,
+            "memory": plan["memory"], "similar_incidents": plan["similar"],
+        }
+
+        stats = {}
+        flight = llm_scheduler.submit(
+            provider,
+            self._flight_key("stream", client, provider, plan),
+            lambda: client.astream(plan["prompt"], plan["system_context"], context=plan["context"], stats=stats),
+            priority=self._priority(anomaly_context),
+            owner=stats,
+        )
+        t_start = time.perf_counter()
+        t_first = None
+        pieces = []
+        try:
+            async for kind, text in flight.follow():
+                if kind == "queued":
+                    yield {"type": "queued", **text}
+                    continue
+                if t_first is None:
+                    t_first = time.perf_counter()
+                pieces.append(text)
+                yield {"type": "token", "text": text}
+        except Exception as e:
+            logger.error(f"Streaming diagnosis failed ({provider}): {e}")
+            if anomaly_id:
+                chat_sessions.drop(anomaly_id)
+            yield {"type": "error", "error": str(e), "partial_response": "".join(pieces)}
+            return
+
+        t_end = time.perf_counter()
+        # A deduplicated request reads the provider state of the shared generation
+        stats = flight.owner
+        queue = flight.info()
+        # Provider token counts when reported, else the number of streamed pieces
+        tokens = stats.get("tokens") or len(pieces)
+        gen_s = stats.get("eval_duration_s") or ((t_end - t_first) if t_first is not None else None)
+        metrics = {
+            "provider": provider,
+            "cached": False,
+            "time_to_first_token_s": round(t_first - t_start, 3) if t_first is not None else None,
+            "total_s": round(t_end - t_start, 3),
+            "tokens": tokens,
+            "prompt_tokens": stats.get("prompt_tokens"),
+            "tokens_per_s": round(tokens / gen_s, 2) if gen_s else None,
+            "queue_wait_s": queue["wait_s"],
+            "shared": queue["shared_with"] > 0,
+        }
+        self.stream_metrics.append({"timestamp": time.time(), **metrics})
+        logger.info(
+            f"Diagnosis stream ({provider}): TTFT {metrics['time_to_first_token_s']}s, "
+            f"{tokens} tokens, {metrics['tokens_per_s']} tok/s"
+        )
+        response = "".join(pieces)
+        await asyncio.to_thread(self._finish, plan, client, provider, anomaly_id, user_query, response, stats)
+        yield {"type": "done", "response": response, "citations": citations, "metrics": metrics}
+
+    def get_stream_metrics(self):
+        """Recent streaming generations and their median time-to-first-token / throughput"""
+        records = list(self.stream_metrics)
+
+        def median(key):
+            values = sorted(r[key] for r in records if r.get(key) is not None)
+            return values[len(values) // 2] if values else None
+
+        return {
+            "count": len(records),
+            "median_time_to_first_token_s": median("time_to_first_token_s"),
+            "median_tokens_per_s": median("tokens_per_s"),
+            "conversation_memory": chat_sessions.get_stats(),
+            "client_pool": LLMFactory.get_stats(),
+            "recent": records[-20:],
+        }
+
 service = DiagnosisService()
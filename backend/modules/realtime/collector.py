@@ -9,6 +9,7 @@ from typing import Any, Dict, Optional
 
 from .database import save_event, save_sample, get_latest_sample
 from .modbus_client import modbus_source
+from .oee import oee_engine
 from .rules import realtime_rules
 from .config_store import get_config
 
@@ -67,6 +68,7 @@ class RealtimeCollector:
                 # keep shutdown resilient
                 pass
         self._task = None
+        oee_engine.flush()
         try:
             await modbus_source.disconnect()
         except Exception:
@@ -96,6 +98,7 @@ class RealtimeCollector:
                 self.last_error = None
 
                 save_sample(ts, point)
+                oee_engine.update(ts, point)
 
                 for ev in realtime_rules.evaluate(point, ts):
                     save_event(ts, ev.event_type, ev.message, ev.details)
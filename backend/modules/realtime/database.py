@@ -11,10 +11,16 @@ from contextlib import contextmanager
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
+from modules.foundation.long_poll import ChangeFeed
+
 logger = logging.getLogger(__name__)
 
 DB_PATH = Path(__file__).parent / "realtime_data.db"
 
+# Notified on every insert (wakes long-polling /stream and /events requests)
+samples_feed = ChangeFeed()
+events_feed = ChangeFeed()
+
 
 @contextmanager
 def get_db_connection():
@@ -61,6 +67,68 @@ def init_database():
             ON realtime_events(timestamp)
             """
         )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS oee_shifts (
+                shift_start REAL PRIMARY KEY,
+                shift_end REAL NOT NULL,
+                run_s REAL NOT NULL,
+                stop_s REAL NOT NULL,
+                fault_s REAL NOT NULL,
+                offline_s REAL NOT NULL,
+                good REAL NOT NULL,
+                scrap REAL NOT NULL,
+                ideal_s REAL NOT NULL,
+                samples INTEGER NOT NULL,
+                availability REAL,
+                performance REAL,
+                quality REAL,
+                oee REAL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        # Downtime intervals (split at local midnight) and their per-day aggregate
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS downtime_intervals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_ts REAL NOT NULL,
+                end_ts REAL NOT NULL,
+                day TEXT NOT NULL,
+                state TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                device TEXT NOT NULL DEFAULT '',
+                interval_start REAL NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_downtime_intervals_start
+            ON downtime_intervals(start_ts)
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS downtime_daily (
+                day TEXT NOT NULL,
+                state TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                duration_s REAL NOT NULL,
+                PRIMARY KEY (day, state, reason)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS downtime_progress (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+            """
+        )
         conn.commit()
         logger.info(f"Realtime database initialized at {DB_PATH}")
 
@@ -73,7 +141,43 @@ def save_sample(timestamp: float, payload: Dict[str, Any]) -> int:
             (timestamp, json.dumps(payload)),
         )
         conn.commit()
-        return int(cur.lastrowid)
+    samples_feed.notify()
+    return int(cur.lastrowid)
+
+
+def save_samples_bulk(samples: List[Tuple[float, Dict[str, Any]]], skip_duplicates: bool = False) -> int:
+    """
+    Insert many (timestamp, payload) samples in a single transaction. A payload
+    may be a dict or an already serialized JSON object string. With skip_duplicates,
+    samples whose timestamp is already stored for the same "device" payload key
+    (absent for single-machine data), or repeated within the batch, are skipped.
+    Returns the number of rows inserted.
+    """
+    if not samples:
+        return 0
+    if skip_duplicates:
+        sql = """
+            INSERT INTO realtime_samples (timestamp, payload)
+            SELECT ?1, ?2
+            WHERE NOT EXISTS (
+                SELECT 1 FROM realtime_samples
+                WHERE timestamp = ?1
+                  AND json_extract(payload, '$.device') IS json_extract(?2, '$.device')
+            )
+        """
+    else:
+        sql = "INSERT INTO realtime_samples (timestamp, payload) VALUES (?, ?)"
+    with get_db_connection() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            sql,
+            ((ts, payload if isinstance(payload, str) else json.dumps(payload)) for ts, payload in samples),
+        )
+        conn.commit()
+        inserted = conn.total_changes - before
+    if inserted:
+        samples_feed.notify()
+    return inserted
 
 
 def save_event(timestamp: float, event_type: str, message: str, details: Optional[Dict[str, Any]] = None) -> int:
@@ -84,7 +188,8 @@ def save_event(timestamp: float, event_type: str, message: str, details: Optiona
             (timestamp, event_type, message, json.dumps(details or {})),
         )
         conn.commit()
-        return int(cur.lastrowid)
+    events_feed.notify()
+    return int(cur.lastrowid)
 
 
 def get_samples_between(ts_from: float, ts_to: float, limit: int = 50_000) -> List[Dict[str, Any]]:
@@ -108,6 +213,71 @@ def get_samples_between(ts_from: float, ts_to: float, limit: int = 50_000) -> Li
         return out
 
 
+def get_samples_after_id(last_id: int, limit: int = 50_000) -> List[Dict[str, Any]]:
+    """
+    Samples inserted after the given row id (ascending), each with its row "id".
+    Used for incremental consumers that keep a watermark on the sample sequence.
+    """
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, timestamp, payload
+            FROM realtime_samples
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (int(last_id), limit),
+        )
+        out: List[Dict[str, Any]] = []
+        for row in cur.fetchall():
+            payload = json.loads(row["payload"]) if row["payload"] else {}
+            payload["timestamp"] = row["timestamp"]
+            payload["id"] = row["id"]
+            out.append(payload)
+        return out
+
+
+def get_sample_id_before(ts: float) -> int:
+    """Id of the last sample stored before ts (a cursor that starts at ts)."""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT MIN(id) AS first_id FROM realtime_samples WHERE timestamp >= ?", (ts,)).fetchone()
+        if row["first_id"] is not None:
+            return int(row["first_id"]) - 1
+    return get_max_sample_id()
+
+
+def get_latest_samples(limit: int = 5000) -> List[Dict[str, Any]]:
+    """Most recent samples (ascending order), each with its row "id"."""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, timestamp, payload
+            FROM realtime_samples
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        out: List[Dict[str, Any]] = []
+        for row in reversed(cur.fetchall()):
+            payload = json.loads(row["payload"]) if row["payload"] else {}
+            payload["timestamp"] = row["timestamp"]
+            payload["id"] = row["id"]
+            out.append(payload)
+        return out
+
+
+def get_max_sample_id() -> int:
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM realtime_samples")
+        row = cur.fetchone()
+        return int(row["max_id"] or 0)
+
+
 def get_latest_sample() -> Optional[Dict[str, Any]]:
     with get_db_connection() as conn:
         cur = conn.cursor()
@@ -153,6 +323,58 @@ def get_latest_events(limit: int = 100) -> List[Dict[str, Any]]:
         return out
 
 
+def get_events_after_id(last_id: int, limit: int = 500) -> List[Dict[str, Any]]:
+    """Rule events inserted after the given row id (ascending)."""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, timestamp, type, message, details
+            FROM realtime_events
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (int(last_id), limit),
+        )
+        return [
+            {
+                "id": row["id"],
+                "timestamp": row["timestamp"],
+                "type": row["type"],
+                "message": row["message"],
+                "details": json.loads(row["details"]) if row["details"] else {},
+            }
+            for row in cur.fetchall()
+        ]
+
+
+def get_events_between(ts_from: float, ts_to: float, limit: int = 1000) -> List[Dict[str, Any]]:
+    """Rule events in [ts_from, ts_to] (ascending)."""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, timestamp, type, message, details
+            FROM realtime_events
+            WHERE timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp ASC
+            LIMIT ?
+            """,
+            (ts_from, ts_to, limit),
+        )
+        return [
+            {
+                "id": row["id"],
+                "timestamp": row["timestamp"],
+                "type": row["type"],
+                "message": row["message"],
+                "details": json.loads(row["details"]) if row["details"] else {},
+            }
+            for row in cur.fetchall()
+        ]
+
+
 def clear_samples(confirm: bool) -> int:
     if not confirm:
         return 0
@@ -172,3 +394,141 @@ def clear_events(confirm: bool) -> int:
         conn.commit()
         return int(cur.rowcount)
 
+
+OEE_SHIFT_COLUMNS = (
+    "shift_start", "shift_end", "run_s", "stop_s", "fault_s", "offline_s",
+    "good", "scrap", "ideal_s", "samples", "availability", "performance", "quality", "oee", "updated_at",
+)
+
+
+def save_oee_shift(row: Dict[str, Any]):
+    """Insert or update the accumulators and OEE of a shift (keyed by shift_start)."""
+    columns = ", ".join(OEE_SHIFT_COLUMNS)
+    placeholders = ", ".join("?" for _ in OEE_SHIFT_COLUMNS)
+    updates = ", ".join(f"{c} = excluded.{c}" for c in OEE_SHIFT_COLUMNS[1:])
+    with get_db_connection() as conn:
+        conn.execute(
+            f"INSERT INTO oee_shifts ({columns}) VALUES ({placeholders}) "
+            f"ON CONFLICT(shift_start) DO UPDATE SET {updates}",
+            tuple(row.get(c) for c in OEE_SHIFT_COLUMNS),
+        )
+        conn.commit()
+
+
+def get_oee_shift_at(ts: float) -> Optional[Dict[str, Any]]:
+    """The stored shift covering ts (primary key lookup)."""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM oee_shifts WHERE shift_start <= ? ORDER BY shift_start DESC LIMIT 1",
+            (ts,),
+        ).fetchone()
+    if not row or row["shift_end"] <= ts:
+        return None
+    return dict(row)
+
+
+def get_oee_shifts(ts_from: float, ts_to: float, limit: int = 500) -> List[Dict[str, Any]]:
+    """Stored shifts starting in [ts_from, ts_to] (ascending)."""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT * FROM oee_shifts
+            WHERE shift_start >= ? AND shift_start <= ?
+            ORDER BY shift_start ASC
+            LIMIT ?
+            """,
+            (ts_from, ts_to, limit),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def save_downtime_progress(segments: List[Dict[str, Any]], watermark: int, tracker_state: Dict[str, Any]):
+    """
+    Store closed downtime segments, add them to the per-day aggregate and move
+    the tracker watermark, in one transaction (a crash never counts twice).
+    A segment counts as a stop in the aggregate when it starts its interval.
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            """
+            INSERT INTO downtime_intervals (start_ts, end_ts, day, state, reason, device, interval_start)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (s["start_ts"], s["end_ts"], s["day"], s["state"], s["reason"], s["device"], s["interval_start"])
+                for s in segments
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO downtime_daily (day, state, reason, count, duration_s) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(day, state, reason) DO UPDATE SET
+                count = count + excluded.count,
+                duration_s = duration_s + excluded.duration_s
+            """,
+            [
+                (s["day"], s["state"], s["reason"], int(s["start_ts"] == s["interval_start"]), s["end_ts"] - s["start_ts"])
+                for s in segments
+            ],
+        )
+        conn.execute(
+            """
+            INSERT INTO downtime_progress (key, value) VALUES ('tracker', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """,
+            (json.dumps({"watermark": int(watermark), **tracker_state}),),
+        )
+        conn.commit()
+
+
+def get_downtime_progress() -> Dict[str, Any]:
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT value FROM downtime_progress WHERE key = 'tracker'").fetchone()
+    return json.loads(row["value"]) if row else {}
+
+
+def get_downtime_daily(day_from: str, day_to: str) -> List[Dict[str, Any]]:
+    """Downtime per (state, reason) summed over the days in [day_from, day_to] ('YYYY-MM-DD')."""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT state, reason, SUM(count) AS count, SUM(duration_s) AS duration_s
+            FROM downtime_daily
+            WHERE day >= ? AND day <= ?
+            GROUP BY state, reason
+            """,
+            (day_from, day_to),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_downtime_segments(ts_from: float, ts_to: float, limit: int = 100_000) -> List[Dict[str, Any]]:
+    """Downtime segments overlapping [ts_from, ts_to] (a segment never spans more than a day)."""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT start_ts, end_ts, state, reason, device, interval_start
+            FROM downtime_intervals
+            WHERE start_ts >= ? AND start_ts < ? AND end_ts > ?
+            ORDER BY start_ts ASC
+            LIMIT ?
+            """,
+            (ts_from - 86400 - 3600, ts_to, ts_from, limit),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_top_event_between(ts_from: float, ts_to: float) -> Optional[Dict[str, Any]]:
+    """The most severe (then earliest) WARNING/CRITICAL rule event in [ts_from, ts_to]."""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT id, timestamp, type, message
+            FROM realtime_events
+            WHERE timestamp >= ? AND timestamp <= ? AND type IN ('CRITICAL', 'WARNING')
+            ORDER BY CASE type WHEN 'CRITICAL' THEN 0 ELSE 1 END, timestamp ASC
+            LIMIT 1
+            """,
+            (ts_from, ts_to),
+        ).fetchone()
+    return dict(row) if row else None
@@ -0,0 +1,276 @@
+"""
+Downtime analytics - stop/fault intervals and their Pareto by reason.
+
+A background tracker reads the realtime samples stored after its watermark (so
+the collector, file ingestion and restarts are all covered), derives the
+machine state of each one with the OEE engine's rules and opens an interval
+when a device leaves RUN. The interval closes when the device runs again,
+switches between STOP and FAULT, or stops reporting for longer than
+OEE_MAX_GAP_S (the downtime then ends at its last sample).
+
+Reason of an interval: the reason field of its samples (DOWNTIME_REASON_KEY)
+when the PLC reports one, else the most severe rule event (realtime_events)
+raised from DOWNTIME_EVENT_LOOKBACK_S before the interval to its end, else
+"Unspecified stop" / "Unspecified fault".
+
+Closed intervals are stored split at local midnight (downtime_intervals) and
+added to a per-day, per-reason aggregate (downtime_daily) in the transaction
+that moves the watermark. A Pareto over any range reads the aggregate for its
+whole days and the segments only for the partial days at its edges, so a year
+costs a few hundred aggregate rows, never a rescan of the samples.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from .database import (
+    get_downtime_daily,
+    get_downtime_progress,
+    get_downtime_segments,
+    get_samples_after_id,
+    get_top_event_between,
+    save_downtime_progress,
+)
+from .oee import oee_engine
+
+logger = logging.getLogger(__name__)
+
+DOWNTIME_STATES = ("STOP", "FAULT")
+
+
+def _f(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return float(default)
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+def _midnight_after(ts: float) -> float:
+    """First local midnight strictly after ts"""
+    day = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (day + timedelta(days=1)).timestamp()
+
+
+def _midnight_at_or_after(ts: float) -> float:
+    day = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts if day.timestamp() == ts else _midnight_after(ts)
+
+
+def _midnight_at_or_before(ts: float) -> float:
+    return datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def split_by_day(start: float, end: float) -> List[Tuple[float, float, str]]:
+    """[start, end] cut at local midnights: (segment start, segment end, day)"""
+    out = []
+    while start < end:
+        cut = min(end, _midnight_after(start))
+        out.append((start, cut, _day(start)))
+        start = cut
+    return out
+
+
+class DowntimeTracker:
+    def __init__(self):
+        self.tick_s = _f("DOWNTIME_TICK_S", 5.0)
+        self.batch_size = int(_f("DOWNTIME_BATCH", 5000))
+        self.event_lookback_s = _f("DOWNTIME_EVENT_LOOKBACK_S", 60.0)
+        self.min_duration_s = _f("DOWNTIME_MIN_S", 1.0)
+        self.reason_key = os.getenv("DOWNTIME_REASON_KEY", "reason")
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        self._loaded = False
+        self.watermark = 0
+        # device -> open interval {state, start, last_ts, reason}
+        self.open: Dict[str, Dict[str, Any]] = {}
+        # device -> timestamp of its last processed sample
+        self.last_ts: Dict[str, float] = {}
+        self.intervals_closed = 0
+        # Serializes batches; readers use the snapshot published after each commit
+        self._lock = threading.Lock()
+        self._open_snapshot: Dict[str, Dict[str, Any]] = {}
+
+    async def start(self):
+        """
+        Start the tracker loop and return the running task.
+        """
+        if self.running and self._task:
+            return self._task
+        self.running = True
+        self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await asyncio.wait_for(self._task, timeout=2.0)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+            except Exception:
+                # keep shutdown resilient
+                pass
+        self._task = None
+
+    async def _loop(self):
+        logger.info("⏱️ Downtime tracker started")
+        while self.running:
+            try:
+                while self.running and await asyncio.to_thread(self.process_new) >= self.batch_size:
+                    # Catching up (backlog or bulk ingest): no sleep between batches
+                    pass
+            except Exception as e:
+                logger.warning(f"Downtime tracker error: {e}")
+            await asyncio.sleep(self.tick_s)
+
+    def _load(self):
+        if self._loaded:
+            return
+        state = get_downtime_progress()
+        self.watermark = int(state.get("watermark") or 0)
+        self.open = dict(state.get("open") or {})
+        self.last_ts = {k: float(v) for k, v in (state.get("last_ts") or {}).items()}
+        self._publish_open()
+        self._loaded = True
+
+    def _publish_open(self):
+        # A new dict replaces the old one whole: readers never wait for a batch
+        self._open_snapshot = {device: dict(i) for device, i in self.open.items()}
+
+    def process_new(self) -> int:
+        """Derive intervals from the samples stored after the watermark; returns samples read"""
+        with self._lock:
+            self._load()
+            samples = get_samples_after_id(self.watermark, limit=self.batch_size)
+            if not samples:
+                return 0
+            segments: List[Dict[str, Any]] = []
+            for sample in samples:
+                self._observe(sample, segments)
+            self.watermark = samples[-1]["id"]
+            save_downtime_progress(segments, self.watermark, {"open": self.open, "last_ts": self.last_ts})
+            self._publish_open()
+            return len(samples)
+
+    def _observe(self, sample: Dict[str, Any], segments: List[Dict[str, Any]]):
+        ts = float(sample["timestamp"])
+        device = str(sample.get("device") or "")
+        last = self.last_ts.get(device)
+        if last is not None and ts <= last:
+            # Out of order (late ingest of older data): the state timeline has moved on
+            return
+        self.last_ts[device] = ts
+        state = oee_engine.state_of(sample)
+        interval = self.open.get(device)
+
+        if interval and ts - interval["last_ts"] > oee_engine.max_gap_s:
+            # No samples for a while: the downtime is known to last until the last one
+            self._close(device, interval["last_ts"], segments)
+            interval = None
+        if interval and interval["state"] != state:
+            self._close(device, ts, segments)
+            interval = None
+        if state in DOWNTIME_STATES:
+            if interval is None:
+                interval = {"state": state, "start": ts, "last_ts": ts, "reason": None}
+                self.open[device] = interval
+            interval["last_ts"] = ts
+            reason = sample.get(self.reason_key)
+            if reason and not interval["reason"]:
+                interval["reason"] = str(reason)
+
+    def _close(self, device: str, end: float, segments: List[Dict[str, Any]]):
+        interval = self.open.pop(device)
+        start = interval["start"]
+        if end - start < self.min_duration_s:
+            return
+        reason = interval["reason"] or self._reason_from_events(start, end) or f"Unspecified {interval['state'].lower()}"
+        for seg_start, seg_end, day in split_by_day(start, end):
+            segments.append({
+                "start_ts": seg_start,
+                "end_ts": seg_end,
+                "day": day,
+                "state": interval["state"],
+                "reason": reason,
+                "device": device,
+                "interval_start": start,
+            })
+        self.intervals_closed += 1
+
+    def _reason_from_events(self, start: float, end: float) -> Optional[str]:
+        event = get_top_event_between(start - self.event_lookback_s, end)
+        return event["message"] if event and event.get("message") else None
+
+    def pareto(self, ts_from: float, ts_to: float, states: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Downtime per reason in [ts_from, ts_to], longest first, with its share and
+        cumulative share. count is the number of intervals that began in the range.
+        """
+        totals: Dict[Tuple[str, str], List[float]] = {}
+
+        def add(state: str, reason: str, count: float, duration: float):
+            if states and state not in states:
+                return
+            entry = totals.setdefault((state, reason), [0, 0.0])
+            entry[0] += count
+            entry[1] += duration
+
+        # Whole days from the aggregate, the partial days at the edges from the segments
+        first_day, last_day = _midnight_at_or_after(ts_from), _midnight_at_or_before(ts_to)
+        if first_day < last_day:
+            for row in get_downtime_daily(_day(first_day), _day(last_day - 1)):
+                add(row["state"], row["reason"], row["count"], row["duration_s"])
+            edges = [(ts_from, first_day), (last_day, ts_to)]
+        else:
+            edges = [(ts_from, ts_to)]
+        for a, b in edges:
+            if b <= a:
+                continue
+            for seg in get_downtime_segments(a, b):
+                overlap = min(seg["end_ts"], b) - max(seg["start_ts"], a)
+                starts_here = seg["start_ts"] == seg["interval_start"] and a <= seg["start_ts"] < b
+                if overlap > 0 or starts_here:
+                    add(seg["state"], seg["reason"], int(starts_here), max(overlap, 0.0))
+
+        # Intervals still open (as of the last committed batch) count up to their last sample
+        for interval in self._open_snapshot.values():
+            overlap = min(interval["last_ts"], ts_to) - max(interval["start"], ts_from)
+            if overlap > 0:
+                add(interval["state"], interval["reason"] or f"Unspecified {interval['state'].lower()}",
+                    int(ts_from <= interval["start"] <= ts_to), overlap)
+
+        grand_total = sum(d for _, d in totals.values()) or 1.0
+        out, cumulative = [], 0.0
+        for (state, reason), (count, duration) in sorted(totals.items(), key=lambda kv: -kv[1][1]):
+            cumulative += duration
+            out.append({
+                "reason": reason,
+                "state": state,
+                "count": int(count),
+                "duration_s": round(duration, 1),
+                "duration_min": round(duration / 60.0, 1),
+                "share": round(duration / grand_total, 4),
+                "cumulative_share": round(cumulative / grand_total, 4),
+            })
+        return out
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "watermark": self.watermark,
+            "open_intervals": {device: dict(i) for device, i in self._open_snapshot.items()},
+            "intervals_closed": self.intervals_closed,
+        }
+
+
+downtime_tracker = DowntimeTracker()
@@ -0,0 +1,222 @@
+"""
+Bulk ingestion of CSV / Parquet / NDJSON files into realtime_samples.
+
+Files are parsed in chunks, columns are mapped with the XLSX importer's COL_MAP
+(Data/Ora or a single timestamp column, Italian/English signal names, or the
+payload keys themselves), other columns are kept as they are, and each chunk is
+written with one executemany transaction. A device column (device,
+machine, dispositivo, ...) is kept as the payload "device", so multi-machine
+files sharing timestamps are stored per machine. Samples whose (device,
+timestamp) pair is already stored are skipped.
+
+CLI (from backend/):
+    python -m modules.realtime.ingest data/*.csv --chunk-size 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from modules.anomaly_detection.xlsx_importer import SIGNAL_KEYS, frame_to_columns
+
+from .database import save_samples_bulk
+
+logger = logging.getLogger(__name__)
+
+INGEST_FORMATS = ("csv", "parquet", "ndjson")
+DEFAULT_CHUNK_SIZE = 100_000
+
+_EXTENSIONS = {
+    ".csv": "csv",
+    ".txt": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+
+# Normalized column names holding the machine a row belongs to
+DEVICE_COLUMNS = ("device", "device_id", "machine", "machine_id", "dispositivo", "macchina")
+
+
+def detect_format(filename: str) -> str:
+    fmt = _EXTENSIONS.get(Path(filename or "").suffix.lower())
+    if not fmt:
+        raise ValueError(f"Cannot infer format from '{filename}'. Use one of: {', '.join(INGEST_FORMATS)}")
+    return fmt
+
+
+def _sniff_delimiter(file_path: str) -> str:
+    with open(file_path, "r", encoding="utf-8-sig", errors="replace") as f:
+        sample = f.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def find_device_column(frame: pd.DataFrame) -> Optional[str]:
+    normalized = {str(c).strip().lower(): c for c in frame.columns}
+    return next((normalized[c] for c in DEVICE_COLUMNS if c in normalized), None)
+
+
+def _device_groups(frame: pd.DataFrame, device_col: Optional[str]) -> Iterator[Tuple[Optional[str], pd.DataFrame]]:
+    """(device, rows) per machine in the chunk; a single (None, frame) without a device column."""
+    if device_col is None:
+        yield None, frame
+        return
+    keys = frame[device_col].map(lambda d: None if pd.isna(d) else str(d))
+    for device, rows in frame.groupby(keys, sort=False, dropna=False):
+        yield (None if pd.isna(device) else device), rows.drop(columns=device_col)
+
+
+def iter_frames(file_path: str, fmt: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Yield the file as DataFrames of at most chunk_size rows."""
+    if fmt == "csv":
+        yield from pd.read_csv(
+            file_path,
+            sep=_sniff_delimiter(file_path),
+            chunksize=chunk_size,
+            encoding="utf-8-sig",
+            skipinitialspace=True,
+        )
+    elif fmt == "ndjson":
+        yield from pd.read_json(file_path, lines=True, chunksize=chunk_size)
+    elif fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ValueError("Parquet ingestion requires pyarrow (pip install pyarrow)") from e
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'. Use one of: {', '.join(INGEST_FORMATS)}")
+
+
+def payloads_json(columns: Dict[str, np.ndarray], device: Optional[str] = None) -> List[str]:
+    """
+    Sample payloads (same keys as the XLSX import, NaN -> null, then any extra
+    columns, plus "device" when given) serialized in one vectorized pass: per-row
+    json.dumps would dominate the ingest time.
+    """
+    frame = pd.DataFrame({k: columns[k] for k in SIGNAL_KEYS})
+    frame["power"] = columns["power_kw"]
+    for key, values in columns.items():
+        if key != "timestamp" and key not in frame:
+            frame[key] = values
+    if device is not None:
+        frame["device"] = device
+    return frame.to_json(orient="records", lines=True, double_precision=15).splitlines()
+
+
+def ingest_file(
+    file_path: str,
+    fmt: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    electrical_mode: str = "three_phase",
+    skip_duplicates: bool = True,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Stream one file into realtime_samples. Rows without a valid timestamp are
+    counted as invalid; duplicates (by device and timestamp) are skipped when
+    requested.
+    on_progress(rows_read, rows_inserted) is called after every chunk.
+    """
+    fmt = (fmt or detect_format(file_path)).lower()
+    t0 = time.perf_counter()
+    rows_read = 0
+    rows_valid = 0
+    rows_inserted = 0
+    ts_min: Optional[float] = None
+    ts_max: Optional[float] = None
+    detected: Dict[str, str] = {}
+
+    devices = set()
+
+    for frame in iter_frames(file_path, fmt, chunk_size=max(1, chunk_size)):
+        rows_read += len(frame)
+        device_col = find_device_column(frame)
+        samples = []
+        for device, rows in _device_groups(frame, device_col):
+            columns, summary = frame_to_columns(
+                rows, max_rows=len(rows) or 1, electrical_mode=electrical_mode, keep_extra=True
+            )
+            detected = summary.detected_columns or detected
+            if device_col is not None:
+                detected["device"] = device_col
+            if not summary.rows_imported:
+                continue
+            devices.add(device)
+            rows_valid += summary.rows_imported
+            ts_min = summary.timestamp_min if ts_min is None else min(ts_min, summary.timestamp_min)
+            ts_max = summary.timestamp_max if ts_max is None else max(ts_max, summary.timestamp_max)
+            samples.extend(zip(columns["timestamp"].tolist(), payloads_json(columns, device=device)))
+        if samples:
+            rows_inserted += save_samples_bulk(samples, skip_duplicates=skip_duplicates)
+        if on_progress:
+            on_progress(rows_read, rows_inserted)
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "file": Path(file_path).name,
+        "format": fmt,
+        "rows_read": rows_read,
+        "rows_inserted": rows_inserted,
+        "duplicates_skipped": rows_valid - rows_inserted,
+        "rows_invalid": rows_read - rows_valid,
+        "devices": len(devices - {None}),
+        "timestamp_min": ts_min,
+        "timestamp_max": ts_max,
+        "detected_columns": detected,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows_read / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def main():
+    from .database import init_database
+
+    parser = argparse.ArgumentParser(
+        description="Bulk ingest CSV/Parquet/NDJSON files into realtime_samples",
+    )
+    parser.add_argument("paths", nargs="+", help="files or glob patterns")
+    parser.add_argument("--format", choices=INGEST_FORMATS, default=None, help="default: from file extension")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--electrical-mode", choices=("three_phase", "single_phase"), default="three_phase")
+    parser.add_argument("--keep-duplicates", action="store_true", help="insert rows even if the (device, timestamp) pair exists")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    init_database()
+
+    files = sorted({p for pattern in args.paths for p in (glob.glob(pattern) or [pattern])})
+    failed = 0
+    for path in files:
+        try:
+            report = ingest_file(
+                path,
+                fmt=args.format,
+                chunk_size=args.chunk_size,
+                electrical_mode=args.electrical_mode,
+                skip_duplicates=not args.keep_duplicates,
+            )
+            print(json.dumps(report))
+        except Exception as e:
+            failed += 1
+            print(json.dumps({"file": Path(path).name, "error": str(e)}))
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+OEE engine - availability, performance and quality from the sample stream.
+
+Every collector sample advances the accumulators of the current shift, so no
+history is ever rescanned:
+
+- the time since the previous sample is credited to the machine state that
+  sample reported (RUN / STOP / FAULT); gaps longer than OEE_MAX_GAP_S are
+  OFFLINE and do not count as planned time,
+- deltas of the cumulative piece counters add good and scrap pieces (a
+  counter that goes backwards was reset: its new value is the delta),
+- every piece adds its ideal cycle time (60 / ideal rate of the recipe).
+
+    availability = run_s / (run_s + stop_s + fault_s)
+    performance  = ideal_s / run_s          (capped at 1)
+    quality      = good / (good + scrap)
+
+Intervals crossing a shift boundary (OEE_SHIFTS, local start times) are split
+between the two shifts. The current shift is read from memory; shifts are
+persisted (table oee_shifts) when they close and every OEE_PERSIST_S while
+open, so any past shift is a single-row lookup and a restart resumes the
+current one.
+
+Sample fields (names configurable): "state" (RUN/STOP/FAULT or a numeric code
+mapped by OEE_STATE_CODES_JSON), cumulative "produced" / "scrap" counters,
+"speed" (pieces/min, integrated when there is no counter) and "recipe".
+Without a state field the machine is RUN while power_kw >= OEE_RUN_POWER_KW.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from .database import get_oee_shift_at, get_oee_shifts, save_oee_shift
+
+logger = logging.getLogger(__name__)
+
+STATES = ("RUN", "STOP", "FAULT")
+OFFLINE = "OFFLINE"
+STATE_ALIASES = {
+    "RUNNING": "RUN",
+    "PRODUCING": "RUN",
+    "IDLE": "STOP",
+    "STOPPED": "STOP",
+    "ALARM": "FAULT",
+    "ERROR": "FAULT",
+}
+
+
+def _f(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return float(default)
+
+
+def _json_env(name: str, default: Dict[str, Any]) -> Dict[str, Any]:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return dict(default)
+    try:
+        data = json.loads(raw)
+        if isinstance(data, dict):
+            return data
+    except ValueError:
+        pass
+    logger.warning(f"Invalid {name}, using defaults")
+    return dict(default)
+
+
+def _num(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def parse_shifts(raw: str) -> List[int]:
+    """'06:00,14:00,22:00' -> sorted shift start minutes of the day"""
+    starts = set()
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        hours, _, minutes = part.partition(":")
+        starts.add((int(hours) % 24) * 60 + int(minutes or 0) % 60)
+    return sorted(starts) or [0]
+
+
+def shift_bounds(ts: float, starts: List[int]) -> Tuple[float, float]:
+    """(start, end) timestamps of the shift containing ts (local time)"""
+    day = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+    # Boundaries from the last one of the previous day to the first of the next
+    bounds = [day - timedelta(days=1) + timedelta(minutes=starts[-1])]
+    bounds += [day + timedelta(minutes=m) for m in starts]
+    bounds.append(day + timedelta(days=1) + timedelta(minutes=starts[0]))
+    edges = [b.timestamp() for b in bounds]
+    for start, end in zip(edges, edges[1:]):
+        if start <= ts < end:
+            return start, end
+    return edges[-2], edges[-1]
+
+
+@dataclass
+class ShiftTotals:
+    shift_start: float
+    shift_end: float
+    run_s: float = 0.0
+    stop_s: float = 0.0
+    fault_s: float = 0.0
+    offline_s: float = 0.0
+    good: float = 0.0
+    scrap: float = 0.0
+    ideal_s: float = 0.0
+    samples: int = 0
+
+    def add_time(self, state: str, seconds: float):
+        field = f"{state.lower()}_s" if state in STATES else "offline_s"
+        setattr(self, field, getattr(self, field) + seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        planned = self.run_s + self.stop_s + self.fault_s
+        total = self.good + self.scrap
+        availability = self.run_s / planned if planned > 0 else None
+        performance = min(self.ideal_s / self.run_s, 1.0) if self.run_s > 0 else None
+        quality = self.good / total if total > 0 else None
+        oee = None
+        if availability is not None and performance is not None and quality is not None:
+            oee = availability * performance * quality
+        return {
+            **asdict(self),
+            "availability": None if availability is None else round(availability, 4),
+            "performance": None if performance is None else round(performance, 4),
+            "quality": None if quality is None else round(quality, 4),
+            "oee": None if oee is None else round(oee, 4),
+        }
+
+
+def shift_response(row: Dict[str, Any], now: float) -> Dict[str, Any]:
+    """API view of a shift row: adds labels, planned time and oee_percent"""
+    planned = row["run_s"] + row["stop_s"] + row["fault_s"]
+    return {
+        **row,
+        "shift": datetime.fromtimestamp(row["shift_start"]).isoformat(timespec="minutes"),
+        "planned_s": round(planned, 1),
+        "oee_percent": round(row["oee"] * 100, 1) if row.get("oee") is not None else 0,
+        "closed": row["shift_end"] <= now,
+    }
+
+
+class OEEEngine:
+    def __init__(
+        self,
+        persist: bool = True,
+        ideal_rates: Optional[Dict[str, float]] = None,
+        ideal_rate_ppm: Optional[float] = None,
+    ):
+        self.persist = persist
+        self.shift_starts = parse_shifts(os.getenv("OEE_SHIFTS", "06:00,14:00,22:00"))
+        self.max_gap_s = _f("OEE_MAX_GAP_S", 30.0)
+        self.persist_interval_s = _f("OEE_PERSIST_S", 60.0)
+        self.run_power_kw = _f("OEE_RUN_POWER_KW", 1.0)
+        self.ideal_rate_ppm = ideal_rate_ppm if ideal_rate_ppm is not None else _f("OEE_IDEAL_RATE_PPM", 120.0)
+        self.ideal_rates = {
+            str(k): float(v) for k, v in (ideal_rates or _json_env("OEE_IDEAL_RATES_JSON", {})).items()
+        }
+        self.state_codes = {
+            str(k): str(v).upper() for k, v in _json_env("OEE_STATE_CODES_JSON", {"0": "STOP", "1": "RUN", "2": "FAULT"}).items()
+        }
+        self.state_key = os.getenv("OEE_STATE_KEY", "state")
+        self.produced_key = os.getenv("OEE_PRODUCED_KEY", "produced")
+        self.scrap_key = os.getenv("OEE_SCRAP_KEY", "scrap")
+        self.speed_key = os.getenv("OEE_SPEED_KEY", "speed")
+
+        self.shift: Optional[ShiftTotals] = None
+        self.state: Optional[str] = None
+        self.state_since: Optional[float] = None
+        self.recipe: Optional[str] = None
+        self.speed_ppm = 0.0
+        self._last_ts: Optional[float] = None
+        self._counters: Dict[str, float] = {}
+        self._last_persist = 0.0
+        self._lock = threading.Lock()
+
+    def state_of(self, point: Dict[str, Any]) -> Optional[str]:
+        raw = point.get(self.state_key)
+        if raw is not None:
+            if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+                raw = self.state_codes.get(str(int(raw)), "")
+            state = str(raw).strip().upper()
+            state = STATE_ALIASES.get(state, state)
+            return state if state in STATES else None
+        power = _num(point.get("power_kw"))
+        if power is not None:
+            return "RUN" if power >= self.run_power_kw else "STOP"
+        return None
+
+    def _counter_delta(self, key: str, value: Optional[float]) -> Optional[float]:
+        if value is None:
+            return None
+        last = self._counters.get(key)
+        self._counters[key] = value
+        if last is None:
+            return 0.0
+        return value - last if value >= last else value
+
+    def ideal_cycle_s(self, recipe: Optional[str]) -> float:
+        rate = self.ideal_rates.get(recipe or "", self.ideal_rate_ppm)
+        return 60.0 / rate if rate > 0 else 0.0
+
+    def update(self, ts: float, point: Dict[str, Any]):
+        """Advance the accumulators with one sample (samples older than the last are ignored)"""
+        with self._lock:
+            if self._last_ts is not None and ts <= self._last_ts:
+                return
+            if self.shift is None:
+                self.shift = self._open_shift(ts)
+            state = self.state_of(point)
+            if point.get("recipe"):
+                self.recipe = str(point["recipe"])
+
+            # The interval since the previous sample belongs to the previous state
+            dt = ts - self._last_ts if self._last_ts is not None else 0.0
+            if dt > 0:
+                self._credit_time(self._last_ts, ts, self.state if dt <= self.max_gap_s else OFFLINE)
+            self._roll_to(ts)
+
+            good = self._counter_delta("good", _num(point.get(self.produced_key)))
+            scrap = self._counter_delta("scrap", _num(point.get(self.scrap_key)))
+            speed = _num(point.get(self.speed_key))
+            if good is None and speed is not None and 0 < dt <= self.max_gap_s:
+                # No piece counter: integrate the rate reported by the previous sample
+                good = self.speed_ppm * dt / 60.0
+            pieces = (good or 0.0) + (scrap or 0.0)
+            self.shift.good += good or 0.0
+            self.shift.scrap += scrap or 0.0
+            self.shift.ideal_s += pieces * self.ideal_cycle_s(self.recipe)
+            self.shift.samples += 1
+
+            if speed is not None:
+                self.speed_ppm = max(speed, 0.0)
+            elif 0 < dt <= self.max_gap_s:
+                self.speed_ppm = pieces * 60.0 / dt
+            if state != self.state:
+                self.state, self.state_since = state, ts
+            self._last_ts = ts
+
+            if self.persist and ts - self._last_persist >= self.persist_interval_s:
+                self._save(self.shift)
+                self._last_persist = ts
+
+    def _credit_time(self, t0: float, t1: float, state: Optional[str]):
+        """Credit [t0, t1] to state, closing the shifts it runs past"""
+        state = state or OFFLINE
+        while t1 > self.shift.shift_end:
+            if t0 < self.shift.shift_end:
+                self.shift.add_time(state, self.shift.shift_end - t0)
+                t0 = self.shift.shift_end
+            self._roll_to(t0)
+        if t1 > t0:
+            self.shift.add_time(state, t1 - t0)
+
+    def _roll_to(self, ts: float):
+        """Close the current shift (persisting it) if ts is past its end"""
+        if ts < self.shift.shift_end:
+            return
+        if self.persist:
+            self._save(self.shift)
+        self.shift = self._open_shift(ts)
+
+    def _open_shift(self, ts: float) -> ShiftTotals:
+        start, end = shift_bounds(ts, self.shift_starts)
+        if self.persist:
+            # Resume the accumulators persisted before a restart
+            try:
+                row = get_oee_shift_at(ts)
+            except Exception as e:
+                logger.warning(f"Could not load persisted OEE shift: {e}")
+                row = None
+            if row and row["shift_start"] == start:
+                return ShiftTotals(**{k: row[k] for k in ShiftTotals.__dataclass_fields__})
+        return ShiftTotals(shift_start=start, shift_end=end)
+
+    def _save(self, shift: ShiftTotals):
+        try:
+            save_oee_shift({**shift.metrics(), "updated_at": time.time()})
+        except Exception as e:
+            logger.warning(f"Could not persist OEE shift: {e}")
+
+    def flush(self):
+        """Persist the open shift (shutdown)"""
+        with self._lock:
+            if self.persist and self.shift is not None:
+                self._save(self.shift)
+
+    def get_current(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """OEE of the shift containing now, from the in-memory accumulators"""
+        now = time.time() if now is None else now
+        with self._lock:
+            shift = self.shift
+            if shift is None or not (shift.shift_start <= now < shift.shift_end):
+                # No sample in this shift yet
+                start, end = shift_bounds(now, self.shift_starts)
+                shift = ShiftTotals(shift_start=start, shift_end=end)
+            fresh = self._last_ts is not None and now - self._last_ts <= self.max_gap_s
+            return {
+                **shift_response(shift.metrics(), now),
+                "state": self.state if fresh else None,
+                "state_since": self.state_since if fresh else None,
+                "recipe": self.recipe,
+                "speed": round(self.speed_ppm, 1) if fresh else 0.0,
+                "last_sample_ts": self._last_ts,
+            }
+
+    def get_shift(self, at: float) -> Optional[Dict[str, Any]]:
+        """OEE of the shift containing `at`: live if it is the open one, else the stored row"""
+        with self._lock:
+            shift = self.shift
+            if shift is not None and shift.shift_start <= at < shift.shift_end:
+                return shift_response(shift.metrics(), time.time())
+        if not self.persist:
+            return None
+        row = get_oee_shift_at(at)
+        return shift_response(row, time.time()) if row else None
+
+    def get_shifts(self, ts_from: float, ts_to: float, limit: int = 500) -> List[Dict[str, Any]]:
+        """Shifts starting in [ts_from, ts_to]; the open one reflects the latest samples"""
+        now = time.time()
+        rows = {row["shift_start"]: row for row in (get_oee_shifts(ts_from, ts_to, limit) if self.persist else [])}
+        with self._lock:
+            shift = self.shift
+            if shift is not None and ts_from <= shift.shift_start <= ts_to:
+                rows[shift.shift_start] = shift.metrics()
+        return [shift_response(rows[k], now) for k in sorted(rows)][:limit]
+
+
+oee_engine = OEEEngine()
@@ -1,9 +1,25 @@
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
+import os
+import shutil
+import tempfile
 import time
 
 from .collector import collector
-from .database import get_latest_events, get_samples_between, clear_events, clear_samples
+from modules.foundation.long_poll import long_poll
+from .database import (
+    clear_events,
+    clear_samples,
+    events_feed,
+    get_events_after_id,
+    get_latest_events,
+    get_sample_id_before,
+    get_samples_after_id,
+    get_samples_between,
+    samples_feed,
+)
+from .ingest import DEFAULT_CHUNK_SIZE, detect_format, ingest_file
 
 
 router = APIRouter(prefix="/api/realtime", tags=["Realtime"])
@@ -15,17 +31,40 @@ def get_status():
 
 
 @router.get("/stream")
-def get_stream(seconds: int = 60, limit: int = 5000):
+async def get_stream(seconds: int = 60, limit: int = 5000, since: Optional[int] = None, wait: float = 0):
+    """
+    Samples of the last `seconds`. With since (a sample id, as returned in
+    "cursor") only samples stored after it are returned, as {"items", "cursor"};
+    since=0 starts with the last `seconds`. wait > 0 holds the request up to
+    that many seconds until a sample arrives.
+    """
+    limit = max(1, min(int(limit), 50_000))
     now = time.time()
     seconds = max(1, min(int(seconds), 24 * 3600))
-    limit = max(1, min(int(limit), 50_000))
-    return get_samples_between(now - seconds, now, limit=limit)
+    if since is None:
+        return await run_in_threadpool(get_samples_between, now - seconds, now, limit)
+    if since <= 0:
+        since = await run_in_threadpool(get_sample_id_before, now - seconds)
+    items = await long_poll(samples_feed, lambda: get_samples_after_id(since, limit=limit), wait)
+    return {"items": items, "cursor": items[-1]["id"] if items else since}
 
 
 @router.get("/events")
-def get_events(limit: int = 100):
+async def get_events(limit: int = 100, since: Optional[int] = None, wait: float = 0):
+    """
+    Latest rule events (newest first). With since/wait as in /stream, items
+    are oldest first; since=0 starts with the latest `limit` events.
+    """
     limit = max(1, min(int(limit), 500))
-    return get_latest_events(limit=limit)
+    if since is None:
+        return await run_in_threadpool(get_latest_events, limit)
+    if since <= 0:
+        items = list(reversed(await run_in_threadpool(get_latest_events, limit)))
+        if items:
+            return {"items": items, "cursor": items[-1]["id"]}
+        since = 0
+    items = await long_poll(events_feed, lambda: get_events_after_id(since, limit=limit), wait)
+    return {"items": items, "cursor": items[-1]["id"] if items else since}
 
 
 @router.post("/clear")
@@ -43,3 +82,48 @@ def clear(scope: str = Body(default="ui"), confirm: bool = Body(default=False)):
     deleted_events = clear_events(confirm=confirm)
     return {"status": "success", "scope": "db", "deleted_samples": deleted_samples, "deleted_events": deleted_events}
 
+
+
+@router.post("/ingest")
+async def ingest(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(default=None),
+    chunk_size: int = Form(default=DEFAULT_CHUNK_SIZE),
+    electrical_mode: str = Form(default="three_phase"),
+    skip_duplicates: bool = Form(default=True),
+):
+    """
+    Bulk ingest a CSV / Parquet / NDJSON file into the realtime samples store.
+    format defaults to the file extension; a device column is kept as the
+    payload "device", and samples whose (device, timestamp) pair is already
+    stored are skipped unless skip_duplicates=false.
+    """
+    try:
+        fmt = (format or detect_format(file.filename or "")).lower()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    tmp_path = None
+    try:
+        suffix = os.path.splitext(file.filename or "")[1]
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            tmp_path = tmp.name
+            await run_in_threadpool(shutil.copyfileobj, file.file, tmp)
+        report = await run_in_threadpool(
+            ingest_file,
+            tmp_path,
+            fmt=fmt,
+            chunk_size=max(1000, chunk_size),
+            electrical_mode=electrical_mode,
+            skip_duplicates=skip_duplicates,
+        )
+        report["file"] = file.filename
+        return {"status": "success", **report}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Ingest failed: {str(e)}")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.unlink(tmp_path)
+            except Exception:
+                pass
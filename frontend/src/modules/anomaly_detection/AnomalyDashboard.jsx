@@ -1,6 +1,11 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { AlertTriangle, CheckCircle, BrainCircuit, Activity, Play, Settings, Download, Trash2 } from 'lucide-react';
 import { SignalChart } from './SignalChart';
+import { pollSince } from '../foundation/longPoll';
+
+// Points kept for the live charts and events kept in the log (as on the backend)
+const LIVE_POINTS = 1000;
+const LIVE_EVENTS = 50;
 
 // Internal Component for Historical Chart
 const HistoryChart = ({ data, dataKey, color, title, unit, onPointClick }) => {
@@ -31,30 +36,58 @@ export function AnomalyDashboard({ onDiagnose }) {
   const [exportLoading, setExportLoading] = useState(false);
   const [importing, setImporting] = useState(false);
 
-  const fetchData = async () => {
+  // AbortControllers of the running long-polls (points, events)
+  const livePolls = useRef({ points: null, events: null });
+
+  const stopLive = (name) => {
+    livePolls.current[name]?.abort();
+    livePolls.current[name] = null;
+  };
+
+  // (Re)start a long-poll from cursor 0: its first page replaces the local state
+  const startLive = (name, url, onPage) => {
+    stopLive(name);
+    const controller = new AbortController();
+    livePolls.current[name] = controller;
+    pollSince(url, onPage, controller.signal);
+  };
+
+  const startLivePolling = () => {
+    startLive('points', `http://localhost:8000/api/anomaly/stream?limit=${LIVE_POINTS}`, (items, replace) => {
+      setHistoryData((prev) => (replace ? items : [...prev, ...items]).slice(-LIVE_POINTS));
+    });
+    startLive('events', 'http://localhost:8000/api/anomaly/events', (items, replace) => {
+      // Events are newest first
+      setEvents((prev) => (replace ? items : [...items, ...prev]).slice(0, LIVE_EVENTS));
+    });
+  };
+
+  const fetchStatus = async () => {
     try {
-      setLoading(true);
-      const [historyRes, eventsRes, statusRes, statsRes, sourceRes] = await Promise.all([
-        fetch('http://localhost:8000/api/anomaly/stream?limit=1000'), // Fetch large history
-        fetch('http://localhost:8000/api/anomaly/events'),
+      const [statusRes, statsRes, sourceRes] = await Promise.all([
         fetch('http://localhost:8000/api/anomaly/status'),
         fetch('http://localhost:8000/api/anomaly/stats'),
         fetch('http://localhost:8000/api/anomaly/source')
       ]);
 
-      const hData = await historyRes.json();
-      const eventsData = await eventsRes.json();
       const statusData = await statusRes.json();
       const statsData = await statsRes.json();
       const sourceData = await sourceRes.json();
 
-      setHistoryData(hData);
-      setEvents(eventsData);
       setStatus(statusData);
       setStats(statsData.stats);
       setSourceMode(sourceData.mode || 'realtime');
     } catch (e) {
       console.error("Anomaly Module fetch error", e);
+    }
+  };
+
+  // Full resync (after clear/import/source switch, or from the Refresh button)
+  const fetchData = async () => {
+    try {
+      setLoading(true);
+      startLivePolling();
+      await fetchStatus();
     } finally {
         setLoading(false);
     }
@@ -67,6 +100,8 @@ export function AnomalyDashboard({ onDiagnose }) {
       const tsTo = Math.floor(new Date(rangeTo).getTime() / 1000);
       const res = await fetch(`http://localhost:8000/api/anomaly/history?ts_from=${tsFrom}&ts_to=${tsTo}&limit=50000`);
       const data = await res.json();
+      // Keep the stored range on screen: live points resume with Refresh
+      stopLive('points');
       setHistoryData(Array.isArray(data) ? data : []);
       // When loading from DB, we keep existing events list (can be empty)
     } catch (e) {
@@ -179,12 +214,26 @@ export function AnomalyDashboard({ onDiagnose }) {
         method: 'POST',
         body: form
       });
-      const result = await res.json();
-      if (res.ok && result.status === 'success') {
+      const accepted = await res.json();
+      if (!res.ok) {
+        alert(`Import failed: ${accepted.detail || 'Unknown error'}`);
+        return;
+      }
+
+      // The import runs in the background: poll the job until it ends
+      let job = accepted.job;
+      while (!['completed', 'failed', 'cancelled'].includes(job.status)) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobRes = await fetch(`http://localhost:8000/api/anomaly/import/jobs/${accepted.job_id}`);
+        job = await jobRes.json();
+      }
+
+      const result = job.result;
+      if (job.status === 'completed' && result) {
         alert(`✅ Import OK\nRows: ${result.import_summary?.rows_imported}\nLoaded: ${result.points_loaded}\nMode: ${result.mode}`);
         fetchData();
       } else {
-        alert(`Import failed: ${result.detail || 'Unknown error'}`);
+        alert(`Import ${job.status}: ${job.error || 'Unknown error'}`);
       }
     } catch (e) {
       console.error("Import failed", e);
@@ -241,9 +290,13 @@ export function AnomalyDashboard({ onDiagnose }) {
   useEffect(() => {
     fetchData();
     fetchMLAlgorithms();
-    // Refresh history every 10 seconds (less frequent than real-time)
-    const interval = setInterval(fetchData, 10000);
-    return () => clearInterval(interval);
+    // Points and events arrive through the long-polls; status/stats are small and polled
+    const interval = setInterval(fetchStatus, 10000);
+    return () => {
+      clearInterval(interval);
+      stopLive('points');
+      stopLive('events');
+    };
   }, []);
 
   const hasVibration = historyData.some(d => d.vibration !== undefined && d.vibration !== null);
@@ -0,0 +1,46 @@
+// Incremental polling of the backend `since` cursor endpoints (see
+// backend/modules/foundation/long_poll.py). Each request returns only the items
+// after the cursor, and waits up to `waitS` seconds server-side for new ones,
+// so a dashboard receives deltas as they happen instead of re-downloading its
+// whole window on a timer.
+
+export const LONG_POLL_WAIT_S = 25;
+
+const RETRY_DELAY_MS = 5000;
+
+const sleep = (ms, signal) => new Promise((resolve) => {
+  const timer = setTimeout(resolve, ms);
+  signal.addEventListener('abort', () => {
+    clearTimeout(timer);
+    resolve();
+  }, { once: true });
+});
+
+// Poll `url` (which may already carry query params) until `signal` aborts.
+// onPage(items, replace) is called for every non-empty page; replace is true
+// for the first page and whenever the server reports `reset`, meaning the
+// local buffer must be dropped rather than extended.
+export async function pollSince(url, onPage, signal, waitS = LONG_POLL_WAIT_S) {
+  const sep = url.includes('?') ? '&' : '?';
+  let cursor = 0;
+  let first = true;
+  while (!signal.aborted) {
+    try {
+      const wait = first ? 0 : waitS;
+      const res = await fetch(`${url}${sep}since=${cursor}&wait=${wait}`, { signal });
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      const page = await res.json();
+      if (signal.aborted) return;
+      const items = Array.isArray(page.items) ? page.items : [];
+      if (first || page.reset || items.length) {
+        onPage(items, first || !!page.reset);
+      }
+      cursor = page.cursor ?? cursor;
+      first = false;
+    } catch (e) {
+      if (signal.aborted) return;
+      console.error(`Long poll ${url} failed`, e);
+      await sleep(RETRY_DELAY_MS, signal);
+    }
+  }
+}
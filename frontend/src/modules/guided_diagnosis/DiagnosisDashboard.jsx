@@ -15,6 +15,7 @@ export function DiagnosisDashboard({ initialAnomaly }) {
     { role: 'system', content: 'Hello. I am your AI Diagnostic Assistant. How can I help you today?' }
   ]);
   const [analyzing, setAnalyzing] = useState(false);
+  const [queuePosition, setQueuePosition] = useState(0);
   const [currentAnomaly, setCurrentAnomaly] = useState(null);
   
   // Use ref to track if we're already processing to prevent double execution in React StrictMode
@@ -49,6 +50,56 @@ export function DiagnosisDashboard({ initialAnomaly }) {
     }
   }, [initialAnomaly]);
 
+  // Stream the diagnosis (NDJSON events) into a growing assistant message
+  const streamDiagnosis = async (payload) => {
+      const res = await fetch('http://localhost:8000/api/diagnosis/analyze/stream', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(payload)
+      });
+      if (!res.ok || !res.body) {
+          throw new Error(`HTTP ${res.status}`);
+      }
+
+      setChatHistory(prev => [...prev, { role: 'assistant', content: '' }]);
+      const appendToken = (text) => {
+          setChatHistory(prev => {
+              const last = prev[prev.length - 1];
+              return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+          });
+      };
+
+      setQueuePosition(0);
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split('\n');
+          buffer = lines.pop();
+          for (const line of lines) {
+              if (!line.trim()) continue;
+              const event = JSON.parse(line);
+              if (event.type === 'token') {
+                  setQueuePosition(0);
+                  appendToken(event.text);
+              } else if (event.type === 'queued') {
+                  // Waiting for a free LLM slot (other diagnoses running)
+                  setQueuePosition(event.position);
+              } else if (event.type === 'error') {
+                  // Drop the assistant message if nothing was generated
+                  setChatHistory(prev => {
+                      const last = prev[prev.length - 1];
+                      const kept = last.role === 'assistant' && !last.content ? prev.slice(0, -1) : prev;
+                      return [...kept, { role: 'system', content: `Error: ${event.error}` }];
+                  });
+              }
+          }
+      }
+  };
+
   const handleAutoDiagnose = async (anomaly) => {
       const autoQuery = "Analyze the detected anomaly and suggest immediate actions based on the manual.";
       const userMsg = { role: 'user', content: autoQuery };
@@ -63,18 +114,7 @@ export function DiagnosisDashboard({ initialAnomaly }) {
               anomaly_context: anomaly
           };
   
-          const res = await fetch('http://localhost:8000/api/diagnosis/analyze', {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify(payload)
-          });
-          
-          const data = await res.json();
-          if (data.error) {
-              setChatHistory(prev => [...prev, { role: 'system', content: `Error: ${data.error}` }]);
-          } else {
-              setChatHistory(prev => [...prev, { role: 'assistant', content: data.response }]);
-          }
+          await streamDiagnosis(payload);
       } catch (e) {
           setChatHistory(prev => [...prev, { role: 'system', content: "Failed to communicate with diagnosis service." }]);
       } finally {
@@ -149,18 +189,7 @@ export function DiagnosisDashboard({ initialAnomaly }) {
         anomaly_context: currentAnomaly
       };
 
-      const res = await fetch('http://localhost:8000/api/diagnosis/analyze', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload)
-      });
-      
-      const data = await res.json();
-      if (data.error) {
-          setChatHistory(prev => [...prev, { role: 'system', content: `Error: ${data.error}` }]);
-      } else {
-          setChatHistory(prev => [...prev, { role: 'assistant', content: data.response }]);
-      }
+      await streamDiagnosis(payload);
     } catch (e) {
       setChatHistory(prev => [...prev, { role: 'system', content: "Failed to communicate with diagnosis service." }]);
     } finally {
@@ -258,7 +287,7 @@ export function DiagnosisDashboard({ initialAnomaly }) {
                     </div>
                   </div>
                 ))}
-                {analyzing && <div style={{ display: 'flex', alignItems: 'center', gap: '0.5rem', padding: '1rem' }}><Loader className="spin" /> Analyzing...</div>}
+                {analyzing && <div style={{ display: 'flex', alignItems: 'center', gap: '0.5rem', padding: '1rem' }}><Loader className="spin" /> {queuePosition > 0 ? `Queued (position ${queuePosition})...` : 'Analyzing...'}</div>}
              </div>
              
              <div style={{ padding: '1rem', borderTop: '1px solid var(--border)', display: 'flex', gap: '1rem' }}>
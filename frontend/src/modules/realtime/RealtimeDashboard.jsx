@@ -1,24 +1,43 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { AlertTriangle, CheckCircle, PlugZap } from 'lucide-react';
+import { pollSince } from '../foundation/longPoll';
+
+// Alerts kept in the table
+const LIVE_EVENTS = 100;
 
 export function RealtimeDashboard() {
   const [rtStatus, setRtStatus] = useState(null);
   const [events, setEvents] = useState([]);
   const [loading, setLoading] = useState(false);
 
-  const fetchRealtime = async () => {
+  const eventsPoll = useRef(null);
+
+  // (Re)start the alerts long-poll: the first page holds the latest alerts,
+  // the next ones only the alerts stored since (oldest first)
+  const startEventsPoll = () => {
+    eventsPoll.current?.abort();
+    const controller = new AbortController();
+    eventsPoll.current = controller;
+    pollSince(`http://localhost:8000/api/realtime/events?limit=${LIVE_EVENTS}`, (items, replace) => {
+      const newestFirst = [...items].reverse();
+      setEvents((prev) => (replace ? newestFirst : [...newestFirst, ...prev]).slice(0, LIVE_EVENTS));
+    }, controller.signal);
+  };
+
+  const fetchStatus = async () => {
     try {
-      setLoading(true);
-      const [sRes, eRes] = await Promise.all([
-        fetch('http://localhost:8000/api/realtime/status'),
-        fetch('http://localhost:8000/api/realtime/events?limit=100')
-      ]);
-      const s = await sRes.json();
-      const e = await eRes.json();
-      setRtStatus(s);
-      setEvents(Array.isArray(e) ? e : []);
+      const sRes = await fetch('http://localhost:8000/api/realtime/status');
+      setRtStatus(await sRes.json());
     } catch (err) {
       console.error('Realtime fetch failed', err);
+    }
+  };
+
+  const fetchRealtime = async () => {
+    try {
+      setLoading(true);
+      startEventsPoll();
+      await fetchStatus();
     } finally {
       setLoading(false);
     }
@@ -26,8 +45,11 @@ export function RealtimeDashboard() {
 
   useEffect(() => {
     fetchRealtime();
-    const t = setInterval(fetchRealtime, 2000);
-    return () => clearInterval(t);
+    const t = setInterval(fetchStatus, 2000);
+    return () => {
+      clearInterval(t);
+      eventsPoll.current?.abort();
+    };
   }, []);
 
   const connected = !!rtStatus?.connected;